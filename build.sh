@@ -20,7 +20,7 @@ aws s3 cp datahub_etl/sites.json s3://dantelore.data.lake/weather_stations/sites
 echo "Building the Weather Data Modeller"
 mkdir build
 
-cp weather_data_model/lambda_function.py build
+cp -Rf weather_data_model build
 cp -Rf helpers build
 
 (
@@ -4,18 +4,19 @@ import requests
 import os
 import csv
 import json
-import gzip
 from urllib.parse import urljoin
 from bs4 import BeautifulSoup
 from datetime import datetime
 
 from helpers.aws import load_file_to_s3
+from helpers.quantile_sketch import MonthlySiteSketches
 from ceda_auth_helpers import setup_credentials, CREDENTIALS_FILE_PATH, CERTS_DIR
 
 LOCAL_FILE_STORE = "weatherData/midas"
 ROOT_URL = "https://dap.ceda.ac.uk/badc/ukmo-midas-open/data/uk-hourly-weather-obs/dataset-version-202107/"
 S3_RAW_BUCKET = "dantelore.data.raw"
 S3_INCOMING_BUCKET = "dantelore.data.incoming"
+S3_LAKE_BUCKET = "dantelore.data.lake"
 S3_BASE_KEY = "midas"
 VERSION_ID = "qc-version-1"
 
@@ -42,12 +43,9 @@ def save_file(response, url):
 def save_gzipped_file_to_s3(bucket, local_file):
     dirs = local_file[len(LOCAL_FILE_STORE):].split('/')[:-1]
 
-    zipped_file = local_file + ".gz"
-    with open(local_file, 'rb') as f_in, gzip.open(zipped_file, 'wb') as f_out:
-        f_out.writelines(f_in)
-
-    raw_s3_key = os.path.join(S3_BASE_KEY, *dirs, zipped_file.rsplit('/', 1)[-1])
-    load_file_to_s3(zipped_file, bucket, raw_s3_key)
+    # Compressed on the way up, so no .gz copy is written locally
+    raw_s3_key = os.path.join(S3_BASE_KEY, *dirs, local_file.rsplit('/', 1)[-1] + ".gz")
+    load_file_to_s3(local_file, bucket, raw_s3_key, compress=True)
 
 
 def fetch_data(url):
@@ -115,6 +113,8 @@ def extract_data(csv_filename):
 
     json_filename = os.path.join(json_dir, csv_filename.split('/')[-1].replace('.csv', '.json'))
 
+    sketches = MonthlySiteSketches()
+
     print("Writing JSON to " + json_filename)
     with open(json_filename, "w") as f:
         for row in csv.DictReader(csv_lines):
@@ -122,6 +122,11 @@ def extract_data(csv_filename):
             output_row = {key: val for key, val in {**data, **row}.items() if val != 'NA'}
             json_line = json.dumps(output_row)
             f.write(json_line + "\n")
+            sketches.add(output_row.get("src_id"), data.get("observation_station"), data.get("lat"), data.get("lon"),
+                         output_row.get("ob_time"), output_row.get("air_temperature"))
+
+    # Each file holds a whole station-year, so its site-month sketches replace any from an earlier run
+    sketches.save(S3_LAKE_BUCKET, "midas", replace=True)
     return json_filename
 
 
@@ -137,8 +142,6 @@ def do_process_data_file(response, url):
         json_file = extract_data(raw_data_file)
         if json_file:
             save_gzipped_file_to_s3(S3_INCOMING_BUCKET, json_file)
-
-            # Zipped copies will remain
             os.remove(json_file)
         os.remove(raw_data_file)
 
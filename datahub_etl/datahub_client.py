@@ -1,27 +1,77 @@
 import requests
 import time
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+def _retry_after_seconds(response, default):
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return default
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
+
+
+def _create_session(pool_size):
+    # All requests go to one host, so a single pool sized to the number of workers
+    # lets every worker keep its own connection alive between sites.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive"
+    })
+    return session
 
 
 class DataHubClient:
-    def __init__(self, api_key, base_url="https://data.hub.api.metoffice.gov.uk/observation-land/1"):
+    def __init__(self, api_key, base_url="https://data.hub.api.metoffice.gov.uk/observation-land/1",
+                 rate_limiter=None, pool_size=10, session=None):
         self.api_key = api_key
         self.base_url = base_url
+        self.rate_limiter = rate_limiter
+        self.session = session or _create_session(pool_size)
 
     def get_headers(self):
         return {"apikey": self.api_key}
 
+    def close(self):
+        self.session.close()
+
     def _request_with_backoff(self, url, params=None, max_retries=3):
         for attempt in range(max_retries):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+
             try:
-                response = requests.get(url, headers=self.get_headers(), params=params)
+                response = self.session.get(url, headers=self.get_headers(), params=params)
                 response.raise_for_status()
                 return response.json()
             except requests.exceptions.HTTPError as e:
                 if e.response.status_code == 429:
+                    wait_time = _retry_after_seconds(e.response, default=(2 ** attempt) * 1)
+
+                    # Hold back every worker sharing the limiter, not just this one
+                    if self.rate_limiter:
+                        self.rate_limiter.pause(wait_time)
+
                     if attempt < max_retries - 1:
-                        wait_time = (2 ** attempt) * 1
                         print(f"Rate limit hit, waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
-                        time.sleep(wait_time)
+                        if not self.rate_limiter:
+                            time.sleep(wait_time)
                         continue
                 raise
 
@@ -1,49 +1,94 @@
 from helpers.aws import load_file_to_s3, add_glue_partition_for
+from helpers.quantile_sketch import MonthlySiteSketches
+import os
+import time
 from datetime import datetime
-from .weather_etl import extract_observations_data, transform_observations_data
+from .weather_etl import GeohashCacheUpdates, extract_observations_data, save_ingest_state
 from .datahub_client import DataHubClient
+from .rate_limiter import RateLimiter
+from .warm_state import WARM_STATE
 from .api_key import API_KEY
 
 INPUT_FILE = "/tmp/weather_data.json"
 OUTPUT_FILE = "/tmp/observations.json"
 S3_INCOMING_BUCKET = "dantelore.data.incoming"
 S3_RAW_BUCKET = "dantelore.data.raw"
+S3_LAKE_BUCKET = "dantelore.data.lake"
 S3_CACHE_KEY = "weather_cache/geohash_cache.json"
 ATHENA_DATABASE = "incoming"
 ATHENA_TABLE = "weather"
 ATHENA_RESULTS_BUCKET = "dantelore.queryresults"
+MAX_WORKERS = 8
+DAILY_REQUEST_QUOTA = 360
+RUNS_PER_DAY = 24
+REQUESTS_PER_SECOND = 2
+WATERMARK_OVERLAP_HOURS = 1
+UPLOAD_SAFETY_MARGIN_SECONDS = 60
+# With partition projection on incoming.weather, Athena finds new days itself
+PARTITION_PROJECTION = os.environ.get("INCOMING_PARTITION_PROJECTION", "false").lower() == "true"
+
+CLIENT_TTL_SECONDS = 6 * 3600
+
+
+def _get_client():
+    # Kept in warm state so warm invocations reuse the pooled connections
+    client = WARM_STATE.get("datahub_client")
+    if client is None:
+        client = DataHubClient(API_KEY, pool_size=MAX_WORKERS)
+        WARM_STATE.put("datahub_client", client, ttl_seconds=CLIENT_TTL_SECONDS)
+    return client
+
+
+def _get_deadline(context):
+    # Leave time for the S3 uploads and Glue partition after the last site is fetched
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    remaining_seconds = context.get_remaining_time_in_millis() / 1000
+    return time.monotonic() + remaining_seconds - UPLOAD_SAFETY_MARGIN_SECONDS
 
 
 def handler(event, context):
     today = datetime.today()
-    client = DataHubClient(API_KEY)
+    deadline = _get_deadline(context)
+    client = _get_client()
+    client.rate_limiter = RateLimiter.for_daily_quota(DAILY_REQUEST_QUOTA, runs_per_day=RUNS_PER_DAY,
+                                                      requests_per_second=REQUESTS_PER_SECOND)
 
-    has_data = extract_observations_data(INPUT_FILE, client, s3_bucket=S3_RAW_BUCKET, s3_cache_key=S3_CACHE_KEY)
+    # Raw and transformed files are written in a single pass, transform_observations_data is kept for replay
+    sketches = MonthlySiteSketches()
+    cache_updates = GeohashCacheUpdates()
+    has_data = extract_observations_data(INPUT_FILE, client, s3_bucket=S3_RAW_BUCKET, s3_cache_key=S3_CACHE_KEY,
+                                         max_workers=MAX_WORKERS, output_filename=OUTPUT_FILE,
+                                         watermark_overlap_hours=WATERMARK_OVERLAP_HOURS, deadline=deadline,
+                                         sketches=sketches, cache_updates=cache_updates)
 
     if not has_data:
-        print("No observations extracted. Skipping transform and upload.")
+        # No new observations, so no watermark moved past anything unsaved
+        cache_updates.save()
+        print("No observations extracted. Skipping upload.")
         return {"statusCode": 200, "message": "No data extracted"}
 
     save_raw_data_to_s3(today)
 
-    try:
-        transform_observations_data(INPUT_FILE, OUTPUT_FILE)
-    except Exception as e:
-        print("Failed to transform data. Corrupt response from API?")
-        print(e)
-        return {"statusCode": 500}
-
     hour_prefix = today.strftime("%Y-%m-%d-%H")
-    s3_key = f"weather/year={today.year}/month={today.month}/day={today.day}/observations-{hour_prefix}.json"
+    s3_key = f"weather/year={today.year}/month={today.month}/day={today.day}/observations-{hour_prefix}.json.gz"
+
+    # Athena reads gzipped JSON transparently, going by the .gz extension
+    load_file_to_s3(OUTPUT_FILE, S3_INCOMING_BUCKET, s3_key, compress=True)
+    if not PARTITION_PROJECTION:
+        add_glue_partition_for(today.year, today.month, today.day, ATHENA_TABLE, ATHENA_DATABASE,
+                               ATHENA_RESULTS_BUCKET)
 
-    load_file_to_s3(OUTPUT_FILE, S3_INCOMING_BUCKET, s3_key)
-    add_glue_partition_for(today.year, today.month, today.day, ATHENA_TABLE, ATHENA_DATABASE, ATHENA_RESULTS_BUCKET)
+    # The new watermarks are only saved once the observations behind them are in S3,
+    # so if anything above fails the next run fetches them again. The per site-month
+    # temperature sketches follow, only if the watermarks were saved.
+    save_ingest_state(cache_updates, sketches, S3_LAKE_BUCKET, "datahub")
 
     return {"statusCode": 200, "message": "Success"}
 
 
 def save_raw_data_to_s3(today):
     hour_prefix = today.strftime("%Y-%m-%d-%H")
-    raw_s3_key = f"weather/{today.year}/{today.month}/{today.day}/raw-{hour_prefix}.json"
+    raw_s3_key = f"weather/{today.year}/{today.month}/{today.day}/raw-{hour_prefix}.json.gz"
     print(f"Writing raw data to: s3://{S3_RAW_BUCKET}/{raw_s3_key}")
-    load_file_to_s3(INPUT_FILE, S3_RAW_BUCKET, raw_s3_key)
+    load_file_to_s3(INPUT_FILE, S3_RAW_BUCKET, raw_s3_key, compress=True)
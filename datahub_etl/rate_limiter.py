@@ -0,0 +1,71 @@
+import threading
+import time
+
+
+class QuotaExhaustedError(Exception):
+    pass
+
+
+class RateLimiter:
+    """Token bucket shared by every worker using a DataHubClient.
+
+    Each request takes a token, tokens refill at requests_per_second up to burst.
+    pause() holds back all callers together, e.g. for a 429's Retry-After, and
+    request_budget caps the number of requests made through the limiter.
+    """
+
+    def __init__(self, requests_per_second=None, burst=1, request_budget=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.requests_per_second = requests_per_second
+        self.burst = max(1, burst)
+        self.request_budget = request_budget
+        self.requests_made = 0
+
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._last_refill = clock()
+        self._paused_until = 0.0
+
+    @classmethod
+    def for_daily_quota(cls, daily_quota, runs_per_day=24, requests_per_second=None, burst=1):
+        return cls(requests_per_second=requests_per_second, burst=burst,
+                   request_budget=max(1, daily_quota // runs_per_day))
+
+    @property
+    def remaining(self):
+        if self.request_budget is None:
+            return None
+        return max(0, self.request_budget - self.requests_made)
+
+    def _refill(self, now):
+        if self.requests_per_second:
+            elapsed = now - self._last_refill
+            self._tokens = min(self.burst, self._tokens + elapsed * self.requests_per_second)
+        else:
+            self._tokens = float(self.burst)
+        self._last_refill = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if self.request_budget is not None and self.requests_made >= self.request_budget:
+                    raise QuotaExhaustedError(f"Request budget of {self.request_budget} used up for this run")
+
+                now = self._clock()
+                self._refill(now)
+                wait_time = self._paused_until - now
+
+                if wait_time <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self.requests_made += 1
+                        return
+                    wait_time = (1 - self._tokens) / self.requests_per_second
+
+            self._sleep(wait_time)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
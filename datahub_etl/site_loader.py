@@ -1,46 +1,94 @@
-import csv
-import io
-from typing import List, Dict
-
-_SITES_CACHE = None
-
-
-def _parse_s3_location(s3_url: str) -> tuple[str, str]:
-    parts = s3_url.split('/')
-    bucket = parts[2]
-    key = '/'.join(parts[3:])
-    return bucket, key
-
-
-def _parse_sites_csv(csv_content: str) -> List[Dict]:
-    sites = []
-    reader = csv.DictReader(io.StringIO(csv_content))
-    for row in reader:
-        sites.append({
-            'site_id': row['site_id'],
-            'site_name': row['site_name'],
-            'site_country': row['site_country'],
-            'site_elevation': float(row['site_elevation']),
-            'lat': float(row['lat']),
-            'lon': float(row['lon'])
-        })
-    return sites
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from .site_registry import Site, SiteRegistry
+from .warm_state import WARM_STATE
+
+SITES_CACHE_KEY = "sites"
+SITES_CACHE_TTL_SECONDS = 24 * 3600
+
+SITES_SNAPSHOT_FILE = "/tmp/sites_snapshot.json"
+SITES_SNAPSHOT_MAX_AGE_SECONDS = 24 * 3600
+SITES_S3_BUCKET = "dantelore.data.lake"
+SITES_S3_KEY = "weather_stations/sites.json"
+BUNDLED_SITES_FILE = os.path.join(os.path.dirname(__file__), "sites.json")
+
+_refresh_lock = threading.Lock()
+
+
+def _parse_sites_ndjson(content: str) -> SiteRegistry:
+    return SiteRegistry(json.loads(line) for line in content.splitlines() if line.strip())
+
+
+def load_sites_snapshot(snapshot_file: str = SITES_SNAPSHOT_FILE) -> Optional[Dict]:
+    """Read the local snapshot: {"version", "saved_at", "source", "sites"}, or None if missing or unreadable."""
+    try:
+        with open(snapshot_file, 'r') as f:
+            snapshot = json.load(f)
+        if snapshot.get("sites"):
+            return snapshot
+    except (OSError, ValueError) as e:
+        if os.path.exists(snapshot_file):
+            print(f"Ignoring unreadable site snapshot {snapshot_file}: {e}")
+    return None
+
+
+def save_sites_snapshot(sites: Iterable, version: Optional[str], source: str,
+                        snapshot_file: str = SITES_SNAPSHOT_FILE) -> None:
+    snapshot = {
+        "version": version,
+        "saved_at": time.time(),
+        "source": source,
+        "sites": [Site.from_dict(site).to_dict() for site in sites]
+    }
+    temp_file = f"{snapshot_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+    os.replace(temp_file, snapshot_file)
+
+
+def _snapshot_is_fresh(snapshot: Dict, max_age_seconds: float) -> bool:
+    return time.time() - snapshot.get("saved_at", 0) < max_age_seconds
+
+
+def load_sites_from_s3(s3_bucket: str = SITES_S3_BUCKET, s3_key: str = SITES_S3_KEY,
+                       known_version: Optional[str] = None):
+    """Load the sites.json that build.sh uploads, returning (sites, etag).
+
+    If the object's ETag matches known_version, sites is None and nothing is downloaded.
+    """
+    from helpers.aws import get_s3_etag, load_text_from_s3
+
+    etag = get_s3_etag(s3_bucket, s3_key)
+    if etag is None or etag == known_version:
+        return None, etag
+
+    content = load_text_from_s3(s3_bucket, s3_key)
+    if not content:
+        return None, None
+    return _parse_sites_ndjson(content), etag
+
+
+def load_bundled_sites(sites_file: str = BUNDLED_SITES_FILE) -> SiteRegistry:
+    with open(sites_file, 'r') as f:
+        return _parse_sites_ndjson(f.read())
 
 
 def load_sites_from_athena(
     database: str = "lake",
     results_bucket: str = "dantelore.queryresults",
     wait_seconds: int = 30
-) -> List[Dict]:
-    global _SITES_CACHE
-
-    if _SITES_CACHE is not None:
-        print(f"Using cached site data ({len(_SITES_CACHE)} sites)")
-        return _SITES_CACHE
+) -> SiteRegistry:
+    cached_sites = WARM_STATE.get(SITES_CACHE_KEY)
+    if cached_sites is not None:
+        print(f"Using cached site data ({len(cached_sites)} sites)")
+        return cached_sites
 
     print("Loading site data from Athena...")
 
-    from helpers.aws import execute_athena_query, load_text_from_s3
+    from helpers.aws import execute_athena_query, read_athena_results
 
     sql = """
     SELECT site_id, site_name, site_country, site_elevation, lat, lon
@@ -49,22 +97,105 @@ def load_sites_from_athena(
     """
 
     output_location = execute_athena_query(sql, database, results_bucket, wait_seconds)
-    bucket, key = _parse_s3_location(output_location)
-    csv_content = load_text_from_s3(bucket, key)
-    sites = _parse_sites_csv(csv_content)
+    if output_location is None:
+        raise RuntimeError("Athena query for sites failed")
+    sites = SiteRegistry(read_athena_results(output_location))
 
-    _SITES_CACHE = sites
+    WARM_STATE.put(SITES_CACHE_KEY, sites, ttl_seconds=SITES_CACHE_TTL_SECONDS)
     print(f"Loaded {len(sites)} sites from Athena")
     return sites
 
 
+def refresh_sites_snapshot(
+    database: str = "lake",
+    results_bucket: str = "dantelore.queryresults",
+    snapshot_file: str = SITES_SNAPSHOT_FILE,
+    s3_bucket: str = SITES_S3_BUCKET,
+    s3_key: str = SITES_S3_KEY,
+    known_version: Optional[str] = None
+) -> Optional[SiteRegistry]:
+    """Refresh the local snapshot from S3, falling back to an Athena query. Returns the sites, or None."""
+    try:
+        sites, version = load_sites_from_s3(s3_bucket, s3_key, known_version)
+        if sites:
+            save_sites_snapshot(sites, version, "s3", snapshot_file)
+            print(f"Loaded {len(sites)} sites from S3://{s3_bucket}/{s3_key}")
+            return SiteRegistry.from_sites(sites)
+        if version is not None and version == known_version:
+            snapshot = load_sites_snapshot(snapshot_file)
+            if snapshot:
+                save_sites_snapshot(snapshot["sites"], version, snapshot.get("source", "s3"), snapshot_file)
+                print(f"Site snapshot is current with S3://{s3_bucket}/{s3_key}")
+                return SiteRegistry(snapshot["sites"])
+    except Exception as e:
+        print(f"Could not load sites from S3: {e}")
+
+    try:
+        WARM_STATE.invalidate(SITES_CACHE_KEY)
+        sites = load_sites_from_athena(database, results_bucket)
+        save_sites_snapshot(sites, f"athena:{int(time.time())}", "athena", snapshot_file)
+        return SiteRegistry.from_sites(sites)
+    except Exception as e:
+        print(f"Could not load sites from Athena: {e}")
+
+    return None
+
+
+def _refresh_in_background(**kwargs) -> None:
+    if not _refresh_lock.acquire(blocking=False):
+        return
+
+    def refresh():
+        try:
+            sites = refresh_sites_snapshot(**kwargs)
+            if sites:
+                WARM_STATE.put(SITES_CACHE_KEY, sites, ttl_seconds=SITES_CACHE_TTL_SECONDS)
+        finally:
+            _refresh_lock.release()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
 def get_sites(
     database: str = "lake",
-    results_bucket: str = "dantelore.queryresults"
-) -> List[Dict]:
-    return load_sites_from_athena(database, results_bucket)
+    results_bucket: str = "dantelore.queryresults",
+    snapshot_file: str = SITES_SNAPSHOT_FILE,
+    s3_bucket: str = SITES_S3_BUCKET,
+    s3_key: str = SITES_S3_KEY,
+    max_age_seconds: float = SITES_SNAPSHOT_MAX_AGE_SECONDS
+) -> SiteRegistry:
+    """Return the site list from the cheapest source that has it.
+
+    In order: sites kept warm in this container, a fresh local snapshot, a stale local
+    snapshot (refreshed in the background), the sites.json in S3, an Athena query, and
+    finally the sites.json bundled with the code.
+    """
+    cached_sites = WARM_STATE.get(SITES_CACHE_KEY)
+    if cached_sites is not None:
+        return cached_sites
+
+    source = dict(database=database, results_bucket=results_bucket, snapshot_file=snapshot_file,
+                  s3_bucket=s3_bucket, s3_key=s3_key)
+
+    snapshot = load_sites_snapshot(snapshot_file)
+    if snapshot:
+        if _snapshot_is_fresh(snapshot, max_age_seconds):
+            print(f"Loaded {len(snapshot['sites'])} sites from snapshot {snapshot_file}")
+        else:
+            print(f"Site snapshot {snapshot_file} is stale, refreshing in the background")
+            _refresh_in_background(known_version=snapshot.get("version"), **source)
+        sites = snapshot["sites"]
+    else:
+        sites = refresh_sites_snapshot(**source)
+
+    if not sites:
+        sites = load_bundled_sites()
+        print(f"Falling back to {len(sites)} bundled sites")
+
+    sites = SiteRegistry.from_sites(sites)
+    WARM_STATE.put(SITES_CACHE_KEY, sites, ttl_seconds=SITES_CACHE_TTL_SECONDS)
+    return sites
 
 
 def clear_cache():
-    global _SITES_CACHE
-    _SITES_CACHE = None
+    WARM_STATE.invalidate(SITES_CACHE_KEY)
@@ -0,0 +1,95 @@
+class Site:
+    """One weather station. Slotted to keep thousands of them small, and readable like the
+    dicts it replaces (site["lat"]) so existing callers don't need to change."""
+
+    __slots__ = ("site_id", "site_name", "site_country", "site_elevation", "lat", "lon")
+
+    def __init__(self, site_id, site_name, site_country=None, site_elevation=None, lat=None, lon=None):
+        self.site_id = str(site_id)
+        self.site_name = site_name
+        self.site_country = site_country
+        self.site_elevation = None if site_elevation is None else float(site_elevation)
+        self.lat = None if lat is None else float(lat)
+        self.lon = None if lon is None else float(lon)
+
+    @classmethod
+    def from_dict(cls, site):
+        if isinstance(site, Site):
+            return site
+        return cls(site["site_id"], site["site_name"], site.get("site_country"), site.get("site_elevation"),
+                   site.get("lat"), site.get("lon"))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        if isinstance(other, Site):
+            return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.site_id)
+
+    def __repr__(self):
+        return f"Site({self.site_id!r}, {self.site_name!r})"
+
+
+class SiteRegistry:
+    """Sites in load order, with O(1) lookup by site_id.
+
+    Iterating and indexing behave like the List[Dict] the site loader used to return.
+    """
+
+    def __init__(self, sites=()):
+        self._sites = []
+        self._by_id = {}
+
+        for site in sites:
+            self.add(site)
+
+    @classmethod
+    def from_sites(cls, sites):
+        return sites if isinstance(sites, SiteRegistry) else cls(sites)
+
+    def add(self, site):
+        site = Site.from_dict(site)
+        self._sites.append(site)
+        self._by_id[site.site_id] = site
+        return site
+
+    def get(self, site_id, default=None):
+        return self._by_id.get(str(site_id), default)
+
+    def __contains__(self, site_id):
+        return str(site_id) in self._by_id
+
+    def __len__(self):
+        return len(self._sites)
+
+    def __iter__(self):
+        return iter(self._sites)
+
+    def __getitem__(self, index):
+        return self._sites[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (SiteRegistry, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def to_dicts(self):
+        return [site.to_dict() for site in self._sites]
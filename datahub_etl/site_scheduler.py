@@ -0,0 +1,67 @@
+import heapq
+from datetime import datetime
+
+NEVER_FETCHED = "1970-01-01T00:00:00Z"
+FAILURE_BACKOFF_SECONDS = 3600
+MAX_FAILURE_BACKOFF_SECONDS = 24 * 3600
+LOW_YIELD_BACKOFF_SECONDS = 6 * 3600
+YIELD_SMOOTHING = 0.3
+
+
+def _epoch_seconds(timestamp):
+    try:
+        return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+def site_priority(cache_entry):
+    """When a site is next due, as epoch seconds - lower is fetched sooner.
+
+    Staleness is the base, pushed back by recent consecutive failures and by
+    a history of fetches that returned no new rows.
+    """
+    due = _epoch_seconds(cache_entry.get("last_fetched") or NEVER_FETCHED)
+    due += min(cache_entry.get("failures", 0) * FAILURE_BACKOFF_SECONDS, MAX_FAILURE_BACKOFF_SECONDS)
+
+    expected_yield = cache_entry.get("yield")
+    if expected_yield is not None and expected_yield < 1:
+        due += LOW_YIELD_BACKOFF_SECONDS
+
+    return due
+
+
+def update_expected_yield(previous_yield, rows):
+    if previous_yield is None:
+        return float(rows)
+    return round(previous_yield + YIELD_SMOOTHING * (rows - previous_yield), 2)
+
+
+class SiteScheduler:
+    """Min-heap of sites ordered by site_priority, so taking the next N of S sites costs O(S + N log S).
+
+    Iterating pops sites lazily as (site, last_fetched) pairs, most overdue first. Sites
+    with equal priority come out in the order they were given.
+    """
+
+    def __init__(self, sites, geohash_cache):
+        self._heap = []
+        for index, site in enumerate(sites):
+            cache_entry = geohash_cache.get(site["site_id"], {})
+            last_fetched = cache_entry.get("last_fetched") or NEVER_FETCHED
+            self._heap.append((site_priority(cache_entry), index, site, last_fetched))
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __iter__(self):
+        while self._heap:
+            yield self.pop()
+
+    def pop(self):
+        _, _, site, last_fetched = heapq.heappop(self._heap)
+        return site, last_fetched
+
+    def take(self, count):
+        return [self.pop() for _ in range(min(count, len(self._heap)))]
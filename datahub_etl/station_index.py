@@ -0,0 +1,87 @@
+import math
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.2
+
+
+def decode_geohash(geohash):
+    """Return the (lat, lon) centre of a geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    is_lon = True
+
+    for char in geohash:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            bounds = lon_range if is_lon else lat_range
+            mid = (bounds[0] + bounds[1]) / 2
+            if (bits >> shift) & 1:
+                bounds[0] = mid
+            else:
+                bounds[1] = mid
+            is_lon = not is_lon
+
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class StationIndex:
+    """Grid index of known station locations, used to resolve nearest stations without the API.
+
+    Points are bucketed into cells of cell_degrees, so a lookup only measures distances
+    to stations in the cells that can lie within max_distance_km.
+    """
+
+    def __init__(self, cell_degrees=0.5):
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def add(self, lat, lon, geohash):
+        self._cells.setdefault(self._cell(lat, lon), []).append((lat, lon, geohash))
+        self._size += 1
+
+    def nearest(self, lat, lon, max_distance_km):
+        lat_steps = math.ceil(max_distance_km / (KM_PER_DEGREE * self.cell_degrees))
+        lon_km_per_degree = KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+        lon_steps = math.ceil(max_distance_km / (lon_km_per_degree * self.cell_degrees))
+
+        row, col = self._cell(lat, lon)
+        best = None
+        for d_row in range(-lat_steps, lat_steps + 1):
+            for d_col in range(-lon_steps, lon_steps + 1):
+                for station_lat, station_lon, geohash in self._cells.get((row + d_row, col + d_col), ()):
+                    distance = haversine_km(lat, lon, station_lat, station_lon)
+                    if distance <= max_distance_km and (best is None or distance < best[1]):
+                        best = (geohash, distance)
+
+        return best
+
+
+def build_station_index(sites, geohash_cache, cell_degrees=0.5):
+    """Index every station we have already resolved, at both the site and the station location."""
+    index = StationIndex(cell_degrees)
+    geohashes = set()
+
+    for site in sites:
+        geohash = geohash_cache.get(site["site_id"], {}).get("geohash")
+        if geohash:
+            index.add(site["lat"], site["lon"], geohash)
+            geohashes.add(geohash)
+
+    for geohash in geohashes:
+        index.add(*decode_geohash(geohash), geohash)
+
+    return index
@@ -0,0 +1,55 @@
+import threading
+import time
+
+DEFAULT_TTL_SECONDS = 6 * 3600
+
+
+class WarmState:
+    """Values kept in module memory between warm Lambda invocations.
+
+    Each value expires after its TTL, and can carry a version (e.g. an S3 ETag) so a
+    caller can check it is still current before reusing it.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def put(self, key, value, version=None, ttl_seconds=DEFAULT_TTL_SECONDS):
+        with self._lock:
+            self._values[key] = (value, version, self._clock() + ttl_seconds)
+
+    def contains(self, key):
+        with self._lock:
+            return self._current(key) is not None
+
+    def get(self, key, version=None):
+        """Return the value for key, or None if missing, expired or (when version is given) out of date."""
+        with self._lock:
+            entry = self._current(key)
+            if entry is None:
+                return None
+
+            value, stored_version, _ = entry
+            if version is not None and version != stored_version:
+                del self._values[key]
+                return None
+            return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+    def _current(self, key):
+        entry = self._values.get(key)
+        if entry is not None and self._clock() >= entry[2]:
+            del self._values[key]
+            return None
+        return entry
+
+
+WARM_STATE = WarmState()
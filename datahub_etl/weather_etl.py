@@ -1,54 +1,283 @@
+import gzip
 import json
 import os
-from datetime import datetime, timezone
+import time
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, timezone
+from itertools import chain, groupby, islice, repeat
 from .site_loader import get_sites
+from .site_registry import SiteRegistry
+from .rate_limiter import QuotaExhaustedError, RateLimiter
+from .station_index import build_station_index
+from .site_scheduler import SiteScheduler, update_expected_yield
+from .warm_state import WARM_STATE
 
 CACHE_FILE = "/tmp/geohash_cache.json"
+DEFAULT_MAX_WORKERS = 1
+TRANSFORM_CHUNK_SIZE = 5000
+OFFLINE_STATION_MAX_DISTANCE_KM = 2.0
+NO_STATION_RETRY_DAYS = 7
+INITIAL_SITE_LATENCY_SECONDS = 2.0
+CACHE_COMPACT_AFTER_UPDATES = 48
+CACHE_SAVE_ATTEMPTS = 3
+WARM_CACHE_TTL_SECONDS = 6 * 3600
+
+_S3_CACHE_ETAGS = {}
+
+# Output row layout: each column is filled from the site, from a DataHub observation field,
+# or with a fixed value. Shared by transform_observation and transform_observations.
+SITE_COLUMNS = ("site_id", "site_name", "site_country", "site_continent", "site_elevation", "lat", "lon")
+OBSERVATION_FIELDS = (
+    ("wind_direction", "wind_direction"),
+    ("wind_gust", None),
+    ("screen_relative_humidity", "humidity"),
+    ("pressure", "mslp"),
+    ("wind_speed", "wind_speed"),
+    ("temperature", "temperature"),
+    ("visibility", "visibility"),
+    ("weather_type", "weather_code"),
+    ("pressure_tendency", "pressure_tendency"),
+    ("dew_point", None),
+)
+ROW_COLUMNS = ("observation_ts",) + SITE_COLUMNS + tuple(column for column, _ in OBSERVATION_FIELDS)
 
 
 def load_geohash_cache(cache_file=CACHE_FILE, s3_bucket=None, s3_key=None):
     if s3_bucket and s3_key:
         try:
-            from helpers.aws import load_json_from_s3
-            cache = load_json_from_s3(s3_bucket, s3_key)
+            from helpers.aws import get_s3_etag, load_json_and_etag_from_s3
+
+            # A warm container can skip the download and parse if nobody has saved since we did
+            warm_key = _warm_cache_key(s3_bucket, s3_key)
+            # A copy is handed out, so a run that fails before saving leaves the warm copy as it was in S3
+            if WARM_STATE.contains(warm_key):
+                # No ETag (the HEAD failed or the object is gone) can't vouch for the warm copy
+                etag = get_s3_etag(s3_bucket, s3_key)
+                cache = WARM_STATE.get(warm_key, version=etag) if etag is not None else None
+                if cache is None:
+                    WARM_STATE.invalidate(warm_key)
+                else:
+                    print(f"Reusing warm geohash cache for S3://{s3_bucket}/{s3_key} ({len(cache)} sites)")
+                    return _copy_cache(cache)
+
+            cache, etag = load_json_and_etag_from_s3(s3_bucket, s3_key)
             if cache:
+                _S3_CACHE_ETAGS[(s3_bucket, s3_key)] = etag
+                WARM_STATE.put(warm_key, cache, version=etag, ttl_seconds=WARM_CACHE_TTL_SECONDS)
                 print(f"Loaded geohash cache from S3://{s3_bucket}/{s3_key}")
-                return cache
+                return _copy_cache(cache)
         except Exception as e:
             print(f"Could not load cache from S3: {e}")
 
     if os.path.exists(cache_file):
         with open(cache_file, 'r') as f:
             cache = json.load(f)
-            print(f"Loaded geohash cache from {cache_file} ({len(cache)} sites)")
-            return cache
+
+        updates = _replay_cache_log(cache, _cache_log_file(cache_file))
+        print(f"Loaded geohash cache from {cache_file} ({len(cache)} sites, {updates} logged updates)")
+        return cache
 
     print("No geohash cache found, will populate from API")
     return {}
 
 
-def save_geohash_cache(cache, cache_file=CACHE_FILE, s3_bucket=None, s3_key=None):
-    with open(cache_file, 'w') as f:
-        json.dump(cache, f, indent=2)
-        print(f"Saved geohash cache to {cache_file} ({len(cache)} sites)")
+def _copy_cache(cache):
+    return {site_id: dict(entry) for site_id, entry in cache.items()}
+
+
+class GeohashCacheUpdates:
+    """Geohash cache changes made by an extract, held back until its data is safely uploaded.
+
+    Saving moves the site watermarks past the observations just fetched, so it must not
+    happen until they are in S3 - a run that fails before then fetches them again.
+    """
+
+    def __init__(self):
+        self.cache = None
+        self.changed_site_ids = set()
+        self._s3_bucket = None
+        self._s3_key = None
+
+    def __len__(self):
+        return len(self.changed_site_ids)
+
+    def record(self, cache, changed_site_ids, s3_bucket=None, s3_key=None):
+        self.cache = cache
+        self.changed_site_ids.update(changed_site_ids)
+        self._s3_bucket = s3_bucket
+        self._s3_key = s3_key
+
+    def save(self):
+        """Returns True once the changes are saved (or there were none), False if they did not reach S3"""
+        if self.cache is None or not self.changed_site_ids:
+            return True
+        return save_geohash_cache(self.cache, s3_bucket=self._s3_bucket, s3_key=self._s3_key,
+                                  changed_site_ids=self.changed_site_ids)
+
+
+def save_ingest_state(cache_updates, sketches, sketch_bucket, source="datahub"):
+    """Save the watermarks, then fold the run's sketches in - but only if the watermarks were saved.
+
+    Sketches are merged, not replaced. If the old watermarks stay in S3 the next run fetches the
+    same observations again, and merging those sketches twice would count them twice.
+    """
+    if not cache_updates.save():
+        print("Geohash cache was not saved, leaving temperature sketches for the next run")
+        return False
+    if sketches is not None and len(sketches):
+        sketches.save(sketch_bucket, source)
+    return True
+
+
+def save_geohash_cache(cache, cache_file=CACHE_FILE, s3_bucket=None, s3_key=None, changed_site_ids=None):
+    """Persist the cache locally and, if configured, to S3.
+
+    With changed_site_ids, the local copy appends just those entries to a log next to the
+    snapshot, compacting once CACHE_COMPACT_AFTER_UPDATES have built up. S3 writes are
+    conditional on the ETag we loaded, so overlapping runs merge rather than clobber.
+    Returns False if the S3 copy could not be saved.
+    """
+    _save_geohash_cache_locally(cache, cache_file, changed_site_ids)
 
     if s3_bucket and s3_key:
         try:
-            from helpers.aws import save_json_to_s3
-            save_json_to_s3(cache, s3_bucket, s3_key)
+            return _save_geohash_cache_to_s3(cache, s3_bucket, s3_key, changed_site_ids)
         except Exception as e:
             print(f"Could not save cache to S3: {e}")
+            return False
+    return True
+
+
+def _cache_log_file(cache_file):
+    return cache_file + ".log"
+
+
+def _replay_cache_log(cache, log_file):
+    if not os.path.exists(log_file):
+        return 0
+
+    updates = 0
+    with open(log_file, 'r') as f:
+        for line in f:
+            try:
+                cache.update(json.loads(line))
+                updates += 1
+            except ValueError:
+                # A torn final line from an interrupted append - everything before it is still good
+                break
+    return updates
+
+
+def _write_atomically(filename, content):
+    temp_file = f"{filename}.{os.getpid()}.tmp"
+    with open(temp_file, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, filename)
+
+
+def _save_geohash_cache_locally(cache, cache_file, changed_site_ids=None):
+    log_file = _cache_log_file(cache_file)
+
+    if changed_site_ids is not None and os.path.exists(cache_file):
+        log_length = 0
+        if os.path.exists(log_file):
+            with open(log_file, 'r') as f:
+                log_length = sum(1 for _ in f)
+
+        if log_length < CACHE_COMPACT_AFTER_UPDATES:
+            changes = {site_id: cache[site_id] for site_id in changed_site_ids if site_id in cache}
+            with open(log_file, 'a') as f:
+                f.write(json.dumps(changes, separators=(',', ':')) + '\n')
+            print(f"Logged {len(changes)} geohash cache updates to {log_file}")
+            return
+
+    _write_atomically(cache_file, json.dumps(cache, separators=(',', ':')))
+    if os.path.exists(log_file):
+        os.remove(log_file)
+    print(f"Saved geohash cache to {cache_file} ({len(cache)} sites)")
+
+
+def _save_geohash_cache_to_s3(cache, s3_bucket, s3_key, changed_site_ids=None):
+    from helpers.aws import load_json_and_etag_from_s3, save_json_to_s3_if_unchanged
+
+    etag = _S3_CACHE_ETAGS.get((s3_bucket, s3_key))
+    for attempt in range(CACHE_SAVE_ATTEMPTS):
+        new_etag = save_json_to_s3_if_unchanged(cache, s3_bucket, s3_key, etag)
+        if new_etag:
+            _S3_CACHE_ETAGS[(s3_bucket, s3_key)] = new_etag
+            WARM_STATE.put(_warm_cache_key(s3_bucket, s3_key), cache, version=new_etag,
+                           ttl_seconds=WARM_CACHE_TTL_SECONDS)
+            return True
+
+        # Someone else saved since we loaded: take their copy and re-apply our changes on top
+        remote_cache, etag = load_json_and_etag_from_s3(s3_bucket, s3_key)
+        if remote_cache is None:
+            continue
+
+        changed = cache.keys() if changed_site_ids is None else changed_site_ids
+        merged = dict(remote_cache)
+        merged.update({site_id: cache[site_id] for site_id in changed if site_id in cache})
+        cache.clear()
+        cache.update(merged)
+
+    print(f"Gave up saving geohash cache to S3://{s3_bucket}/{s3_key} after {CACHE_SAVE_ATTEMPTS} attempts")
+    WARM_STATE.invalidate(_warm_cache_key(s3_bucket, s3_key))
+    return False
+
+
+def _warm_cache_key(s3_bucket, s3_key):
+    return "geohash_cache", s3_bucket, s3_key
 
 
 def _build_site_priority_queue(all_sites, geohash_cache):
-    sites_with_priority = []
-    for site in all_sites:
-        cache_entry = geohash_cache.get(site["site_id"], {})
-        last_fetched = cache_entry.get("last_fetched") or "1970-01-01T00:00:00Z"
-        sites_with_priority.append((site, last_fetched))
+    scheduler = SiteScheduler(all_sites, geohash_cache)
+    return scheduler.take(len(scheduler))
+
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _is_known_without_station(cache_entry, now=None):
+    checked = cache_entry.get("no_station_checked")
+    if cache_entry.get("geohash") or not checked:
+        return False
+
+    now = now or datetime.now(timezone.utc)
+    return now - _parse_timestamp(checked) < timedelta(days=NO_STATION_RETRY_DAYS)
+
+
+def _mark_no_station_for_site(site_id, geohash_cache):
+    now = datetime.now(timezone.utc).isoformat()
+    geohash_cache[site_id] = {"geohash": None, "last_fetched": now, "no_station_checked": now}
+
+
+def _resolve_geohashes_offline(all_sites, geohash_cache, max_distance_km=OFFLINE_STATION_MAX_DISTANCE_KM):
+    """Fill in geohashes for uncached sites that sit next to a station we have already resolved."""
+    unresolved = [site for site in all_sites if not geohash_cache.get(site["site_id"], {}).get("geohash")]
+    if not unresolved:
+        return []
+
+    station_index = build_station_index(all_sites, geohash_cache)
+    if not len(station_index):
+        return []
+
+    resolved = []
+    for site in unresolved:
+        match = station_index.nearest(site["lat"], site["lon"], max_distance_km)
+        if match:
+            geohash, distance = match
+            cache_entry = geohash_cache.setdefault(site["site_id"], {})
+            cache_entry["geohash"] = geohash
+            cache_entry.pop("no_station_checked", None)
+            cache_entry.setdefault("last_fetched", None)
+            print(f"  Resolved geohash for {site['site_name']} offline: {geohash} ({distance:.1f}km)")
+            resolved.append(site["site_id"])
 
-    sites_with_priority.sort(key=lambda x: x[1])
-    return sites_with_priority
+    return resolved
 
 
 def _fetch_geohash_for_site(site, client, geohash_cache):
@@ -76,124 +305,419 @@ def _fetch_observations_for_site(site, client, geohash_cache):
     observations = client.get_observations(geohash)
     if not observations:
         print(f"No observations for {site['site_name']}")
-        return None, None
+        return None, geohash
 
+    # Observations refer to their site by id, the site record itself is looked up when transforming
     for obs in observations:
-        obs["_site_metadata"] = site
+        obs["_site_id"] = site["site_id"]
         obs["_geohash"] = geohash
 
     print(f"  {site['site_name']}: {len(observations)} observations")
     return observations, geohash
 
 
-def _update_cache_for_site(site_id, geohash, geohash_cache):
+class _SiteLatency:
+    """Moving average of per-site fetch time, used to decide whether another site fits before the deadline."""
+
+    def __init__(self, deadline=None, initial_seconds=INITIAL_SITE_LATENCY_SECONDS, smoothing=0.3, clock=time.monotonic):
+        self.deadline = deadline
+        self.average = initial_seconds
+        self.smoothing = smoothing
+        self.deadline_reached = False
+        self._clock = clock
+
+    def record(self, seconds):
+        self.average += self.smoothing * (seconds - self.average)
+
+    def can_start_another(self):
+        if self.deadline is not None and self._clock() + self.average > self.deadline:
+            self.deadline_reached = True
+        return not self.deadline_reached
+
+
+def _has_request_budget(client):
+    # Once the run's request budget is spent, every further site would fail straight away
+    rate_limiter = getattr(client, "rate_limiter", None)
+    return not isinstance(rate_limiter, RateLimiter) or rate_limiter.remaining != 0
+
+
+def _fetch_site(site, client, geohash_cache):
+    started = time.monotonic()
+    try:
+        observations, geohash = _fetch_observations_for_site(site, client, geohash_cache)
+        return site, observations, geohash, None, time.monotonic() - started
+    except Exception as e:
+        return site, None, None, e, time.monotonic() - started
+
+
+def _fetch_sites(sites, client, geohash_cache, max_workers=DEFAULT_MAX_WORKERS, can_start=None):
+    # Keeps at most max_workers requests in flight and yields (site, observations, geohash, error, seconds)
+    # as each one completes, so the caller can update the cache from a single thread. No new site is
+    # started once can_start() returns False.
+    pending_sites = iter(sites)
+
+    def next_site():
+        if can_start and not can_start():
+            return None
+        return next(pending_sites, None)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        while len(in_flight) < max_workers:
+            site = next_site()
+            if site is None:
+                break
+            in_flight.add(executor.submit(_fetch_site, site, client, geohash_cache))
+
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+                site = next_site()
+                if site is not None:
+                    in_flight.add(executor.submit(_fetch_site, site, client, geohash_cache))
+
+
+def _is_rate_limit_error(error):
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+
+    error_msg = str(error)
+    return "429" in error_msg or "Too Many Requests" in error_msg
+
+
+def _update_cache_for_site(site_id, geohash, geohash_cache, watermark=None, rows=None):
+    previous_entry = geohash_cache.get(site_id, {})
     geohash_cache[site_id] = {
         "geohash": geohash,
         "last_fetched": datetime.now(timezone.utc).isoformat()
     }
 
+    watermark = _latest_timestamp([previous_entry.get("watermark"), watermark])
+    if watermark:
+        geohash_cache[site_id]["watermark"] = watermark
 
-def _write_observations_to_file(observations, filename):
-    with open(filename, 'w') as f:
-        json.dump(observations, f, ensure_ascii=False, indent=2)
-    print(f"Wrote {len(observations)} observations to {filename}")
+    expected_yield = previous_entry.get("yield")
+    if rows is not None:
+        expected_yield = update_expected_yield(expected_yield, rows)
+    if expected_yield is not None:
+        geohash_cache[site_id]["yield"] = expected_yield
 
 
-def extract_observations_data(filename, client, s3_bucket=None, s3_cache_key=None, batch_size=None):
-    geohash_cache = load_geohash_cache(s3_bucket=s3_bucket, s3_key=s3_cache_key)
-    cache_updated = False
-    all_observations = []
-    failed_sites = []
+def _record_failure_for_site(site_id, geohash_cache):
+    cache_entry = geohash_cache.setdefault(site_id, {})
+    cache_entry["failures"] = cache_entry.get("failures", 0) + 1
 
-    all_sites = get_sites()
-    if batch_size is None:
-        batch_size = max(1, len(all_sites) // 24)
 
-    sites_with_priority = _build_site_priority_queue(all_sites, geohash_cache)
-    sites_to_fetch = [site for site, _ in sites_with_priority[:batch_size]]
+def _latest_timestamp(timestamps):
+    latest = None
+    for timestamp in timestamps:
+        try:
+            if timestamp and (latest is None or _parse_timestamp(timestamp) > _parse_timestamp(latest)):
+                latest = timestamp
+        except ValueError:
+            continue
+    return latest
+
 
-    print(f"Processing batch of {len(sites_to_fetch)} sites (out of {len(all_sites)} total, batch_size={batch_size})")
+def _filter_new_observations(observations, watermark, overlap_hours=0):
+    """Drop observations at or before the site's watermark, less an overlap window for late corrections."""
+    if not watermark:
+        return observations
 
-    for site in sites_to_fetch:
+    cutoff = _parse_timestamp(watermark) - timedelta(hours=overlap_hours)
+    new_observations = []
+    for obs in observations:
         try:
-            observations, geohash = _fetch_observations_for_site(site, client, geohash_cache)
+            if _parse_timestamp(obs["datetime"]) <= cutoff:
+                continue
+        except (KeyError, TypeError, ValueError):
+            pass
+        new_observations.append(obs)
 
-            if observations and geohash:
-                all_observations.extend(observations)
-                _update_cache_for_site(site["site_id"], geohash, geohash_cache)
-                cache_updated = True
-            else:
-                failed_sites.append(site["site_name"])
+    return new_observations
 
-        except Exception as e:
-            error_msg = str(e)
+
+def _add_to_sketches(sketches, site, observations):
+    for obs in observations:
+        sketches.add(site["site_id"], site["site_name"], site["lat"], site["lon"], obs.get("datetime"),
+                     obs.get("temperature"))
+
+
+def _write_observations(observations, f):
+    for obs in observations:
+        f.write(json.dumps(obs, ensure_ascii=False, separators=(',', ':')) + '\n')
+    return len(observations)
+
+
+def read_observations(filename):
+    # Raw files are newline-delimited, older ones are a single JSON array - both can be replayed,
+    # either as uploaded (.gz) or uncompressed
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rt', encoding='utf-8') as f:
+        first_char = f.read(1)
+        while first_char.isspace():
+            first_char = f.read(1)
+        f.seek(0)
+
+        if first_char == '[':
+            yield from json.load(f)
+            return
+
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def extract_observations_data(filename, client, s3_bucket=None, s3_cache_key=None, batch_size=None,
+                              max_workers=DEFAULT_MAX_WORKERS, output_filename=None, watermark_overlap_hours=0,
+                              deadline=None, sketches=None, cache_updates=None):
+    """Fetch a batch of sites and stream their raw observations to filename.
+
+    If output_filename is given, each site's observations are also transformed as they
+    arrive and written there, so transform_observations_data is only needed for replay.
+
+    Observations at or before a site's watermark (the latest observation already ingested)
+    are dropped; watermark_overlap_hours re-ingests that many hours to pick up late corrections.
+
+    deadline is a time.monotonic() value. When set, and no batch_size is given, sites are taken
+    from the priority queue for as long as the moving-average site latency says another will finish
+    in time, rather than a fixed 1/24 of the sites.
+
+    If sketches (a MonthlySiteSketches) is given, the temperature of every observation newer than
+    the site's watermark is added to it. The overlap window is left out so nothing is counted twice.
+
+    If cache_updates (a GeohashCacheUpdates) is given, the geohash cache is not saved here: the
+    changes are recorded in it for the caller to save once the extracted files are uploaded.
+    """
+    geohash_cache = load_geohash_cache(s3_bucket=s3_bucket, s3_key=s3_cache_key)
+    updated_site_ids = set()
+    observation_count = 0
+    row_count = 0
+    failed_sites = []
+    skipped_sites = []
+
+    all_sites = SiteRegistry.from_sites(get_sites())
+    if batch_size is None:
+        batch_size = len(all_sites) if deadline is not None else max(1, len(all_sites) // 24)
+
+    updated_site_ids.update(_resolve_geohashes_offline(all_sites, geohash_cache))
+
+    # Sites are popped from the scheduler only as they are started. Sites recently found
+    # to have no nearby station are not worth an API call every run.
+    scheduler = SiteScheduler(all_sites, geohash_cache)
+    sites_to_fetch = islice(
+        (site for site, _ in scheduler if not _is_known_without_station(geohash_cache.get(site["site_id"], {}))),
+        batch_size
+    )
+
+    print(f"Processing batch of up to {batch_size} sites (out of {len(all_sites)} total, "
+          f"max_workers={max_workers})")
+
+    latency = _SiteLatency(deadline)
+    sites_fetched = 0
+
+    with ExitStack() as files:
+        raw_file = files.enter_context(open(filename, 'w', encoding='utf-8'))
+        output_file = files.enter_context(open(output_filename, 'w')) if output_filename else None
+
+        def can_start():
+            return _has_request_budget(client) and latency.can_start_another()
+
+        results = _fetch_sites(sites_to_fetch, client, geohash_cache, max_workers, can_start)
+        for site, observations, geohash, error, seconds in results:
+            if isinstance(error, QuotaExhaustedError):
+                # Left stale in the cache so they are first in line on the next run. No request
+                # was made, so the near-zero time says nothing about site latency.
+                skipped_sites.append(site["site_name"])
+                continue
+
+            latency.record(seconds)
+            sites_fetched += 1
+
+            if error is None:
+                if observations and geohash:
+                    watermark = geohash_cache.get(site["site_id"], {}).get("watermark")
+                    new_observations = _filter_new_observations(observations, watermark, watermark_overlap_hours)
+
+                    observation_count += _write_observations(new_observations, raw_file)
+                    if output_file:
+                        row_count += _transform_site_observations(site, new_observations, output_file, all_sites)
+                    if sketches is not None:
+                        _add_to_sketches(sketches, site, _filter_new_observations(new_observations, watermark))
+
+                    latest = _latest_timestamp(obs.get("datetime") for obs in observations)
+                    _update_cache_for_site(site["site_id"], geohash, geohash_cache, watermark=latest,
+                                           rows=len(new_observations))
+                else:
+                    failed_sites.append(site["site_name"])
+                    if not geohash:
+                        _mark_no_station_for_site(site["site_id"], geohash_cache)
+                    else:
+                        _record_failure_for_site(site["site_id"], geohash_cache)
+                updated_site_ids.add(site["site_id"])
+                continue
+
+            error_msg = str(error)
             print(f"Failed to fetch {site['site_name']}: {error_msg}")
             failed_sites.append(site["site_name"])
 
-            if "429" in error_msg or "Too Many Requests" in error_msg:
+            if _is_rate_limit_error(error):
                 print(f"  Rate limited on {site['site_name']}, marking as fetched to move on")
                 cache_entry = geohash_cache.get(site["site_id"], {})
                 if cache_entry.get("geohash"):
                     _update_cache_for_site(site["site_id"], cache_entry["geohash"], geohash_cache)
-                    cache_updated = True
+                    updated_site_ids.add(site["site_id"])
+            else:
+                _record_failure_for_site(site["site_id"], geohash_cache)
+                updated_site_ids.add(site["site_id"])
+
+    if latency.deadline_reached:
+        print(f"Stopped after {sites_fetched} sites to stay within the deadline "
+              f"(average {latency.average:.2f}s per site)")
 
-    if cache_updated:
-        save_geohash_cache(geohash_cache, s3_bucket=s3_bucket, s3_key=s3_cache_key)
+    print(f"Wrote {observation_count} observations to {filename}")
+    if output_filename:
+        print(f"Wrote {row_count} lines to {output_filename}")
+
+    if cache_updates is not None:
+        cache_updates.record(geohash_cache, updated_site_ids, s3_bucket=s3_bucket, s3_key=s3_cache_key)
+    elif updated_site_ids:
+        save_geohash_cache(geohash_cache, s3_bucket=s3_bucket, s3_key=s3_cache_key,
+                           changed_site_ids=updated_site_ids)
 
     if failed_sites:
         print(f"\nFailed to fetch {len(failed_sites)} sites")
 
-    _write_observations_to_file(all_observations, filename)
-    return len(all_observations) > 0
+    if not _has_request_budget(client):
+        print(f"Request budget used up after {sites_fetched} sites"
+              + (f", {len(skipped_sites)} already started were skipped" if skipped_sites else ""))
 
+    return observation_count > 0
 
-def transform_observations_data(input_filename, output_filename):
-    with open(input_filename, 'r') as f:
-        observations = json.load(f)
 
-    if not observations:
+def transform_observations_data(input_filename, output_filename, sites=None):
+    observations = read_observations(input_filename)
+
+    first = next(observations, None)
+    if first is None:
         return False
 
-    with open(output_filename, 'w') as f:
-        count = 0
-        for obs in observations:
-            row = transform_observation(obs)
-            if row:
-                f.write(json.dumps(row) + '\n')
-                count += 1
+    # Older raw files embed the site in each observation, newer ones refer to it by id
+    if sites is None and "_site_metadata" not in first:
+        sites = get_sites()
+    if sites is not None:
+        sites = SiteRegistry.from_sites(sites)
 
+    with open(output_filename, 'w') as f:
+        count = _write_rows(chain([first], observations), f, sites)
         print(f"Wrote {count} lines to {output_filename}")
 
     return True
 
 
-def _get_numeric_field(obs, field_name):
-    value = obs.get(field_name)
-    return None if value in ("", None) else value
+def _write_rows(observations, f, sites=None):
+    count = 0
+    observations = iter(observations)
+    while True:
+        chunk = list(islice(observations, TRANSFORM_CHUNK_SIZE))
+        if not chunk:
+            return count
+
+        rows = transform_observations(chunk, sites)
+        f.writelines(json.dumps(row) + '\n' for row in rows)
+        count += len(rows)
+
 
+def _transform_site_observations(site, observations, f, sites=None):
+    # A bad response only costs this site's transformed rows, the raw copy is kept for replay
+    try:
+        rows = transform_observations(observations, sites)
+    except Exception as e:
+        print(f"Failed to transform observations for {site['site_name']}: {e}")
+        return 0
 
-def transform_observation(obs):
+    f.writelines(json.dumps(row) + '\n' for row in rows)
+    return len(rows)
+
+
+def _site_values(site):
+    return (site["site_id"], site["site_name"], site["site_country"], "EUROPE", float(site["site_elevation"]),
+            float(site["lat"]), float(site["lon"]))
+
+
+def _site_for_observation(obs, sites=None):
+    # sites is a SiteRegistry, built once by the caller rather than per observation
     site = obs.get("_site_metadata")
+    if not site and sites is not None and "_site_id" in obs:
+        site = sites.get(obs["_site_id"])
+    return site
+
+
+def _site_key(obs):
+    # Cheap grouping key - the site itself is only resolved once per run of observations
+    site = obs.get("_site_metadata")
+    if site:
+        return True, site.get("site_id")
+    return False, obs.get("_site_id")
+
+
+def _observation_ts(obs):
+    return obs.get("datetime", "").replace("Z", "").replace("T", " ")
+
+
+def _observation_column(group, field):
+    if field is None:
+        return [None] * len(group)
+    column = list(map(dict.get, group, repeat(field)))
+    # Blank values become null. Checking first keeps the common, fully populated column at C speed
+    if "" in column:
+        column = [None if value == "" else value for value in column]
+    return column
+
+
+def transform_observations(observations, sites=None):
+    """Transform observations into lake rows, column by column.
+
+    Observations are grouped into runs from the same site, which is resolved once per run.
+    Each observation field is then extracted as a whole column, and each row is a copy of the
+    run's site columns updated with its observation values.
+    """
+    rows = []
+    sites = SiteRegistry.from_sites(sites) if sites is not None else None
+    observation_columns = ("observation_ts",) + tuple(column for column, _ in OBSERVATION_FIELDS)
+
+    for _, group in groupby(observations, key=_site_key):
+        group = list(group)
+        site = _site_for_observation(group[0], sites)
+        if not site:
+            continue
+
+        template = dict.fromkeys(ROW_COLUMNS)
+        template.update(zip(SITE_COLUMNS, _site_values(site)))
+        timestamps = [_observation_ts(obs) for obs in group]
+        columns = [timestamps] + [_observation_column(group, field) for _, field in OBSERVATION_FIELDS]
+
+        for values in zip(*columns):
+            row = template.copy()
+            row.update(zip(observation_columns, values))
+            rows.append(row)
+
+    return rows
+
+
+def _clean_value(value):
+    return None if value in ("", None) else value
+
+
+def transform_observation(obs, sites=None):
+    """A single observation as a lake row, built from the same column layout as transform_observations"""
+    sites = SiteRegistry.from_sites(sites) if sites is not None else None
+    site = _site_for_observation(obs, sites)
     if not site:
         return None
 
-    return {
-        "observation_ts": obs.get("datetime", "").replace("Z", "").replace("T", " "),
-        "site_id": site["site_id"],
-        "site_name": site["site_name"],
-        "site_country": site["site_country"],
-        "site_continent": "EUROPE",
-        "site_elevation": float(site["site_elevation"]),
-        "lat": float(site["lat"]),
-        "lon": float(site["lon"]),
-        "wind_direction": _get_numeric_field(obs, "wind_direction"),
-        "wind_gust": None,
-        "screen_relative_humidity": _get_numeric_field(obs, "humidity"),
-        "pressure": _get_numeric_field(obs, "mslp"),
-        "wind_speed": _get_numeric_field(obs, "wind_speed"),
-        "temperature": _get_numeric_field(obs, "temperature"),
-        "visibility": _get_numeric_field(obs, "visibility"),
-        "weather_type": _get_numeric_field(obs, "weather_code"),
-        "pressure_tendency": _get_numeric_field(obs, "pressure_tendency"),
-        "dew_point": None,
-    }
+    values = tuple(_clean_value(obs.get(field)) if field else None for _, field in OBSERVATION_FIELDS)
+    return dict(zip(ROW_COLUMNS, (_observation_ts(obs),) + _site_values(site) + values))
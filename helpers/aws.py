@@ -1,42 +1,280 @@
 import boto3
+import codecs
+import csv
 import json
-from time import sleep
+import random
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import monotonic, sleep
+from boto3.s3.transfer import TransferConfig
+from datetime import date, datetime
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 
 # Should be using https://github.com/laughingman7743/PyAthena
 
-def load_file_to_s3(filename, s3_bucket, s3_key):
+MAX_POOL_CONNECTIONS = 32
+MAX_RETRY_ATTEMPTS = 5
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    retries={'max_attempts': MAX_RETRY_ATTEMPTS, 'mode': 'adaptive'}
+)
+
+ATHENA_POLL_INITIAL_SECONDS = 0.25
+ATHENA_POLL_MAX_SECONDS = 5.0
+ATHENA_BATCH_GET_LIMIT = 50
+ATHENA_FINISHED_STATES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+ATHENA_RESULTS_PAGE_SIZE = 1000
+ATHENA_STREAM_THRESHOLD_BYTES = 4 * 1024 * 1024
+
+ATHENA_TYPE_CONVERTERS = {
+    'tinyint': int,
+    'smallint': int,
+    'integer': int,
+    'bigint': int,
+    'float': float,
+    'real': float,
+    'double': float,
+    'decimal': float,
+    'boolean': lambda value: value.lower() == 'true',
+    'date': date.fromisoformat,
+    'timestamp': datetime.fromisoformat
+}
+
+MULTIPART_PART_SIZE_BYTES = 8 * 1024 * 1024
+MULTIPART_MAX_CONCURRENCY = 8
+S3_DELETE_BATCH_SIZE = 1000
+S3_DELETE_MAX_CONCURRENCY = 8
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_PART_SIZE_BYTES,
+    multipart_chunksize=MULTIPART_PART_SIZE_BYTES,
+    max_concurrency=MULTIPART_MAX_CONCURRENCY
+)
+
+PARTITIONS_PER_STATEMENT = 500
+
+_clients = {}
+_clients_lock = threading.Lock()
+_partitions = {}
+_partitions_lock = threading.Lock()
+
+
+def get_client(service, region=None):
+    """Shared boto3 client for a service and region, created on first use and kept for the life of the process.
+
+    Clients are thread safe once created, but creating them isn't, hence the lock.
+    """
+    key = (service, region)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = boto3.client(service, region_name=region, config=CLIENT_CONFIG)
+                _clients[key] = client
+    return client
+
+
+def clear_clients():
+    with _clients_lock:
+        _clients.clear()
+
+
+def load_file_to_s3(filename, s3_bucket, s3_key, compress=False):
     print(f"Uploading data to S3://{s3_bucket}/{s3_key}")
 
-    s3 = boto3.client('s3')
-    s3.upload_file(filename, s3_bucket, s3_key)
+    if compress:
+        with open(filename, 'rb') as f:
+            upload_stream_to_s3(f, s3_bucket, s3_key, compress=True)
+        return
+
+    s3 = get_client('s3')
+    s3.upload_file(filename, s3_bucket, s3_key, Config=TRANSFER_CONFIG)
+
+
+def _byte_chunks(data, chunk_size):
+    if hasattr(data, 'read'):
+        stream = data
+        data = iter(lambda: stream.read(chunk_size), stream.read(0))
+    for chunk in data:
+        yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class _MultipartUpload:
+    """Uploads parts on a thread pool as they are filled, keeping at most max_concurrency in flight"""
+
+    def __init__(self, s3, s3_bucket, s3_key, extra_args, max_concurrency):
+        self._s3 = s3
+        self._bucket = s3_bucket
+        self._key = s3_key
+        self._max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._in_flight = set()
+        self._parts = []
+        self._upload_id = s3.create_multipart_upload(Bucket=s3_bucket, Key=s3_key, **extra_args)['UploadId']
+
+    def _upload_part(self, part_number, body):
+        response = self._s3.upload_part(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+                                        PartNumber=part_number, Body=body)
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def _collect(self, done):
+        for future in done:
+            self._in_flight.discard(future)
+            self._parts.append(future.result())
+
+    def add_part(self, body):
+        if len(self._in_flight) >= self._max_concurrency:
+            self._collect(wait(self._in_flight, return_when=FIRST_COMPLETED).done)
+        part_number = len(self._parts) + len(self._in_flight) + 1
+        self._in_flight.add(self._executor.submit(self._upload_part, part_number, body))
+
+    def complete(self):
+        try:
+            self._collect(wait(self._in_flight).done)
+            self._s3.complete_multipart_upload(
+                Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+                MultipartUpload={'Parts': sorted(self._parts, key=lambda part: part['PartNumber'])}
+            )
+        finally:
+            self._executor.shutdown()
+
+    def abort(self):
+        self._executor.shutdown(cancel_futures=True)
+        self._s3.abort_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id)
+
+
+def upload_stream_to_s3(data, s3_bucket, s3_key, compress=False, content_type=None,
+                        part_size=MULTIPART_PART_SIZE_BYTES, max_concurrency=MULTIPART_MAX_CONCURRENCY):
+    """Upload an iterable of str/bytes chunks, or a file-like object, without staging it on disk.
+
+    With compress=True the stream is gzipped on the way. Anything smaller than one part is
+    sent with a single PUT; larger streams become a multipart upload with parts sent in
+    parallel. Returns the number of bytes uploaded.
+    """
+    s3 = get_client('s3')
+    extra_args = {}
+    if content_type:
+        extra_args['ContentType'] = content_type
+
+    chunks = _byte_chunks(data, part_size)
+    if compress:
+        chunks = _gzip_chunks(chunks)
+
+    buffer = bytearray()
+    upload = None
+    total = 0
+    try:
+        for chunk in chunks:
+            buffer += chunk
+            total += len(chunk)
+            while len(buffer) >= part_size:
+                if upload is None:
+                    upload = _MultipartUpload(s3, s3_bucket, s3_key, extra_args, max_concurrency)
+                upload.add_part(bytes(buffer[:part_size]))
+                del buffer[:part_size]
+
+        if upload is None:
+            s3.put_object(Bucket=s3_bucket, Key=s3_key, Body=bytes(buffer), **extra_args)
+        else:
+            if buffer:
+                upload.add_part(bytes(buffer))
+            upload.complete()
+    except Exception:
+        if upload is not None:
+            upload.abort()
+        raise
+
+    print(f"Uploaded {total} bytes to S3://{s3_bucket}/{s3_key}")
+    return total
 
 
 def download_file_from_s3(s3_bucket, s3_key, filename):
     print(f"Downloading data from S3://{s3_bucket}/{s3_key}")
 
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     s3.download_file(s3_bucket, s3_key, filename)
 
 
-def delete_folder_from_s3(s3_bucket, folder_key):
-    print(f"Deleting all files in S3://{s3_bucket}/{folder_key}")
+def _delete_keys(s3, s3_bucket, keys):
+    response = s3.delete_objects(
+        Bucket=s3_bucket,
+        Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+    )
+    errors = response.get('Errors', [])
+    for error in errors:
+        print(f"Failed to delete {error['Key']}: {error.get('Code')} {error.get('Message')}")
+    return len(keys) - len(errors), errors
 
-    s3 = boto3.client('s3')
-    paginator = s3.get_paginator('list_objects_v2')
 
-    for page in paginator.paginate(Bucket=s3_bucket, Prefix=folder_key):
-        if 'Contents' in page:
-            for obj in page['Contents']:
-                print(f"Deleting: {obj['Key']}")
-                s3.delete_object(Bucket=s3_bucket, Key=obj['Key'])
+def delete_folder_from_s3(s3_bucket, folder_key, dry_run=False, max_concurrency=S3_DELETE_MAX_CONCURRENCY,
+                          raise_on_error=True):
+    """Delete everything under a prefix, up to 1000 keys per delete_objects call, with batches run in parallel.
+
+    Returns (count, errors): the number of keys deleted, or that would be with dry_run=True,
+    and the per-key errors S3 reported. Unless raise_on_error is False, any per-key error
+    raises a RuntimeError once every batch has finished, as files left behind would be read
+    again by whatever is written to the prefix next.
+    """
+    print(f"{'Counting' if dry_run else 'Deleting'} all files in S3://{s3_bucket}/{folder_key}")
+
+    s3 = get_client('s3')
+    paginator = s3.get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=s3_bucket, Prefix=folder_key,
+                               PaginationConfig={'PageSize': S3_DELETE_BATCH_SIZE})
+
+    count = 0
+    errors = []
+    in_flight = set()
+
+    def collect(done):
+        nonlocal count
+        for future in done:
+            in_flight.discard(future)
+            deleted, batch_errors = future.result()
+            count += deleted
+            errors.extend(batch_errors)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for page in pages:
+            keys = [obj['Key'] for obj in page.get('Contents', [])]
+            if not keys:
+                continue
+            if dry_run:
+                count += len(keys)
+                continue
+
+            if len(in_flight) >= max_concurrency:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            for i in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+                in_flight.add(executor.submit(_delete_keys, s3, s3_bucket, keys[i:i + S3_DELETE_BATCH_SIZE]))
+
+        collect(wait(in_flight).done)
+
+    print(f"{'Would delete' if dry_run else 'Deleted'} {count} files from S3://{s3_bucket}/{folder_key}"
+          + (f", {len(errors)} failed" if errors else ""))
+    if errors and raise_on_error:
+        raise RuntimeError(f"Failed to delete {len(errors)} files from S3://{s3_bucket}/{folder_key}")
+    return count, errors
 
 
 def load_text_from_s3(s3_bucket, s3_key):
     """Load text content from S3 (CSV, plain text, etc.)"""
     try:
-        s3 = boto3.client('s3')
+        s3 = get_client('s3')
         response = s3.get_object(Bucket=s3_bucket, Key=s3_key)
         content = response['Body'].read().decode('utf-8')
         return content
@@ -52,7 +290,7 @@ def load_text_from_s3(s3_bucket, s3_key):
 
 def load_json_from_s3(s3_bucket, s3_key):
     try:
-        s3 = boto3.client('s3')
+        s3 = get_client('s3')
         response = s3.get_object(Bucket=s3_bucket, Key=s3_key)
         content = response['Body'].read().decode('utf-8')
         return json.loads(content)
@@ -68,84 +306,351 @@ def load_json_from_s3(s3_bucket, s3_key):
 
 def save_json_to_s3(data, s3_bucket, s3_key):
     try:
-        s3 = boto3.client('s3')
-        s3.put_object(
+        chunks = json.JSONEncoder(separators=(',', ':')).iterencode(data)
+        upload_stream_to_s3(chunks, s3_bucket, s3_key, content_type='application/json')
+        print(f"Saved JSON to S3://{s3_bucket}/{s3_key}")
+        return True
+    except Exception as e:
+        print(f"Failed to save JSON to S3://{s3_bucket}/{s3_key}: {e}")
+        return False
+
+
+def get_s3_etag(s3_bucket, s3_key):
+    """ETag of an S3 object, or None if it doesn't exist or can't be read"""
+    try:
+        s3 = get_client('s3')
+        return s3.head_object(Bucket=s3_bucket, Key=s3_key)['ETag']
+    except Exception as e:
+        print(f"Failed to read ETag for S3://{s3_bucket}/{s3_key}: {e}")
+        return None
+
+
+def load_json_and_etag_from_s3(s3_bucket, s3_key):
+    """Load JSON from S3 along with the object's ETag, for a later save_json_to_s3_if_unchanged"""
+    try:
+        s3 = get_client('s3')
+        response = s3.get_object(Bucket=s3_bucket, Key=s3_key)
+        content = response['Body'].read().decode('utf-8')
+        return json.loads(content), response['ETag']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None, None
+        print(f"Failed to load JSON from S3://{s3_bucket}/{s3_key}: {e}")
+        return None, None
+    except Exception as e:
+        print(f"Failed to load JSON from S3://{s3_bucket}/{s3_key}: {e}")
+        return None, None
+
+
+def save_json_to_s3_if_unchanged(data, s3_bucket, s3_key, etag=None):
+    """Write compact JSON only if the object still has the given ETag (or still doesn't exist if etag is None).
+
+    Returns the new ETag, or None if another writer got there first or the write failed.
+    """
+    conditions = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    try:
+        s3 = get_client('s3')
+        response = s3.put_object(
             Bucket=s3_bucket,
             Key=s3_key,
-            Body=json.dumps(data, indent=2),
-            ContentType='application/json'
+            Body=json.dumps(data, separators=(',', ':')),
+            ContentType='application/json',
+            **conditions
         )
         print(f"Saved JSON to S3://{s3_bucket}/{s3_key}")
-        return True
+        return response['ETag']
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            print(f"S3://{s3_bucket}/{s3_key} was changed by another writer")
+            return None
+        print(f"Failed to save JSON to S3://{s3_bucket}/{s3_key}: {e}")
+        return None
     except Exception as e:
         print(f"Failed to save JSON to S3://{s3_bucket}/{s3_key}: {e}")
-        return False
+        return None
 
 
-def add_glue_partition_for(year, month, day, table, database, results_bucket):
-    sql = f"ALTER TABLE {table} ADD IF NOT EXISTS PARTITION (year='{year}', month='{month}', day='{day}')"
-    execute_athena_command(sql, database, results_bucket)
+def list_glue_partitions(table, database):
+    """Values of every partition of a Glue table, as tuples of strings"""
+    paginator = get_client('glue').get_paginator('get_partitions')
+    partitions = []
+    for page in paginator.paginate(DatabaseName=database, TableName=table):
+        partitions.extend(tuple(partition['Values']) for partition in page['Partitions'])
+    return partitions
 
 
-def execute_athena_command(sql, database, results_bucket, wait_seconds=10):
-    athena = boto3.client('athena')
-
-    print(f"Executing: {sql}")
-
-    query_start = athena.start_query_execution(
-        QueryString=sql,
-        QueryExecutionContext={
-            'Database': database
-        },
-        ResultConfiguration={
-            'OutputLocation': f"s3://{results_bucket}/Unsaved/"
-        }
-    )
+def get_glue_partition_location(table, database, values):
+    """S3 location of one partition, or None if it isn't registered"""
+    try:
+        response = get_client('glue').get_partition(
+            DatabaseName=database, TableName=table, PartitionValues=[str(value) for value in values]
+        )
+        return response['Partition']['StorageDescriptor']['Location']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'EntityNotFoundException':
+            return None
+        raise
+
+
+def _registered_partitions(table, database):
+    """Partitions known to exist, loaded from Glue the first time a table is used in this process"""
+    key = (database, table)
+    with _partitions_lock:
+        if key not in _partitions:
+            known = set()
+            try:
+                known.update(list_glue_partitions(table, database))
+            except Exception as e:
+                print(f"Could not list partitions of {database}.{table}: {e}")
+            _partitions[key] = known
+        return _partitions[key]
+
+
+def add_glue_partitions(partitions, table, database, results_bucket, wait_seconds=30):
+    """Register (year, month, day) partitions, skipping any already known to exist.
+
+    New partitions are added PARTITIONS_PER_STATEMENT to an ALTER TABLE statement, with the
+    statements run concurrently. Returns True if every new partition was added.
+    """
+    known = _registered_partitions(table, database)
+    new_partitions = sorted({tuple(str(value) for value in partition) for partition in partitions} - known)
+    if not new_partitions:
+        print(f"Partitions already registered for {database}.{table}")
+        return True
+
+    statements = []
+    for i in range(0, len(new_partitions), PARTITIONS_PER_STATEMENT):
+        specs = " ".join(
+            f"PARTITION (year='{year}', month='{month}', day='{day}')"
+            for year, month, day in new_partitions[i:i + PARTITIONS_PER_STATEMENT]
+        )
+        statements.append(f"ALTER TABLE {table} ADD IF NOT EXISTS {specs}")
 
-    for count in range(wait_seconds):
-        query_execution = athena.get_query_execution(QueryExecutionId=query_start['QueryExecutionId'])
-        state = query_execution.get('QueryExecution', {}).get('Status', {}).get('State')
+    succeeded = execute_athena_commands(statements, database, results_bucket, wait_seconds)
+    if succeeded:
+        with _partitions_lock:
+            known.update(new_partitions)
+    return succeeded
 
-        if state == 'FAILED':
-            reason = query_execution.get('QueryExecution', {}).get('Status', {}).get('StateChangeReason')
-            print(f"Query failed: {reason}")
-            return False
-        elif state == 'SUCCEEDED':
-            print('Query succeeded')
-            return True
 
-        sleep(1)
+def add_glue_partition_for(year, month, day, table, database, results_bucket):
+    return add_glue_partitions([(year, month, day)], table, database, results_bucket, wait_seconds=10)
+
+
+def clear_partitions():
+    with _partitions_lock:
+        _partitions.clear()
+
+
+class AthenaQuery:
+    """Handle on a submitted Athena statement, updated by AthenaRunner.wait"""
+
+    def __init__(self, query_execution_id, sql):
+        self.query_execution_id = query_execution_id
+        self.sql = sql
+        self.state = 'QUEUED'
+        self.reason = None
+        self.output_location = None
+        self.data_scanned_bytes = None
+        self.engine_execution_ms = None
+
+    @property
+    def done(self):
+        return self.state in ATHENA_FINISHED_STATES
+
+    @property
+    def succeeded(self):
+        return self.state == 'SUCCEEDED'
+
+    def update(self, query_execution):
+        status = query_execution.get('Status', {})
+        statistics = query_execution.get('Statistics', {})
+        self.state = status.get('State', self.state)
+        self.reason = status.get('StateChangeReason', self.reason)
+        self.output_location = query_execution.get('ResultConfiguration', {}).get('OutputLocation')
+        self.data_scanned_bytes = statistics.get('DataScannedInBytes')
+        self.engine_execution_ms = statistics.get('EngineExecutionTimeInMillis')
+
+    def __repr__(self):
+        return f"AthenaQuery({self.query_execution_id!r}, {self.state})"
+
+
+class AthenaRunner:
+    """Submits Athena statements without waiting, then polls all of them together.
+
+    Polling backs off exponentially with jitter, from ATHENA_POLL_INITIAL_SECONDS up to
+    ATHENA_POLL_MAX_SECONDS, using one batch_get_query_execution call per 50 queries.
+    Anything still running when the timeout expires is stopped.
+    """
+
+    def __init__(self, database, results_bucket, athena=None, clock=monotonic, sleep=sleep, jitter=random.random):
+        self.database = database
+        self.results_bucket = results_bucket
+        self._athena = athena or get_client('athena')
+        self._clock = clock
+        self._sleep = sleep
+        self._jitter = jitter
+
+    def submit(self, sql):
+        print(f"Executing: {sql}")
+        query_start = self._athena.start_query_execution(
+            QueryString=sql,
+            QueryExecutionContext={
+                'Database': self.database
+            },
+            ResultConfiguration={
+                'OutputLocation': f"s3://{self.results_bucket}/Unsaved/"
+            }
+        )
+        return AthenaQuery(query_start['QueryExecutionId'], sql)
+
+    def submit_all(self, statements):
+        return [self.submit(sql) for sql in statements]
+
+    def wait(self, queries, timeout_seconds):
+        deadline = self._clock() + timeout_seconds
+        delay = ATHENA_POLL_INITIAL_SECONDS
+
+        while True:
+            self._poll(queries)
+            running = [query for query in queries if not query.done]
+            remaining = deadline - self._clock()
+            if not running or remaining <= 0:
+                break
+
+            self._sleep(min(delay * (0.5 + self._jitter() / 2), remaining))
+            delay = min(delay * 2, ATHENA_POLL_MAX_SECONDS)
+
+        for query in running:
+            self._stop(query, timeout_seconds)
+
+        for query in queries:
+            if query.succeeded:
+                print(f"Query {query.query_execution_id} scanned {query.data_scanned_bytes} bytes "
+                      f"in {query.engine_execution_ms} ms")
+        return queries
+
+    def run(self, statements, timeout_seconds):
+        """Submit all statements at once and wait for them to finish. Returns their AthenaQuery handles."""
+        return self.wait(self.submit_all(statements), timeout_seconds)
+
+    def _poll(self, queries):
+        by_id = {query.query_execution_id: query for query in queries if not query.done}
+        ids = list(by_id)
+        for i in range(0, len(ids), ATHENA_BATCH_GET_LIMIT):
+            response = self._athena.batch_get_query_execution(QueryExecutionIds=ids[i:i + ATHENA_BATCH_GET_LIMIT])
+            for query_execution in response.get('QueryExecutions', []):
+                by_id[query_execution['QueryExecutionId']].update(query_execution)
+
+    def _stop(self, query, timeout_seconds):
+        print(f"Query {query.query_execution_id} timed out after {timeout_seconds} seconds, stopping it")
+        try:
+            self._athena.stop_query_execution(QueryExecutionId=query.query_execution_id)
+        except Exception as e:
+            print(f"Failed to stop query {query.query_execution_id}: {e}")
+        query.state = 'CANCELLED'
+        query.reason = f"Timed out after {timeout_seconds} seconds"
+
+
+def execute_athena_commands(statements, database, results_bucket, wait_seconds=10):
+    """Run several independent statements concurrently. Returns True only if all of them succeeded."""
+    queries = AthenaRunner(database, results_bucket).run(statements, wait_seconds)
+    for query in queries:
+        if not query.succeeded:
+            print(f"Query failed: {query.reason}")
+    return all(query.succeeded for query in queries)
 
-    print(f"Query timed out after {wait_seconds} seconds")
+
+def execute_athena_command(sql, database, results_bucket, wait_seconds=10):
+    query = AthenaRunner(database, results_bucket).run([sql], wait_seconds)[0]
+
+    if query.succeeded:
+        print('Query succeeded')
+        return True
+
+    print(f"Query failed: {query.reason}")
     return False
 
 
 def execute_athena_query(sql, database, results_bucket, wait_seconds=30):
-    athena = boto3.client('athena')
-
-    query_start = athena.start_query_execution(
-        QueryString=sql,
-        QueryExecutionContext={
-            'Database': database
-        },
-        ResultConfiguration={
-            'OutputLocation': f"s3://{results_bucket}/Unsaved/"
-        }
+    query = AthenaRunner(database, results_bucket).run([sql], wait_seconds)[0]
+
+    if query.succeeded:
+        return query.output_location
+
+    print(f"Query failed: {query.reason}")
+    return None
+
+
+def split_s3_location(s3_url):
+    bucket, _, key = s3_url.replace('s3://', '', 1).partition('/')
+    return bucket, key
+
+
+def _athena_columns(result_set):
+    """(name, converter) for each column of a GetQueryResults result set"""
+    return [
+        (column['Name'], ATHENA_TYPE_CONVERTERS.get(column['Type'].lower()))
+        for column in result_set['ResultSetMetadata']['ColumnInfo']
+    ]
+
+
+def _typed_row(columns, values):
+    row = {}
+    for (name, convert), value in zip(columns, values):
+        if value is None or (value == '' and convert is not None):
+            row[name] = None
+        else:
+            row[name] = convert(value) if convert else value
+    return row
+
+
+def _read_athena_result_pages(athena, query_execution_id):
+    paginator = athena.get_paginator('get_query_results')
+    pages = paginator.paginate(
+        QueryExecutionId=query_execution_id,
+        PaginationConfig={'PageSize': ATHENA_RESULTS_PAGE_SIZE}
     )
 
-    for count in range(wait_seconds):
-        query_execution = athena.get_query_execution(QueryExecutionId=query_start['QueryExecutionId'])
-        state = query_execution.get('QueryExecution', {}).get('Status', {}).get('State')
+    columns = None
+    for page in pages:
+        rows = page['ResultSet']['Rows']
+        if columns is None:
+            columns = _athena_columns(page['ResultSet'])
+            header = [cell.get('VarCharValue') for cell in rows[0]['Data']] if rows else None
+            if header == [name for name, _ in columns]:
+                rows = rows[1:]
 
-        if state == 'FAILED':
-            print(
-                "Query failed: " + query_execution.get('QueryExecution', {}).get('Status', {}).get('StateChangeReason')
-            )
-            return None
-        elif state == 'SUCCEEDED':
-            return query_execution['QueryExecution']['ResultConfiguration']['OutputLocation']
+        for result_row in rows:
+            yield _typed_row(columns, [cell.get('VarCharValue') for cell in result_row['Data']])
 
-        sleep(1)
 
-    print(f"Query timed out after {wait_seconds} attempts")
-    return None
+def _stream_athena_result_csv(athena, query_execution_id, s3_bucket, s3_key):
+    metadata = athena.get_query_results(QueryExecutionId=query_execution_id, MaxResults=1)
+    columns = _athena_columns(metadata['ResultSet'])
+
+    body = get_client('s3').get_object(Bucket=s3_bucket, Key=s3_key)['Body']
+    try:
+        reader = csv.reader(codecs.getreader('utf-8')(body))
+        next(reader, None)
+        for values in reader:
+            yield _typed_row(columns, values)
+    finally:
+        body.close()
+
+
+def read_athena_results(output_location, stream_threshold_bytes=ATHENA_STREAM_THRESHOLD_BYTES):
+    """Yield the rows of a finished query as dicts, with values converted from their Athena column types.
+
+    Small results are paged through GetQueryResults; results larger than stream_threshold_bytes
+    are streamed from the CSV in S3 instead. The query id is the name of the output file.
+    NULLs come back as None - in the CSV, an empty non-string value is taken as NULL.
+    """
+    s3_bucket, s3_key = split_s3_location(output_location)
+    query_execution_id = s3_key.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+    athena = get_client('athena')
+
+    size = get_client('s3').head_object(Bucket=s3_bucket, Key=s3_key)['ContentLength']
+    if size > stream_threshold_bytes:
+        return _stream_athena_result_csv(athena, query_execution_id, s3_bucket, s3_key)
+    return _read_athena_result_pages(athena, query_execution_id)
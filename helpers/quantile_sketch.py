@@ -0,0 +1,214 @@
+import bisect
+from datetime import datetime
+from helpers.aws import load_json_and_etag_from_s3, save_json_to_s3_if_unchanged
+
+SKETCH_COMPRESSION = 100
+SKETCH_PREFIX = "temperature_sketches"
+SKETCH_SAVE_ATTEMPTS = 3
+SUMMARY_QUANTILES = (("low_temp", 0.05), ("high_temp", 0.95), ("median_temp", 0.50))
+
+
+class TDigest:
+    """Mergeable quantile sketch (a merging t-digest).
+
+    Values are held as weighted centroids, kept small in the tails and larger in the middle,
+    so extreme quantiles such as 0.05 and 0.95 stay accurate. Two digests of disjoint data
+    merge into a digest of the union, which is what lets per-run sketches be combined.
+    """
+
+    def __init__(self, compression=SKETCH_COMPRESSION):
+        self.compression = compression
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._centroids = []
+        self._buffer = []
+
+    def add(self, value, weight=1):
+        value = float(value)
+        self._buffer.append((value, weight))
+        self.count += weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self._buffer) >= self.compression * 5:
+            self._compress()
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        other._compress()
+        self._buffer.extend(other._centroids)
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        if not self._buffer:
+            return
+
+        points = sorted(self._centroids + self._buffer)
+        self._buffer = []
+        merged = [list(points[0])]
+        cumulative = 0.0
+        for mean, weight in points[1:]:
+            current = merged[-1]
+            q = (cumulative + (current[1] + weight) / 2) / self.count
+            if current[1] + weight <= max(1.0, 4 * self.count * q * (1 - q) / self.compression):
+                current[0] += (mean - current[0]) * weight / (current[1] + weight)
+                current[1] += weight
+            else:
+                cumulative += current[1]
+                merged.append([mean, weight])
+        self._centroids = [(mean, weight) for mean, weight in merged]
+
+    def quantile(self, q):
+        """Estimated value at quantile q (0 to 1), or None if nothing has been added"""
+        self._compress()
+        if not self._centroids:
+            return None
+        if len(self._centroids) == 1:
+            return self._centroids[0][0]
+
+        # Interpolate between centroid centres, with min and max as the outer anchors
+        target = q * self.count
+        centres = []
+        cumulative = 0.0
+        for mean, weight in self._centroids:
+            centres.append(cumulative + weight / 2)
+            cumulative += weight
+
+        if target <= centres[0]:
+            return self._interpolate(target, 0.0, self.min, centres[0], self._centroids[0][0])
+        if target >= centres[-1]:
+            return self._interpolate(target, centres[-1], self._centroids[-1][0], self.count, self.max)
+
+        i = bisect.bisect_right(centres, target) - 1
+        return self._interpolate(target, centres[i], self._centroids[i][0],
+                                 centres[i + 1], self._centroids[i + 1][0])
+
+    @staticmethod
+    def _interpolate(x, x0, y0, x1, y1):
+        if x1 <= x0:
+            return y0
+        return y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+
+    def to_dict(self):
+        self._compress()
+        return {
+            "n": self.count,
+            "min": self.min,
+            "max": self.max,
+            "c": [value for mean, weight in self._centroids for value in (round(mean, 3), weight)]
+        }
+
+    @classmethod
+    def from_dict(cls, data, compression=SKETCH_COMPRESSION):
+        digest = cls(compression)
+        digest.count = data["n"]
+        digest.min = data["min"]
+        digest.max = data["max"]
+        values = data["c"]
+        digest._centroids = [(values[i], values[i + 1]) for i in range(0, len(values), 2)]
+        return digest
+
+
+def month_sketch_key(source, year, month, prefix=SKETCH_PREFIX):
+    return f"{prefix}/source={source}/year={year}/month={month}/sketches.json"
+
+
+def _month_of(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return timestamp.year, timestamp.month
+
+
+class MonthlySiteSketches:
+    """Temperature sketches per site per month, accumulated during one ingest run"""
+
+    def __init__(self):
+        self._months = {}
+
+    def __len__(self):
+        return sum(len(sites) for sites in self._months.values())
+
+    def add(self, site_id, site_name, lat, lon, timestamp, value):
+        if site_id is None or value in (None, ""):
+            return
+        try:
+            value = float(value)
+            year, month = _month_of(timestamp)
+        except (TypeError, ValueError):
+            return
+
+        sites = self._months.setdefault((year, month), {})
+        entry = sites.get(str(site_id))
+        if entry is None:
+            entry = sites[str(site_id)] = {"site_name": site_name, "lat": lat, "lon": lon, "digest": TDigest()}
+        entry["digest"].add(value)
+
+    def months(self):
+        return sorted(self._months)
+
+    def sites_for(self, year, month):
+        return self._months.get((year, month), {})
+
+    def save(self, s3_bucket, source, replace=False, prefix=SKETCH_PREFIX):
+        """Fold these sketches into the month objects in S3.
+
+        By default each site's sketch is merged with what is stored, for ingest that only sees
+        new observations. With replace=True the stored sketch is overwritten instead, for ingest
+        that sees a site's whole month at once and may be re-run.
+        """
+        saved = True
+        for year, month in self.months():
+            saved = _save_month(s3_bucket, month_sketch_key(source, year, month, prefix),
+                                self._months[(year, month)], replace) and saved
+        return saved
+
+
+def _save_month(s3_bucket, s3_key, sites, replace):
+    # Conditional writes, so concurrent ingests each merge into the latest copy rather than overwrite it
+    for attempt in range(SKETCH_SAVE_ATTEMPTS):
+        stored, etag = load_json_and_etag_from_s3(s3_bucket, s3_key)
+        stored_sites = (stored or {}).get("sites", {})
+
+        for site_id, entry in sites.items():
+            digest = TDigest().merge(entry["digest"])
+            if not replace and site_id in stored_sites:
+                digest.merge(TDigest.from_dict(stored_sites[site_id]["digest"]))
+            stored_sites[site_id] = {"site_name": entry["site_name"], "lat": entry["lat"], "lon": entry["lon"],
+                                     "digest": digest.to_dict()}
+
+        if save_json_to_s3_if_unchanged({"sites": stored_sites}, s3_bucket, s3_key, etag):
+            return True
+        print(f"Retrying sketch save for S3://{s3_bucket}/{s3_key} (attempt {attempt + 2})")
+
+    print(f"Gave up saving sketches to S3://{s3_bucket}/{s3_key}")
+    return False
+
+
+def load_month_sketches(s3_bucket, year, month, sources=("datahub",), prefix=SKETCH_PREFIX):
+    """Stored sketches for one month, merged across sources: {site_id: {site_name, lat, lon, digest}}"""
+    merged = {}
+    for source in sources:
+        stored, _ = load_json_and_etag_from_s3(s3_bucket, month_sketch_key(source, year, month, prefix))
+        for site_id, entry in (stored or {}).get("sites", {}).items():
+            digest = TDigest.from_dict(entry["digest"])
+            if site_id in merged:
+                merged[site_id]["digest"].merge(digest)
+            else:
+                merged[site_id] = {**entry, "digest": digest}
+    return merged
+
+
+def monthly_summary(s3_bucket, year, month, sources=("datahub",), prefix=SKETCH_PREFIX):
+    """Rows shaped like lake.weather_monthly_site_summary, computed from the stored sketches"""
+    rows = []
+    for site_id, entry in sorted(load_month_sketches(s3_bucket, year, month, sources, prefix).items()):
+        row = {"site_id": site_id, "site_name": entry["site_name"], "lat": entry["lat"], "lon": entry["lon"],
+               "year": year, "month": month}
+        row.update((column, entry["digest"].quantile(q)) for column, q in SUMMARY_QUANTILES)
+        rows.append(row)
+    return rows
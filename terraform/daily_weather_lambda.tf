@@ -23,6 +23,12 @@ resource "aws_lambda_function" "datapoint_etl_lambda_function" {
   function_name    = var.datapoint_etl_function_name
   source_code_hash = filebase64sha256("weather_etl.zip")
   timeout          = 300
+
+  environment {
+    variables = {
+      INCOMING_PARTITION_PROJECTION = tostring(var.incoming_weather_partition_projection)
+    }
+  }
 }
 
 resource "aws_cloudwatch_event_rule" "time_to_load_weather_data" {
@@ -80,6 +86,9 @@ resource "aws_iam_policy" "datapoint_etl_lambda_policy" {
         "logs:PutLogEvents",
         "athena:StartQueryExecution",
         "athena:GetQueryExecution",
+        "athena:BatchGetQueryExecution",
+        "athena:StopQueryExecution",
+        "athena:GetQueryResults",
         "glue:GetDatabase",
         "glue:GetTable",
         "glue:CreatePartition",
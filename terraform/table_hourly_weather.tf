@@ -1,3 +1,25 @@
+variable "incoming_weather_partition_projection" {
+  description = "Let Athena derive incoming.weather partitions from the S3 layout, instead of registering each day"
+  default     = false
+}
+
+variable "incoming_weather_projection_years" {
+  default = "2021,2040"
+}
+
+locals {
+  incoming_weather_projection_parameters = {
+    "projection.enabled"        = "true"
+    "projection.year.type"      = "integer"
+    "projection.year.range"     = var.incoming_weather_projection_years
+    "projection.month.type"     = "integer"
+    "projection.month.range"    = "1,12"
+    "projection.day.type"       = "integer"
+    "projection.day.range"      = "1,31"
+    "storage.location.template" = "s3://dantelore.data.incoming/weather/year=$${year}/month=$${month}/day=$${day}"
+  }
+}
+
 resource "aws_glue_catalog_table" "incoming_weather_glue_table" {
   database_name = "incoming"
   name = "weather"
@@ -5,10 +27,13 @@ resource "aws_glue_catalog_table" "incoming_weather_glue_table" {
 
   table_type = "EXTERNAL_TABLE"
 
-  parameters = {
-    EXTERNAL                    = "TRUE"
-    "use.null.for.invalid.data" = "true"
-  }
+  parameters = merge(
+    {
+      EXTERNAL                    = "TRUE"
+      "use.null.for.invalid.data" = "true"
+    },
+    { for key, value in local.incoming_weather_projection_parameters : key => value if var.incoming_weather_partition_projection }
+  )
 
   storage_descriptor {
     location = "s3://dantelore.data.incoming/weather"
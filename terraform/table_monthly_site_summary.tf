@@ -43,16 +43,6 @@ resource "aws_glue_catalog_table" "weather_monthly_site_summary_glue_table" {
       type = "double"
     }
 
-    columns {
-      name = "year"
-      type = "bigint"
-    }
-
-    columns {
-      name = "month"
-      type = "bigint"
-    }
-
     columns {
       name = "low_temp"
       type = "double"
@@ -68,4 +58,13 @@ resource "aws_glue_catalog_table" "weather_monthly_site_summary_glue_table" {
       type = "double"
     }
   }
-}
\ No newline at end of file
+
+  partition_keys {
+    name = "year"
+    type = "bigint"
+  }
+  partition_keys {
+    name = "month"
+    type = "bigint"
+  }
+}
@@ -3,7 +3,7 @@ variable "weather_data_model_lambda" {
 }
 
 variable "weather_data_model_handler" {
-  default = "lambda_function.handler"
+  default = "weather_data_model.lambda_function.handler"
 }
 
 variable "weather_data_model_cloudwatch_event" {
@@ -22,7 +22,7 @@ resource "aws_lambda_function" "weather_data_model_lambda_function" {
   filename         = "weather_data_model.zip"
   function_name    = var.weather_data_model_lambda
   source_code_hash = filebase64sha256("weather_data_model.zip")
-  timeout          = 60
+  timeout          = 300
 }
 
 resource "aws_cloudwatch_event_rule" "time_to_model_weather_data" {
@@ -80,13 +80,18 @@ resource "aws_iam_policy" "weather_data_model_lambda_policy" {
         "logs:PutLogEvents",
         "athena:StartQueryExecution",
         "athena:GetQueryExecution",
+        "athena:BatchGetQueryExecution",
+        "athena:StopQueryExecution",
+        "athena:GetQueryResults",
         "glue:GetDatabase",
         "glue:GetTable",
         "glue:CreatePartition",
         "glue:BatchCreatePartition",
         "glue:UpdatePartition",
         "glue:GetPartition",
-        "glue:GetPartitions"
+        "glue:GetPartitions",
+        "glue:DeletePartition",
+        "glue:BatchDeletePartition"
       ],
       "Resource": [
           "*"
@@ -123,7 +128,9 @@ resource "aws_iam_policy" "weather_data_model_lambda_policy" {
       ],
       "Resource": [
           "arn:aws:s3:::dantelore.data.lake/weather/*",
-          "arn:aws:s3:::dantelore.data.lake/weather_monthly_site_summary/*"
+          "arn:aws:s3:::dantelore.data.lake/weather_builds/*",
+          "arn:aws:s3:::dantelore.data.lake/weather_monthly_site_summary/*",
+          "arn:aws:s3:::dantelore.data.lake/weather_monthly_site_summary_builds/*"
       ],
       "Effect": "Allow",
       "Sid": ""
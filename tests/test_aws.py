@@ -0,0 +1,350 @@
+import gzip
+import io
+import pytest
+from datetime import datetime
+from unittest.mock import Mock, patch
+from helpers import aws
+
+
+class TestClientPool:
+    def setup_method(self):
+        aws.clear_clients()
+
+    def teardown_method(self):
+        aws.clear_clients()
+
+    @patch('helpers.aws.boto3.client')
+    def test_clients_are_created_once_per_service_and_region(self, mock_client):
+        mock_client.side_effect = lambda service, **kwargs: Mock(name=service)
+
+        s3 = aws.get_client('s3')
+
+        assert aws.get_client('s3') is s3
+        assert aws.get_client('athena') is not s3
+        assert aws.get_client('s3', 'us-east-1') is not s3
+        assert mock_client.call_count == 3
+        assert mock_client.call_args_list[0][1] == {'region_name': None, 'config': aws.CLIENT_CONFIG}
+
+    @patch('helpers.aws.boto3.client')
+    def test_helpers_share_the_pooled_client(self, mock_client):
+        s3 = mock_client.return_value
+        s3.head_object.return_value = {'ETag': '"abc"'}
+
+        aws.load_file_to_s3('file.json', 'bucket', 'key')
+        etag = aws.get_s3_etag('bucket', 'key')
+
+        assert etag == '"abc"'
+        mock_client.assert_called_once()
+        s3.upload_file.assert_called_once_with('file.json', 'bucket', 'key', Config=aws.TRANSFER_CONFIG)
+
+    def test_client_config_tunes_pool_and_retries(self):
+        assert aws.CLIENT_CONFIG.max_pool_connections == aws.MAX_POOL_CONNECTIONS
+        assert aws.CLIENT_CONFIG.retries == {'max_attempts': aws.MAX_RETRY_ATTEMPTS, 'mode': 'adaptive'}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _execution(query_id, state, scanned=None, engine_ms=None):
+    return {
+        'QueryExecutionId': query_id,
+        'Status': {'State': state},
+        'ResultConfiguration': {'OutputLocation': f"s3://results/Unsaved/{query_id}.csv"},
+        'Statistics': {'DataScannedInBytes': scanned, 'EngineExecutionTimeInMillis': engine_ms}
+    }
+
+
+class TestAthenaRunner:
+    def _runner(self, athena, clock):
+        return aws.AthenaRunner("lake", "results", athena=athena, clock=clock, sleep=clock.sleep, jitter=lambda: 1.0)
+
+    def test_submits_all_statements_then_polls_them_together(self):
+        clock = FakeClock()
+        athena = Mock()
+        athena.start_query_execution.side_effect = [{'QueryExecutionId': 'q1'}, {'QueryExecutionId': 'q2'}]
+        athena.batch_get_query_execution.side_effect = [
+            {'QueryExecutions': [_execution('q1', 'RUNNING'), _execution('q2', 'SUCCEEDED', 100, 7)]},
+            {'QueryExecutions': [_execution('q1', 'SUCCEEDED', 2048, 350)]}
+        ]
+
+        q1, q2 = self._runner(athena, clock).run(["select 1", "select 2"], timeout_seconds=30)
+
+        assert athena.start_query_execution.call_count == 2
+        assert athena.batch_get_query_execution.call_args_list[0][1] == {'QueryExecutionIds': ['q1', 'q2']}
+        assert athena.batch_get_query_execution.call_args_list[1][1] == {'QueryExecutionIds': ['q1']}
+        assert q1.succeeded and q2.succeeded
+        assert (q1.data_scanned_bytes, q1.engine_execution_ms) == (2048, 350)
+        assert q1.output_location == "s3://results/Unsaved/q1.csv"
+        assert clock.sleeps == [aws.ATHENA_POLL_INITIAL_SECONDS]
+
+    def test_polling_backs_off_up_to_the_maximum(self):
+        clock = FakeClock()
+        athena = Mock()
+        athena.start_query_execution.return_value = {'QueryExecutionId': 'q1'}
+        athena.batch_get_query_execution.side_effect = (
+            [{'QueryExecutions': [_execution('q1', 'RUNNING')]}] * 6 +
+            [{'QueryExecutions': [_execution('q1', 'SUCCEEDED')]}]
+        )
+
+        self._runner(athena, clock).run(["select 1"], timeout_seconds=60)
+
+        assert clock.sleeps == [0.25, 0.5, 1.0, 2.0, 4.0, 5.0]
+
+    def test_timeout_stops_queries_still_running(self):
+        clock = FakeClock()
+        athena = Mock()
+        athena.start_query_execution.return_value = {'QueryExecutionId': 'q1'}
+        athena.batch_get_query_execution.return_value = {'QueryExecutions': [_execution('q1', 'RUNNING')]}
+
+        query, = self._runner(athena, clock).run(["select 1"], timeout_seconds=2)
+
+        assert clock.now == 2
+        athena.stop_query_execution.assert_called_once_with(QueryExecutionId='q1')
+        assert query.state == 'CANCELLED'
+        assert not query.succeeded
+
+    @patch('helpers.aws.get_client')
+    def test_execute_athena_query_returns_output_location(self, mock_get_client):
+        athena = mock_get_client.return_value
+        athena.start_query_execution.return_value = {'QueryExecutionId': 'q1'}
+        athena.batch_get_query_execution.return_value = {'QueryExecutions': [_execution('q1', 'SUCCEEDED')]}
+
+        assert aws.execute_athena_query("select 1", "lake", "results") == "s3://results/Unsaved/q1.csv"
+        assert aws.execute_athena_command("select 1", "lake", "results") is True
+
+    @patch('helpers.aws.get_client')
+    def test_execute_athena_command_reports_failure(self, mock_get_client):
+        athena = mock_get_client.return_value
+        athena.start_query_execution.return_value = {'QueryExecutionId': 'q1'}
+        failed = _execution('q1', 'FAILED')
+        failed['Status']['StateChangeReason'] = 'Syntax error'
+        athena.batch_get_query_execution.return_value = {'QueryExecutions': [failed]}
+
+        assert aws.execute_athena_command("select", "lake", "results") is False
+        assert aws.execute_athena_query("select", "lake", "results") is None
+
+
+SITE_COLUMNS = {'ColumnInfo': [
+    {'Name': 'site_id', 'Type': 'varchar'},
+    {'Name': 'site_elevation', 'Type': 'double'},
+    {'Name': 'observation_ts', 'Type': 'timestamp'},
+    {'Name': 'rows', 'Type': 'bigint'}
+]}
+
+
+def _result_row(*values):
+    return {'Data': [{} if value is None else {'VarCharValue': value} for value in values]}
+
+
+class TestReadAthenaResults:
+    @patch('helpers.aws.get_client')
+    def test_small_results_are_paged_and_typed(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.head_object.return_value = {'ContentLength': 200}
+        client.get_paginator.return_value.paginate.return_value = [
+            {'ResultSet': {'ResultSetMetadata': SITE_COLUMNS, 'Rows': [
+                _result_row('site_id', 'site_elevation', 'observation_ts', 'rows'),
+                _result_row('3005', '82.0', '2024-01-15 12:00:00.000', '24')
+            ]}},
+            {'ResultSet': {'ResultSetMetadata': SITE_COLUMNS, 'Rows': [
+                _result_row('3017', None, '2024-01-15 13:00:00.000', None)
+            ]}}
+        ]
+
+        rows = list(aws.read_athena_results("s3://results/Unsaved/2024/01/15/abc-123.csv"))
+
+        client.get_paginator.return_value.paginate.assert_called_once_with(
+            QueryExecutionId='abc-123', PaginationConfig={'PageSize': aws.ATHENA_RESULTS_PAGE_SIZE}
+        )
+        assert rows == [
+            {'site_id': '3005', 'site_elevation': 82.0, 'observation_ts': datetime(2024, 1, 15, 12), 'rows': 24},
+            {'site_id': '3017', 'site_elevation': None, 'observation_ts': datetime(2024, 1, 15, 13), 'rows': None}
+        ]
+
+    @patch('helpers.aws.get_client')
+    def test_large_results_are_streamed_from_s3(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.head_object.return_value = {'ContentLength': aws.ATHENA_STREAM_THRESHOLD_BYTES + 1}
+        client.get_query_results.return_value = {'ResultSet': {'ResultSetMetadata': SITE_COLUMNS, 'Rows': []}}
+        client.get_object.return_value = {'Body': io.BytesIO(
+            b'"site_id","site_elevation","observation_ts","rows"\n'
+            b'"3005","82.0","2024-01-15 12:00:00.000","24"\n'
+            b'"3017",,"2024-01-15 13:00:00.000",\n'
+        )}
+
+        rows = aws.read_athena_results("s3://results/Unsaved/abc-123.csv")
+
+        assert next(rows) == {
+            'site_id': '3005', 'site_elevation': 82.0, 'observation_ts': datetime(2024, 1, 15, 12), 'rows': 24
+        }
+        assert next(rows)['site_elevation'] is None
+        assert list(rows) == []
+        client.get_query_results.assert_called_once_with(QueryExecutionId='abc-123', MaxResults=1)
+        client.get_object.assert_called_once_with(Bucket='results', Key='Unsaved/abc-123.csv')
+
+
+class TestStreamingUpload:
+    @patch('helpers.aws.get_client')
+    def test_small_stream_is_sent_in_one_put(self, mock_get_client):
+        s3 = mock_get_client.return_value
+
+        size = aws.upload_stream_to_s3(['{"a":1}\n', '{"b":2}\n'], "bucket", "rows.json",
+                                       content_type='application/x-ndjson')
+
+        s3.put_object.assert_called_once_with(Bucket="bucket", Key="rows.json", Body=b'{"a":1}\n{"b":2}\n',
+                                              ContentType='application/x-ndjson')
+        s3.create_multipart_upload.assert_not_called()
+        assert size == 16
+
+    @patch('helpers.aws.get_client')
+    def test_compressed_stream_is_valid_gzip(self, mock_get_client):
+        s3 = mock_get_client.return_value
+
+        aws.upload_stream_to_s3(io.BytesIO(b'x' * 1000), "bucket", "file.gz", compress=True)
+
+        body = s3.put_object.call_args[1]['Body']
+        assert gzip.decompress(body) == b'x' * 1000
+        assert len(body) < 100
+
+    @patch('helpers.aws.get_client')
+    def test_large_stream_is_uploaded_in_parallel_parts(self, mock_get_client):
+        s3 = mock_get_client.return_value
+        s3.create_multipart_upload.return_value = {'UploadId': 'up-1'}
+        s3.upload_part.side_effect = lambda **kwargs: {'ETag': f"etag-{kwargs['PartNumber']}"}
+
+        chunks = (b'0123456789' for _ in range(25))
+        aws.upload_stream_to_s3(chunks, "bucket", "big.json", part_size=100, max_concurrency=2)
+
+        bodies = {c[1]['PartNumber']: c[1]['Body'] for c in s3.upload_part.call_args_list}
+        assert [len(bodies[n]) for n in sorted(bodies)] == [100, 100, 50]
+        s3.complete_multipart_upload.assert_called_once_with(
+            Bucket="bucket", Key="big.json", UploadId='up-1',
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': f"etag-{n}"} for n in (1, 2, 3)]}
+        )
+        s3.put_object.assert_not_called()
+
+    @patch('helpers.aws.get_client')
+    def test_failed_part_aborts_the_upload(self, mock_get_client):
+        s3 = mock_get_client.return_value
+        s3.create_multipart_upload.return_value = {'UploadId': 'up-1'}
+        s3.upload_part.side_effect = Exception("Connection reset")
+
+        with pytest.raises(Exception):
+            aws.upload_stream_to_s3([b'x' * 250], "bucket", "big.json", part_size=100)
+
+        s3.abort_multipart_upload.assert_called_once_with(Bucket="bucket", Key="big.json", UploadId='up-1')
+        s3.complete_multipart_upload.assert_not_called()
+
+
+class TestDeleteFolder:
+    def _s3(self, mock_get_client, pages):
+        s3 = mock_get_client.return_value
+        s3.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': key} for key in keys]} if keys else {} for keys in pages
+        ]
+        return s3
+
+    @patch('helpers.aws.get_client')
+    def test_deletes_each_page_in_one_batch(self, mock_get_client):
+        s3 = self._s3(mock_get_client, [[f"weather/{i}" for i in range(1000)], ["weather/last"], []])
+        s3.delete_objects.return_value = {}
+
+        count, errors = aws.delete_folder_from_s3("lake", "weather/")
+
+        assert (count, errors) == (1001, [])
+        assert s3.delete_objects.call_count == 2
+        batch_sizes = sorted(len(c[1]['Delete']['Objects']) for c in s3.delete_objects.call_args_list)
+        assert batch_sizes == [1, 1000]
+        s3.delete_object.assert_not_called()
+
+    @patch('helpers.aws.get_client')
+    def test_reports_keys_that_failed(self, mock_get_client):
+        s3 = self._s3(mock_get_client, [["weather/a", "weather/b"]])
+        error = {'Key': 'weather/b', 'Code': 'AccessDenied', 'Message': 'Access Denied'}
+        s3.delete_objects.return_value = {'Errors': [error]}
+
+        count, errors = aws.delete_folder_from_s3("lake", "weather/", raise_on_error=False)
+
+        assert (count, errors) == (1, [error])
+
+    @patch('helpers.aws.get_client')
+    def test_partial_delete_raises_after_all_batches(self, mock_get_client):
+        s3 = self._s3(mock_get_client, [["weather/a"], ["weather/b"]])
+        error = {'Key': 'weather/a', 'Code': 'SlowDown', 'Message': 'Please reduce your request rate'}
+        s3.delete_objects.side_effect = [{'Errors': [error]}, {}]
+
+        with pytest.raises(RuntimeError, match="Failed to delete 1 files"):
+            aws.delete_folder_from_s3("lake", "weather/")
+
+        assert s3.delete_objects.call_count == 2
+
+    @patch('helpers.aws.get_client')
+    def test_dry_run_only_counts(self, mock_get_client):
+        s3 = self._s3(mock_get_client, [["weather/a", "weather/b"], ["weather/c"]])
+
+        assert aws.delete_folder_from_s3("lake", "weather/", dry_run=True) == (3, [])
+        s3.delete_objects.assert_not_called()
+
+
+class TestPartitionRegistry:
+    def setup_method(self):
+        aws.clear_partitions()
+
+    def teardown_method(self):
+        aws.clear_partitions()
+
+    def _glue(self, mock_get_client, existing):
+        glue = mock_get_client.return_value
+        glue.get_paginator.return_value.paginate.return_value = [
+            {'Partitions': [{'Values': list(values)} for values in existing]}
+        ]
+        return glue
+
+    @patch('helpers.aws.execute_athena_commands', return_value=True)
+    @patch('helpers.aws.get_client')
+    def test_known_partition_skips_athena(self, mock_get_client, mock_execute):
+        self._glue(mock_get_client, [('2026', '2', '11')])
+
+        assert aws.add_glue_partition_for(2026, 2, 11, "weather", "incoming", "results") is True
+        mock_execute.assert_not_called()
+
+    @patch('helpers.aws.execute_athena_commands', return_value=True)
+    @patch('helpers.aws.get_client')
+    def test_new_partitions_are_added_together_and_remembered(self, mock_get_client, mock_execute):
+        glue = self._glue(mock_get_client, [('2026', '2', '11')])
+        partitions = [(2026, 2, 11), (2026, 2, 12), (2026, 2, 13)]
+
+        aws.add_glue_partitions(partitions, "weather", "incoming", "results")
+        aws.add_glue_partitions(partitions, "weather", "incoming", "results")
+
+        statements = mock_execute.call_args[0][0]
+        assert statements == [
+            "ALTER TABLE weather ADD IF NOT EXISTS PARTITION (year='2026', month='2', day='12') "
+            "PARTITION (year='2026', month='2', day='13')"
+        ]
+        mock_execute.assert_called_once()
+        glue.get_paginator.return_value.paginate.assert_called_once_with(DatabaseName="incoming",
+                                                                          TableName="weather")
+
+    @patch('helpers.aws.PARTITIONS_PER_STATEMENT', 2)
+    @patch('helpers.aws.execute_athena_commands', return_value=False)
+    @patch('helpers.aws.get_client')
+    def test_backfill_is_split_into_statements_and_retried_after_failure(self, mock_get_client, mock_execute):
+        self._glue(mock_get_client, [])
+        partitions = [(2025, 1, day) for day in range(1, 6)]
+
+        assert aws.add_glue_partitions(partitions, "weather", "incoming", "results") is False
+        assert len(mock_execute.call_args[0][0]) == 3
+
+        aws.add_glue_partitions(partitions, "weather", "incoming", "results")
+        assert mock_execute.call_count == 2
@@ -0,0 +1,113 @@
+import pytest
+import requests
+from unittest.mock import Mock, patch
+from datahub_etl.datahub_client import DataHubClient
+from datahub_etl.rate_limiter import RateLimiter, QuotaExhaustedError
+from tests.fixtures import NEAREST_STATION_RESPONSE
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _response(status_code, json_body=None, headers=None):
+    response = Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = json_body
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+            f"{status_code} Client Error", response=response
+        )
+    return response
+
+
+class TestRateLimiter:
+    def test_acquire_spaces_requests_at_configured_rate(self):
+        clock = FakeClock()
+        limiter = RateLimiter(requests_per_second=2, clock=clock, sleep=clock.sleep)
+
+        for _ in range(3):
+            limiter.acquire()
+
+        assert clock.sleeps == [0.5, 0.5]
+        assert limiter.requests_made == 3
+
+    def test_pause_holds_back_next_acquire(self):
+        clock = FakeClock()
+        limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+
+        limiter.pause(30)
+        limiter.acquire()
+
+        assert clock.sleeps == [30]
+
+    def test_budget_raises_when_used_up(self):
+        limiter = RateLimiter.for_daily_quota(48, runs_per_day=24)
+
+        limiter.acquire()
+        limiter.acquire()
+
+        assert limiter.remaining == 0
+        with pytest.raises(QuotaExhaustedError):
+            limiter.acquire()
+
+
+class TestRequestBackoff:
+    def test_retry_after_pauses_shared_limiter(self):
+        clock = FakeClock()
+        limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+        session = Mock()
+        session.get.side_effect = [
+            _response(429, headers={"Retry-After": "12"}),
+            _response(200, json_body=[{"geohash": "gfxnj5"}])
+        ]
+
+        client = DataHubClient("key", rate_limiter=limiter, session=session)
+        result = client.get_observations("gfxnj5")
+
+        assert result == [{"geohash": "gfxnj5"}]
+        assert clock.sleeps == [12.0]
+        assert limiter.requests_made == 2
+
+    @patch('datahub_etl.datahub_client.time.sleep')
+    def test_falls_back_to_exponential_backoff_without_retry_after(self, mock_sleep):
+        session = Mock()
+        session.get.side_effect = [_response(429), _response(429), _response(429)]
+
+        client = DataHubClient("key", session=session)
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            client.get_observations("gfxnj5")
+
+        assert [c[0][0] for c in mock_sleep.call_args_list] == [1, 2]
+
+
+class TestSession:
+    def test_client_reuses_one_pooled_session(self):
+        client = DataHubClient("key", pool_size=8)
+        adapter = client.session.get_adapter(client.base_url)
+
+        assert adapter._pool_maxsize == 8
+        assert "gzip" in client.session.headers["Accept-Encoding"]
+
+    def test_requests_go_through_session_with_api_key(self):
+        session = Mock()
+        session.get.return_value = _response(200, json_body=NEAREST_STATION_RESPONSE)
+
+        client = DataHubClient("key", session=session)
+        result = client.get_nearest_station(60.139, -1.183)
+
+        assert result == NEAREST_STATION_RESPONSE
+        session.get.assert_called_once_with(
+            f"{client.base_url}/nearest", headers={"apikey": "key"}, params={"lat": 60.14, "lon": -1.18}
+        )
@@ -1,16 +1,24 @@
 import pytest
+import gzip
 import json
 import tempfile
 import os
+import time
 from unittest.mock import Mock, MagicMock, patch
 from datahub_etl.weather_etl import (
     extract_observations_data,
     transform_observations_data,
     transform_observation,
+    transform_observations,
     load_geohash_cache,
     save_geohash_cache,
+    GeohashCacheUpdates,
+    save_ingest_state,
     _build_site_priority_queue
 )
+from datahub_etl.site_registry import SiteRegistry
+from datahub_etl.warm_state import WARM_STATE
+from helpers.quantile_sketch import MonthlySiteSketches
 from tests.fixtures import (
     NEAREST_STATION_RESPONSE,
     OBSERVATIONS_RESPONSE,
@@ -50,6 +58,122 @@ class TestGeohashCaching:
             os.unlink(cache_file)
 
 
+class TestIncrementalCachePersistence:
+    def setup_method(self):
+        WARM_STATE.invalidate()
+
+    def test_changed_entries_are_appended_to_log_and_replayed(self):
+        cache_dir = tempfile.mkdtemp()
+        cache_file = os.path.join(cache_dir, "cache.json")
+
+        cache = {"3005": {"geohash": "gfxnj5", "last_fetched": None}}
+        save_geohash_cache(cache, cache_file=cache_file)
+
+        cache["3017"] = {"geohash": "gfk4ke", "last_fetched": "2026-02-13T10:00:00Z"}
+        save_geohash_cache(cache, cache_file=cache_file, changed_site_ids={"3017"})
+
+        with open(cache_file, 'r') as f:
+            assert json.load(f) == {"3005": {"geohash": "gfxnj5", "last_fetched": None}}
+
+        assert load_geohash_cache(cache_file=cache_file) == cache
+        assert sorted(os.listdir(cache_dir)) == ["cache.json", "cache.json.log"]
+
+    def test_log_is_compacted_into_snapshot(self):
+        cache_dir = tempfile.mkdtemp()
+        cache_file = os.path.join(cache_dir, "cache.json")
+        cache = {"3005": {"geohash": "gfxnj5", "last_fetched": None}}
+        save_geohash_cache(cache, cache_file=cache_file)
+
+        with patch('datahub_etl.weather_etl.CACHE_COMPACT_AFTER_UPDATES', 2):
+            for hour in range(3):
+                cache["3005"]["last_fetched"] = f"2026-02-13T1{hour}:00:00Z"
+                save_geohash_cache(cache, cache_file=cache_file, changed_site_ids={"3005"})
+
+        assert sorted(os.listdir(cache_dir)) == ["cache.json"]
+        with open(cache_file, 'r') as f:
+            assert json.load(f)["3005"]["last_fetched"] == "2026-02-13T12:00:00Z"
+
+    def test_torn_log_line_is_ignored(self):
+        cache_dir = tempfile.mkdtemp()
+        cache_file = os.path.join(cache_dir, "cache.json")
+        save_geohash_cache({"3005": {"geohash": "gfxnj5"}}, cache_file=cache_file)
+
+        with open(cache_file + ".log", 'w') as f:
+            f.write('{"3017":{"geohash":"gfk4ke"}}\n{"3026":{"geo')
+
+        assert load_geohash_cache(cache_file=cache_file) == {
+            "3005": {"geohash": "gfxnj5"}, "3017": {"geohash": "gfk4ke"}
+        }
+
+    @patch('helpers.aws.save_json_to_s3_if_unchanged')
+    @patch('helpers.aws.load_json_and_etag_from_s3')
+    def test_s3_conflict_merges_our_changes_onto_remote_copy(self, mock_load, mock_save):
+        cache_file = tempfile.mktemp(suffix='.json')
+        mock_load.side_effect = [
+            ({"3005": {"geohash": "gfxnj5", "last_fetched": None}}, '"v1"'),
+            ({"3005": {"geohash": "gfxnj5", "last_fetched": None},
+              "3026": {"geohash": "gcrzsx", "last_fetched": "2026-02-13T10:00:00Z"}}, '"v2"'),
+        ]
+        mock_save.side_effect = [None, '"v3"']
+
+        try:
+            cache = load_geohash_cache(cache_file=cache_file, s3_bucket="bucket", s3_key="cache.json")
+            cache["3017"] = {"geohash": "gfk4ke", "last_fetched": "2026-02-13T11:00:00Z"}
+            save_geohash_cache(cache, cache_file=cache_file, s3_bucket="bucket", s3_key="cache.json",
+                               changed_site_ids={"3017"})
+
+            assert mock_save.call_args_list[0][0][3] == '"v1"'
+            merged, _, _, etag = mock_save.call_args_list[1][0]
+            assert etag == '"v2"'
+            assert set(merged) == {"3005", "3017", "3026"}
+        finally:
+            for filename in (cache_file, cache_file + ".log"):
+                if os.path.exists(filename):
+                    os.unlink(filename)
+
+
+class TestWarmGeohashCache:
+    def setup_method(self):
+        WARM_STATE.invalidate()
+
+    @patch('helpers.aws.get_s3_etag')
+    @patch('helpers.aws.load_json_and_etag_from_s3')
+    def test_warm_cache_reused_while_s3_version_unchanged(self, mock_load, mock_etag):
+        mock_load.return_value = ({"3005": {"geohash": "gfxnj5"}}, '"v1"')
+        mock_etag.return_value = '"v1"'
+
+        first = load_geohash_cache(cache_file="nonexistent.json", s3_bucket="bucket", s3_key="cache.json")
+        second = load_geohash_cache(cache_file="nonexistent.json", s3_bucket="bucket", s3_key="cache.json")
+
+        assert second == first
+        assert second is not first
+        mock_load.assert_called_once()
+
+    @patch('helpers.aws.get_s3_etag')
+    @patch('helpers.aws.load_json_and_etag_from_s3')
+    def test_warm_cache_reloaded_when_s3_version_changes(self, mock_load, mock_etag):
+        mock_load.side_effect = [({"3005": {"geohash": "gfxnj5"}}, '"v1"'), ({"3005": {"geohash": "abc"}}, '"v2"')]
+        mock_etag.return_value = '"v2"'
+
+        load_geohash_cache(cache_file="nonexistent.json", s3_bucket="bucket", s3_key="cache.json")
+        cache = load_geohash_cache(cache_file="nonexistent.json", s3_bucket="bucket", s3_key="cache.json")
+
+        assert cache == {"3005": {"geohash": "abc"}}
+        assert mock_load.call_count == 2
+
+    @patch('helpers.aws.get_s3_etag', return_value=None)
+    @patch('helpers.aws.load_json_and_etag_from_s3')
+    def test_warm_cache_not_reused_without_an_s3_version(self, mock_load, mock_etag):
+        mock_load.side_effect = [({"3005": {"geohash": "gfxnj5"}}, '"v1"'), (None, None)]
+
+        load_geohash_cache(cache_file="nonexistent.json", s3_bucket="bucket", s3_key="cache.json")
+        cache = load_geohash_cache(cache_file="nonexistent.json", s3_bucket="bucket", s3_key="cache.json")
+
+        # The S3 object is gone, so the stale warm copy is dropped and the local fallback is used
+        assert cache == {}
+        assert mock_load.call_count == 2
+
+
 class TestDataTransformation:
     def test_transform_observation_maps_fields_correctly(self):
         obs = {
@@ -122,10 +246,11 @@ class TestExtractObservations:
             mock_client.get_observations.assert_called_once_with("gfxnj5")
 
             with open(output_file, 'r') as f:
-                data = json.load(f)
+                data = [json.loads(line) for line in f]
 
             assert len(data) == 2
-            assert data[0]["_site_metadata"]["site_id"] == "3005"
+            assert data[0]["_site_id"] == "3005"
+            assert "_site_metadata" not in data[0]
             assert data[0]["_geohash"] == "gfxnj5"
         finally:
             if os.path.exists(output_file):
@@ -174,7 +299,7 @@ class TestExtractObservations:
                     result = extract_observations_data(output_file, mock_client)
 
             with open(output_file, 'r') as f:
-                data = json.load(f)
+                data = [json.loads(line) for line in f]
 
             assert data == []
         finally:
@@ -183,6 +308,58 @@ class TestExtractObservations:
 
 
 class TestTransformObservationsData:
+    def test_transform_reads_newline_delimited_raw_file(self):
+        input_file = tempfile.mktemp(suffix='.json')
+        output_file = tempfile.mktemp(suffix='.json')
+
+        with open(input_file, 'w') as f:
+            for obs in OBSERVATIONS_RESPONSE:
+                f.write(json.dumps({**obs, "_site_metadata": SAMPLE_SITE, "_geohash": "gfxnj5"}) + '\n')
+
+        try:
+            assert transform_observations_data(input_file, output_file) is True
+
+            with open(output_file, 'r') as f:
+                rows = [json.loads(line) for line in f]
+
+            assert rows[0] == EXPECTED_TRANSFORMED_ROW
+            assert rows[1]["observation_ts"] == "2026-02-11 13:00:00"
+        finally:
+            if os.path.exists(input_file):
+                os.unlink(input_file)
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+    def test_transform_reads_gzipped_raw_file(self):
+        input_file = tempfile.mktemp(suffix='.json.gz')
+        output_file = tempfile.mktemp(suffix='.json')
+
+        with gzip.open(input_file, 'wt') as f:
+            f.write(json.dumps({**OBSERVATIONS_RESPONSE[0], "_site_metadata": SAMPLE_SITE}) + '\n')
+
+        try:
+            assert transform_observations_data(input_file, output_file) is True
+
+            with open(output_file, 'r') as f:
+                assert json.loads(f.readline()) == EXPECTED_TRANSFORMED_ROW
+        finally:
+            for filename in (input_file, output_file):
+                if os.path.exists(filename):
+                    os.unlink(filename)
+
+    def test_transform_returns_false_for_empty_raw_file(self):
+        input_file = tempfile.mktemp(suffix='.json')
+        output_file = tempfile.mktemp(suffix='.json')
+
+        open(input_file, 'w').close()
+
+        try:
+            assert transform_observations_data(input_file, output_file) is False
+            assert not os.path.exists(output_file)
+        finally:
+            if os.path.exists(input_file):
+                os.unlink(input_file)
+
     def test_transform_creates_newline_delimited_json(self):
         input_file = tempfile.mktemp(suffix='.json')
         output_file = tempfile.mktemp(suffix='.json')
@@ -315,3 +492,533 @@ class TestBatchPrioritization:
         finally:
             if os.path.exists(output_file):
                 os.unlink(output_file)
+
+
+class TestConcurrentExtraction:
+    SITES = [
+        {"site_id": "3005", "site_name": "Site A", "lat": 60.0, "lon": -1.0},
+        {"site_id": "3017", "site_name": "Site B", "lat": 61.0, "lon": -2.0},
+        {"site_id": "3026", "site_name": "Site C", "lat": 62.0, "lon": -3.0}
+    ]
+
+    @patch('datahub_etl.weather_etl.get_sites')
+    def test_concurrent_extract_fetches_every_site_and_updates_cache(self, mock_get_sites):
+        mock_get_sites.return_value = self.SITES
+
+        cache = {
+            "3005": {"geohash": "abc", "last_fetched": "2026-02-13T10:00:00Z"},
+            "3017": {"geohash": "def", "last_fetched": "2026-02-12T10:00:00Z"},
+            "3026": {"geohash": "ghi", "last_fetched": "2026-02-13T15:00:00Z"}
+        }
+
+        mock_client = Mock()
+        mock_client.get_observations.side_effect = lambda geohash: [
+            {"datetime": "2026-02-13T12:00:00Z", "temperature": "10"}
+        ]
+
+        output_file = tempfile.mktemp(suffix='.json')
+        saved_cache = {}
+
+        try:
+            with patch('datahub_etl.weather_etl.load_geohash_cache', return_value=cache):
+                with patch('datahub_etl.weather_etl.save_geohash_cache') as mock_save:
+                    mock_save.side_effect = lambda c, **kwargs: saved_cache.update(c)
+                    result = extract_observations_data(output_file, mock_client, batch_size=3, max_workers=3)
+
+            assert result is True
+            assert sorted(c[0][0] for c in mock_client.get_observations.call_args_list) == ["abc", "def", "ghi"]
+            assert all(saved_cache[site_id]["last_fetched"] != "2026-02-13T10:00:00Z" for site_id in cache)
+
+            with open(output_file, 'r') as f:
+                data = [json.loads(line) for line in f]
+
+            assert sorted(obs["_geohash"] for obs in data) == ["abc", "def", "ghi"]
+        finally:
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+    @patch('datahub_etl.weather_etl.get_sites')
+    def test_concurrent_extract_handles_rate_limited_site(self, mock_get_sites):
+        mock_get_sites.return_value = self.SITES
+
+        cache = {
+            "3005": {"geohash": "abc", "last_fetched": "2026-02-13T10:00:00Z"},
+            "3017": {"geohash": "def", "last_fetched": "2026-02-12T10:00:00Z"},
+            "3026": {"geohash": "ghi", "last_fetched": "2026-02-13T15:00:00Z"}
+        }
+
+        def get_observations(geohash):
+            if geohash == "def":
+                raise Exception("429 Client Error: Too Many Requests")
+            return [{"datetime": "2026-02-13T12:00:00Z", "temperature": "10"}]
+
+        mock_client = Mock()
+        mock_client.get_observations.side_effect = get_observations
+
+        output_file = tempfile.mktemp(suffix='.json')
+
+        try:
+            with patch('datahub_etl.weather_etl.load_geohash_cache', return_value=cache):
+                with patch('datahub_etl.weather_etl.save_geohash_cache'):
+                    extract_observations_data(output_file, mock_client, batch_size=3, max_workers=2)
+
+            # Rate limited sites are still marked as fetched so the next run moves on
+            assert cache["3017"]["last_fetched"] != "2026-02-12T10:00:00Z"
+
+            with open(output_file, 'r') as f:
+                data = [json.loads(line) for line in f]
+
+            assert sorted(obs["_geohash"] for obs in data) == ["abc", "ghi"]
+        finally:
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+    @patch('datahub_etl.weather_etl.get_sites')
+    def test_extract_leaves_sites_stale_when_budget_used_up(self, mock_get_sites):
+        from datahub_etl.rate_limiter import QuotaExhaustedError
+
+        mock_get_sites.return_value = self.SITES
+
+        cache = {
+            "3005": {"geohash": "abc", "last_fetched": "2026-02-13T10:00:00Z"},
+            "3017": {"geohash": "def", "last_fetched": "2026-02-12T10:00:00Z"},
+            "3026": {"geohash": "ghi", "last_fetched": "2026-02-13T15:00:00Z"}
+        }
+
+        def get_observations(geohash):
+            if geohash != "def":
+                raise QuotaExhaustedError("Request budget used up")
+            return [{"datetime": "2026-02-13T12:00:00Z", "temperature": "10"}]
+
+        mock_client = Mock()
+        mock_client.get_observations.side_effect = get_observations
+
+        output_file = tempfile.mktemp(suffix='.json')
+
+        try:
+            with patch('datahub_etl.weather_etl.load_geohash_cache', return_value=cache):
+                with patch('datahub_etl.weather_etl.save_geohash_cache'):
+                    extract_observations_data(output_file, mock_client, batch_size=3)
+
+            assert cache["3005"]["last_fetched"] == "2026-02-13T10:00:00Z"
+            assert cache["3026"]["last_fetched"] == "2026-02-13T15:00:00Z"
+            assert cache["3017"]["last_fetched"] != "2026-02-12T10:00:00Z"
+        finally:
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+
+class TestPipelinedExtraction:
+    @patch('datahub_etl.weather_etl.get_sites', return_value=[SAMPLE_SITE])
+    def test_extract_writes_raw_and_transformed_files_in_one_pass(self, mock_get_sites):
+        mock_client = Mock()
+        mock_client.get_observations.return_value = OBSERVATIONS_RESPONSE
+
+        raw_file = tempfile.mktemp(suffix='.json')
+        output_file = tempfile.mktemp(suffix='.json')
+
+        try:
+            with patch('datahub_etl.weather_etl.load_geohash_cache') as mock_load:
+                with patch('datahub_etl.weather_etl.save_geohash_cache'):
+                    mock_load.return_value = {"3005": {"geohash": "gfxnj5", "last_fetched": "2026-01-01T00:00:00Z"}}
+                    extract_observations_data(raw_file, mock_client, output_filename=output_file)
+
+            with open(raw_file, 'r') as f:
+                raw = [json.loads(line) for line in f]
+            with open(output_file, 'r') as f:
+                rows = [json.loads(line) for line in f]
+
+            assert len(raw) == 2
+            assert rows[0] == EXPECTED_TRANSFORMED_ROW
+            assert len(rows) == 2
+        finally:
+            for filename in (raw_file, output_file):
+                if os.path.exists(filename):
+                    os.unlink(filename)
+
+    @patch('datahub_etl.weather_etl.get_sites', return_value=[SAMPLE_SITE])
+    def test_transform_failure_keeps_raw_observations(self, mock_get_sites):
+        mock_client = Mock()
+        mock_client.get_observations.return_value = OBSERVATIONS_RESPONSE
+
+        raw_file = tempfile.mktemp(suffix='.json')
+        output_file = tempfile.mktemp(suffix='.json')
+
+        try:
+            with patch('datahub_etl.weather_etl.load_geohash_cache') as mock_load:
+                with patch('datahub_etl.weather_etl.save_geohash_cache'):
+                    with patch('datahub_etl.weather_etl.transform_observations', side_effect=ValueError("bad")):
+                        mock_load.return_value = {"3005": {"geohash": "gfxnj5", "last_fetched": None}}
+                        result = extract_observations_data(raw_file, mock_client, output_filename=output_file)
+
+            assert result is True
+            with open(raw_file, 'r') as f:
+                assert len(f.readlines()) == 2
+            with open(output_file, 'r') as f:
+                assert f.read() == ""
+        finally:
+            for filename in (raw_file, output_file):
+                if os.path.exists(filename):
+                    os.unlink(filename)
+
+
+class TestBatchTransform:
+    def test_batch_transform_matches_per_row_transform(self):
+        other_site = {**SAMPLE_SITE, "site_id": "3017", "site_name": "KIRKWALL AIRPORT", "lat": "58.954"}
+        observations = (
+            [{**obs, "_site_metadata": SAMPLE_SITE} for obs in OBSERVATIONS_RESPONSE]
+            + [{"datetime": "2026-02-11T14:00:00Z", "temperature": "", "_site_metadata": other_site}]
+            + [{"datetime": "2026-02-11T15:00:00Z", "temperature": "7.0"}]
+            + [{**OBSERVATIONS_RESPONSE[0], "_site_metadata": SAMPLE_SITE}]
+        )
+
+        expected = [row for row in map(transform_observation, observations) if row]
+        rows = transform_observations(observations)
+
+        assert rows == expected
+        assert [json.dumps(row) for row in rows] == [json.dumps(row) for row in expected]
+
+    def test_observations_referring_to_site_by_id_use_registry(self):
+        observations = [{**obs, "_site_id": "3005"} for obs in OBSERVATIONS_RESPONSE]
+
+        rows = transform_observations(observations, sites=[SAMPLE_SITE])
+
+        assert rows[0] == EXPECTED_TRANSFORMED_ROW
+        assert transform_observation(observations[0], sites=SiteRegistry([SAMPLE_SITE])) == EXPECTED_TRANSFORMED_ROW
+        assert transform_observation(observations[0], sites=[SAMPLE_SITE]) == EXPECTED_TRANSFORMED_ROW
+        assert transform_observations(observations) == []
+
+    @patch('datahub_etl.weather_etl.get_sites', return_value=[SAMPLE_SITE])
+    def test_replaying_raw_file_with_site_ids_loads_sites(self, mock_get_sites):
+        input_file = tempfile.mktemp(suffix='.json')
+        output_file = tempfile.mktemp(suffix='.json')
+
+        with open(input_file, 'w') as f:
+            f.write(json.dumps({**OBSERVATIONS_RESPONSE[0], "_site_id": "3005"}) + '\n')
+
+        try:
+            transform_observations_data(input_file, output_file)
+
+            with open(output_file, 'r') as f:
+                assert json.loads(f.readline()) == EXPECTED_TRANSFORMED_ROW
+            mock_get_sites.assert_called_once()
+        finally:
+            for filename in (input_file, output_file):
+                if os.path.exists(filename):
+                    os.unlink(filename)
+
+    def test_site_registry_is_built_once_per_replay(self):
+        input_file = tempfile.mktemp(suffix='.json')
+        output_file = tempfile.mktemp(suffix='.json')
+
+        with open(input_file, 'w') as f:
+            for obs in OBSERVATIONS_RESPONSE * 3:
+                f.write(json.dumps({**obs, "_site_id": "3005"}) + '\n')
+
+        try:
+            with patch.object(SiteRegistry, 'add', autospec=True, side_effect=SiteRegistry.add) as mock_add:
+                with patch('datahub_etl.weather_etl.TRANSFORM_CHUNK_SIZE', 1):
+                    transform_observations_data(input_file, output_file, sites=[SAMPLE_SITE])
+
+            mock_add.assert_called_once()
+            with open(output_file, 'r') as f:
+                assert len(f.readlines()) == len(OBSERVATIONS_RESPONSE) * 3
+        finally:
+            for filename in (input_file, output_file):
+                if os.path.exists(filename):
+                    os.unlink(filename)
+
+    def test_batch_transform_skips_observations_without_site(self):
+        assert transform_observations([{"datetime": "2026-02-11T12:00:00Z"}]) == []
+
+
+class TestOfflineStationResolution:
+    @patch('datahub_etl.weather_etl.get_sites')
+    def test_uncached_site_next_to_known_station_skips_api(self, mock_get_sites):
+        mock_get_sites.return_value = [
+            SAMPLE_SITE,
+            {**SAMPLE_SITE, "site_id": "9999", "site_name": "LERWICK (NEW)", "lat": 60.14, "lon": -1.18}
+        ]
+
+        cache = {"3005": {"geohash": "gfxnj5", "last_fetched": "2026-02-13T10:00:00Z"}}
+
+        mock_client = Mock()
+        mock_client.get_observations.return_value = OBSERVATIONS_RESPONSE
+
+        output_file = tempfile.mktemp(suffix='.json')
+
+        try:
+            with patch('datahub_etl.weather_etl.load_geohash_cache', return_value=cache):
+                with patch('datahub_etl.weather_etl.save_geohash_cache'):
+                    extract_observations_data(output_file, mock_client, batch_size=1)
+
+            mock_client.get_nearest_station.assert_not_called()
+            mock_client.get_observations.assert_called_once_with("gfxnj5")
+            assert cache["9999"]["geohash"] == "gfxnj5"
+        finally:
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+    @patch('datahub_etl.weather_etl.get_sites', return_value=[SAMPLE_SITE])
+    def test_sites_without_station_are_not_retried_every_run(self, mock_get_sites):
+        mock_client = Mock()
+        mock_client.get_nearest_station.return_value = []
+
+        output_file = tempfile.mktemp(suffix='.json')
+        cache = {}
+
+        try:
+            with patch('datahub_etl.weather_etl.load_geohash_cache', return_value=cache):
+                with patch('datahub_etl.weather_etl.save_geohash_cache'):
+                    extract_observations_data(output_file, mock_client)
+                    extract_observations_data(output_file, mock_client)
+
+            mock_client.get_nearest_station.assert_called_once()
+            assert cache["3005"]["geohash"] is None
+            assert "no_station_checked" in cache["3005"]
+        finally:
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+
+class TestWatermarks:
+    def _extract(self, cache, overlap_hours=0, sketches=None):
+        mock_client = Mock()
+        mock_client.get_observations.return_value = [dict(obs) for obs in OBSERVATIONS_RESPONSE]
+
+        raw_file = tempfile.mktemp(suffix='.json')
+
+        try:
+            with patch('datahub_etl.weather_etl.get_sites', return_value=[SAMPLE_SITE]):
+                with patch('datahub_etl.weather_etl.load_geohash_cache', return_value=cache):
+                    with patch('datahub_etl.weather_etl.save_geohash_cache'):
+                        extract_observations_data(raw_file, mock_client, watermark_overlap_hours=overlap_hours,
+                                                  sketches=sketches)
+
+            with open(raw_file, 'r') as f:
+                return [json.loads(line) for line in f]
+        finally:
+            if os.path.exists(raw_file):
+                os.unlink(raw_file)
+
+    def test_extract_records_latest_observation_as_watermark(self):
+        cache = {"3005": {"geohash": "gfxnj5", "last_fetched": None}}
+
+        data = self._extract(cache)
+
+        assert len(data) == 2
+        assert cache["3005"]["watermark"] == "2026-02-11T13:00:00Z"
+
+    def test_extract_drops_observations_at_or_below_watermark(self):
+        cache = {"3005": {"geohash": "gfxnj5", "last_fetched": None, "watermark": "2026-02-11T12:00:00Z"}}
+
+        data = self._extract(cache)
+
+        assert [obs["datetime"] for obs in data] == ["2026-02-11T13:00:00Z"]
+        assert cache["3005"]["watermark"] == "2026-02-11T13:00:00Z"
+
+    def test_overlap_window_keeps_recent_rows_for_late_corrections(self):
+        cache = {"3005": {"geohash": "gfxnj5", "last_fetched": None, "watermark": "2026-02-11T13:00:00Z"}}
+
+        data = self._extract(cache, overlap_hours=1)
+
+        assert [obs["datetime"] for obs in data] == ["2026-02-11T13:00:00Z"]
+
+    def test_sketches_skip_rows_in_the_overlap_window(self):
+        cache = {"3005": {"geohash": "gfxnj5", "last_fetched": None, "watermark": "2026-02-11T12:00:00Z"}}
+        sketches = MonthlySiteSketches()
+
+        data = self._extract(cache, overlap_hours=1, sketches=sketches)
+
+        assert len(data) == 2
+        assert sketches.sites_for(2026, 2)["3005"]["digest"].count == 1
+
+    def test_watermark_never_moves_backwards(self):
+        cache = {"3005": {"geohash": "gfxnj5", "last_fetched": None, "watermark": "2026-02-12T00:00:00Z"}}
+
+        assert self._extract(cache) == []
+        assert cache["3005"]["watermark"] == "2026-02-12T00:00:00Z"
+
+
+class TestDeferredCacheSave:
+    """The handler saves cache_updates only after its uploads, as the watermarks skip what they cover"""
+
+    def setup_method(self):
+        WARM_STATE.invalidate()
+
+    def _run(self, upload_succeeds):
+        mock_client = Mock()
+        mock_client.get_observations.return_value = [dict(obs) for obs in OBSERVATIONS_RESPONSE]
+        raw_file = tempfile.mktemp(suffix='.json')
+        cache_updates = GeohashCacheUpdates()
+
+        try:
+            with patch('datahub_etl.weather_etl.get_sites', return_value=[SAMPLE_SITE]):
+                extract_observations_data(raw_file, mock_client, s3_bucket="raw", s3_cache_key="cache.json",
+                                          cache_updates=cache_updates)
+            if upload_succeeds:
+                cache_updates.save()
+
+            with open(raw_file, 'r') as f:
+                return [json.loads(line)["datetime"] for line in f]
+        finally:
+            if os.path.exists(raw_file):
+                os.unlink(raw_file)
+
+    @patch('datahub_etl.weather_etl._save_geohash_cache_locally')
+    @patch('helpers.aws.save_json_to_s3_if_unchanged', return_value='"v2"')
+    @patch('helpers.aws.get_s3_etag', return_value='"v1"')
+    @patch('helpers.aws.load_json_and_etag_from_s3')
+    def test_failed_upload_is_fetched_again_by_next_run(self, mock_load, mock_etag, mock_save, mock_local):
+        mock_load.return_value = ({"3005": {"geohash": "gfxnj5", "last_fetched": None}}, '"v1"')
+
+        first = self._run(upload_succeeds=False)
+        mock_save.assert_not_called()
+
+        # Same warm container, S3 copy unchanged - the unsaved watermark must not carry over
+        second = self._run(upload_succeeds=True)
+
+        assert first == second == ["2026-02-11T12:00:00Z", "2026-02-11T13:00:00Z"]
+        saved_cache = mock_save.call_args[0][0]
+        assert saved_cache["3005"]["watermark"] == "2026-02-11T13:00:00Z"
+
+    @patch('datahub_etl.weather_etl._save_geohash_cache_locally')
+    @patch('helpers.aws.save_json_to_s3_if_unchanged', return_value='"v2"')
+    @patch('helpers.aws.get_s3_etag', side_effect=['"v2"'])
+    @patch('helpers.aws.load_json_and_etag_from_s3')
+    def test_saved_watermark_skips_observations_next_run(self, mock_load, mock_etag, mock_save, mock_local):
+        mock_load.return_value = ({"3005": {"geohash": "gfxnj5", "last_fetched": None}}, '"v1"')
+
+        first = self._run(upload_succeeds=True)
+        second = self._run(upload_succeeds=True)
+
+        assert len(first) == 2
+        assert second == []
+
+
+class TestSaveIngestState:
+    def _updates(self):
+        cache_updates = GeohashCacheUpdates()
+        cache_updates.record({"3005": {"geohash": "gfxnj5", "watermark": "2026-02-11T13:00:00Z"}}, {"3005"},
+                             s3_bucket="raw", s3_key="cache.json")
+        return cache_updates
+
+    def _sketches(self):
+        sketches = MonthlySiteSketches()
+        sketches.add("3005", "LERWICK", 60.1, -1.2, "2026-02-11T13:00:00Z", 4.0)
+        return sketches
+
+    @pytest.mark.parametrize("s3_save", [{"return_value": False}, {"side_effect": Exception("SlowDown")}])
+    @patch('datahub_etl.weather_etl._save_geohash_cache_locally')
+    def test_sketches_are_not_written_when_the_cache_save_fails(self, mock_local, s3_save):
+        sketches = self._sketches()
+
+        with patch('datahub_etl.weather_etl._save_geohash_cache_to_s3', **s3_save), \
+                patch.object(MonthlySiteSketches, 'save') as mock_sketch_save:
+            assert save_ingest_state(self._updates(), sketches, "lake") is False
+
+        mock_sketch_save.assert_not_called()
+
+    @patch('datahub_etl.weather_etl._save_geohash_cache_locally')
+    @patch('datahub_etl.weather_etl._save_geohash_cache_to_s3', return_value=True)
+    def test_sketches_follow_a_saved_cache(self, mock_s3, mock_local):
+        with patch.object(MonthlySiteSketches, 'save') as mock_sketch_save:
+            assert save_ingest_state(self._updates(), self._sketches(), "lake") is True
+
+        mock_sketch_save.assert_called_once_with("lake", "datahub")
+
+
+class TestDeadline:
+    SITES = TestConcurrentExtraction.SITES
+    CACHE = {
+        "3005": {"geohash": "abc", "last_fetched": "2026-02-13T10:00:00Z"},
+        "3017": {"geohash": "def", "last_fetched": "2026-02-12T10:00:00Z"},
+        "3026": {"geohash": "ghi", "last_fetched": "2026-02-13T15:00:00Z"}
+    }
+
+    def _extract(self, deadline):
+        mock_client = Mock()
+        mock_client.get_observations.return_value = [{"datetime": "2026-02-13T12:00:00Z", "temperature": "10"}]
+
+        output_file = tempfile.mktemp(suffix='.json')
+
+        try:
+            with patch('datahub_etl.weather_etl.get_sites', return_value=self.SITES):
+                with patch('datahub_etl.weather_etl.load_geohash_cache', return_value=json.loads(json.dumps(self.CACHE))):
+                    with patch('datahub_etl.weather_etl.save_geohash_cache'):
+                        extract_observations_data(output_file, mock_client, deadline=deadline)
+        finally:
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+        return [c[0][0] for c in mock_client.get_observations.call_args_list]
+
+    def test_deadline_lifts_fixed_batch_size(self):
+        assert self._extract(deadline=time.monotonic() + 600) == ["def", "abc", "ghi"]
+
+    def test_no_sites_started_once_deadline_has_passed(self):
+        assert self._extract(deadline=time.monotonic() - 1) == []
+
+    def test_no_sites_started_once_request_budget_is_spent(self):
+        from datahub_etl.rate_limiter import RateLimiter
+
+        sites = [{**SAMPLE_SITE, "site_id": str(i)} for i in range(40)]
+        cache = {site["site_id"]: {"geohash": f"g{i}", "last_fetched": None} for i, site in enumerate(sites)}
+        limiter = RateLimiter(request_budget=5)
+
+        def get_observations(geohash):
+            limiter.acquire()
+            return [{"datetime": "2026-02-13T12:00:00Z", "temperature": "10"}]
+
+        mock_client = Mock()
+        mock_client.rate_limiter = limiter
+        mock_client.get_observations.side_effect = get_observations
+        output_file = tempfile.mktemp(suffix='.json')
+
+        try:
+            with patch('datahub_etl.weather_etl.get_sites', return_value=sites):
+                with patch('datahub_etl.weather_etl.load_geohash_cache', return_value=cache):
+                    with patch('datahub_etl.weather_etl.save_geohash_cache'):
+                        extract_observations_data(output_file, mock_client, deadline=time.monotonic() + 600)
+        finally:
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+        assert mock_client.get_observations.call_count == 5
+
+    def test_sites_skipped_for_quota_do_not_count_towards_latency(self):
+        from datahub_etl.rate_limiter import QuotaExhaustedError
+        from datahub_etl.weather_etl import _SiteLatency
+
+        def get_observations(geohash):
+            if geohash != "def":
+                raise QuotaExhaustedError("Request budget used up")
+            return [{"datetime": "2026-02-13T12:00:00Z", "temperature": "10"}]
+
+        mock_client = Mock()
+        mock_client.get_observations.side_effect = get_observations
+        output_file = tempfile.mktemp(suffix='.json')
+
+        try:
+            with patch('datahub_etl.weather_etl.get_sites', return_value=self.SITES):
+                with patch('datahub_etl.weather_etl.load_geohash_cache', return_value=json.loads(json.dumps(self.CACHE))):
+                    with patch('datahub_etl.weather_etl.save_geohash_cache'):
+                        with patch.object(_SiteLatency, 'record') as mock_record:
+                            extract_observations_data(output_file, mock_client, deadline=time.monotonic() + 600)
+        finally:
+            if os.path.exists(output_file):
+                os.unlink(output_file)
+
+        assert mock_client.get_observations.call_count == 3
+        mock_record.assert_called_once()
+
+    def test_site_latency_projects_against_deadline(self):
+        from datahub_etl.weather_etl import _SiteLatency
+
+        latency = _SiteLatency(deadline=10.0, initial_seconds=2.0, smoothing=0.5, clock=lambda: 5.0)
+        assert latency.can_start_another()
+
+        latency.record(10.0)
+
+        assert latency.average == 6.0
+        assert not latency.can_start_another()
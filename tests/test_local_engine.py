@@ -0,0 +1,122 @@
+import gzip
+import json
+import os
+import pandas as pd
+from weather_data_model.local_engine import (
+    SUMMARY_COLUMNS,
+    apply_schema,
+    broken_readings_mask,
+    build_lake,
+    build_summary,
+    build_weather,
+    read_table,
+    to_ndjson
+)
+
+
+def _row(ts, site_name="LERWICK", temperature="4.0", site_id="3005", **extra):
+    return {"observation_ts": ts, "site_id": site_id, "site_name": site_name, "temperature": temperature,
+            "lat": 60.139, "lon": -1.183, **extra}
+
+
+def _incoming(rows, year="2026", month="2"):
+    table = pd.DataFrame(rows)
+    table["year"] = year
+    table["month"] = month
+    return table
+
+
+class TestBrokenReadingsFilter:
+    def test_filter_follows_sql_null_semantics(self):
+        incoming = apply_schema(_incoming([
+            _row("2022-07-03 10:00:00", site_name="CHIVENOR", temperature="-10"),
+            _row("2022-07-03 11:00:00", site_name="CHIVENOR", temperature="15"),
+            _row("2022-07-03 12:00:00", temperature=None),
+            _row("2022-01-03 12:00:00", temperature="-8"),
+        ], year="2022", month="7"))
+
+        assert list(broken_readings_mask(incoming)) == [False, True, False, False]
+
+    def test_null_site_name_needs_a_valid_temperature(self):
+        incoming = apply_schema(_incoming([
+            _row("2026-02-11 12:00:00", site_name=None, temperature=None),
+            _row("2026-02-11 13:00:00", site_name=None, temperature="6"),
+            _row("2026-02-11 14:00:00", temperature=None),
+        ]))
+
+        assert list(broken_readings_mask(incoming)) == [False, True, True]
+
+
+class TestBuildWeather:
+    def test_keeps_latest_observation_per_hour_per_site(self):
+        weather = build_weather(_incoming([
+            _row("2026-02-11 12:00:00", temperature="4.0"),
+            _row("2026-02-11 12:30:00", temperature="5.0"),
+            _row("2026-02-11 12:10:00", temperature="9.0", site_id="3017"),
+            _row("2026-02-11 13:00:00", temperature="6.0"),
+        ]))
+
+        assert list(zip(weather["site_id"], weather["temperature"])) == [("3005", 5.0), ("3005", 6.0),
+                                                                         ("3017", 9.0)]
+        assert list(weather["year"]) == [2026, 2026, 2026]
+        assert list(weather["month"]) == [2, 2, 2]
+
+    def test_invalid_values_become_null(self):
+        weather = build_weather(_incoming([_row("2026-02-11 12:00:00", visibility="x", pressure="n/a")]))
+
+        assert pd.isna(weather["visibility"][0])
+        assert pd.isna(weather["pressure"][0])
+
+
+class TestBuildSummary:
+    def test_percentiles_are_values_from_the_data(self):
+        rows = [_row(f"2026-02-{day:02d} 12:00:00", temperature=str(day)) for day in range(1, 21)]
+        summary = build_summary(build_weather(_incoming(rows)))
+
+        assert len(summary) == 1
+        assert (summary["low_temp"][0], summary["median_temp"][0], summary["high_temp"][0]) == (1.0, 10.0, 19.0)
+
+    def test_site_month_with_no_temperatures_has_null_percentiles(self):
+        summary = build_summary(build_weather(_incoming([_row("2026-02-11 12:00:00", temperature=None)])))
+
+        assert pd.isna(summary["median_temp"][0])
+
+
+class TestLocalLake:
+    def test_builds_lake_from_partitioned_incoming_files(self, tmp_path):
+        day_dir = tmp_path / "incoming" / "year=2026" / "month=2" / "day=11"
+        day_dir.mkdir(parents=True)
+        with gzip.open(day_dir / "observations.json.gz", "wt") as f:
+            f.write(json.dumps(_row("2026-02-11 12:00:00")) + "\n")
+        with open(day_dir / "observations-2.json", "w") as f:
+            f.write(json.dumps(_row("2026-02-11 12:45:00", temperature="4.5")) + "\n")
+
+        weather, summary = build_lake(str(tmp_path / "incoming"), str(tmp_path / "lake"))
+
+        assert list(weather["temperature"]) == [4.5]
+        assert os.path.isdir(tmp_path / "lake" / "weather" / "year=2026" / "month=2")
+
+        lake_weather = read_table(str(tmp_path / "lake" / "weather"))
+        assert list(lake_weather["temperature"]) == [4.5]
+        assert to_ndjson(summary) == (
+            '{"high_temp":4.5,"lat":60.139,"lon":-1.183,"low_temp":4.5,"median_temp":4.5,"month":2,'
+            '"site_id":"3005","site_name":"LERWICK","year":2026}\n'
+        )
+
+    def test_files_outside_partition_folders_use_observation_month(self, tmp_path):
+        with open(tmp_path / "observations.json", "w") as f:
+            f.write(json.dumps(_row("2022-07-03 10:00:00", site_name="CHIVENOR", temperature="-10")) + "\n")
+            f.write(json.dumps(_row("2026-02-11 12:00:00")) + "\n")
+
+        weather = build_weather(read_table(str(tmp_path)))
+
+        assert list(weather["observation_ts"].astype(str)) == ["2026-02-11 12:00:00"]
+        assert (weather["year"][0], weather["month"][0]) == (2026, 2)
+
+    def test_empty_or_missing_input_builds_empty_tables(self, tmp_path):
+        for incoming in (tmp_path / "missing", tmp_path):
+            weather = build_weather(read_table(str(incoming)))
+            summary = build_summary(weather)
+
+            assert len(weather) == 0 and len(summary) == 0
+            assert list(summary.columns) == list(SUMMARY_COLUMNS)
@@ -0,0 +1,115 @@
+import random
+from unittest.mock import patch
+from helpers.quantile_sketch import TDigest, MonthlySiteSketches, monthly_summary, month_sketch_key
+
+
+def _exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class TestTDigest:
+    def test_quantiles_are_close_to_exact(self):
+        rng = random.Random(7)
+        values = [round(rng.gauss(10, 5), 1) for _ in range(5000)]
+        digest = TDigest()
+        for value in values:
+            digest.add(value)
+
+        for q in (0.05, 0.5, 0.95):
+            assert abs(digest.quantile(q) - _exact_quantile(values, q)) < 0.2
+
+    def test_merged_digests_match_digest_of_union(self):
+        rng = random.Random(3)
+        values = [rng.uniform(-5, 30) for _ in range(3000)]
+        first, second = TDigest(), TDigest()
+        for value in values[:1000]:
+            first.add(value)
+        for value in values[1000:]:
+            second.add(value)
+
+        first.merge(second)
+
+        assert first.count == 3000
+        assert (first.min, first.max) == (min(values), max(values))
+        for q in (0.05, 0.5, 0.95):
+            assert abs(first.quantile(q) - _exact_quantile(values, q)) < 0.5
+
+    def test_small_digest_is_exact_and_round_trips(self):
+        digest = TDigest()
+        for value in (4.0, 1.0, 3.0, 2.0, 5.0):
+            digest.add(value)
+
+        restored = TDigest.from_dict(digest.to_dict())
+
+        assert [restored.quantile(q) for q in (0, 0.5, 1)] == [1.0, 3.0, 5.0]
+        assert TDigest().quantile(0.5) is None
+
+
+class TestMonthlySiteSketches:
+    def test_values_are_grouped_by_site_and_month(self):
+        sketches = MonthlySiteSketches()
+        sketches.add("3005", "LERWICK", 60.1, -1.2, "2026-01-31T23:00:00Z", "4.5")
+        sketches.add("3005", "LERWICK", 60.1, -1.2, "2026-02-01T00:00:00Z", "4.0")
+        sketches.add("3005", "LERWICK", 60.1, -1.2, "2026-02-01 01:00:00", 3.5)
+        sketches.add("3005", "LERWICK", 60.1, -1.2, "2026-02-01T02:00:00Z", None)
+        sketches.add("3005", "LERWICK", 60.1, -1.2, "2026-02-01T03:00:00Z", "NA")
+
+        assert sketches.months() == [(2026, 1), (2026, 2)]
+        assert sketches.sites_for(2026, 2)["3005"]["digest"].count == 2
+
+    @patch('helpers.quantile_sketch.save_json_to_s3_if_unchanged', return_value='"new"')
+    @patch('helpers.quantile_sketch.load_json_and_etag_from_s3')
+    def test_save_merges_into_stored_sketch(self, mock_load, mock_save):
+        stored = TDigest()
+        stored.add(10.0)
+        mock_load.return_value = ({"sites": {"3005": {"site_name": "LERWICK", "lat": 60.1, "lon": -1.2,
+                                                       "digest": stored.to_dict()}}}, '"old"')
+        sketches = MonthlySiteSketches()
+        sketches.add("3005", "LERWICK", 60.1, -1.2, "2026-02-01T00:00:00Z", 20.0)
+
+        assert sketches.save("lake", "datahub") is True
+
+        data, bucket, key, etag = mock_save.call_args[0]
+        assert (bucket, key, etag) == ("lake", month_sketch_key("datahub", 2026, 2), '"old"')
+        assert data["sites"]["3005"]["digest"]["n"] == 2
+
+    @patch('helpers.quantile_sketch.save_json_to_s3_if_unchanged', return_value='"new"')
+    @patch('helpers.quantile_sketch.load_json_and_etag_from_s3')
+    def test_save_with_replace_overwrites_stored_sketch(self, mock_load, mock_save):
+        stored = TDigest()
+        stored.add(10.0)
+        mock_load.return_value = ({"sites": {"9": {"site_name": "X", "lat": 1, "lon": 2,
+                                                    "digest": stored.to_dict()}}}, '"old"')
+        sketches = MonthlySiteSketches()
+        sketches.add("9", "X", 1, 2, "2021-03-01 00:00:00", 20.0)
+
+        sketches.save("lake", "midas", replace=True)
+
+        assert mock_save.call_args[0][0]["sites"]["9"]["digest"]["n"] == 1
+
+    @patch('helpers.quantile_sketch.save_json_to_s3_if_unchanged', side_effect=[None, '"new"'])
+    @patch('helpers.quantile_sketch.load_json_and_etag_from_s3', return_value=(None, None))
+    def test_conflicting_write_is_retried(self, mock_load, mock_save):
+        sketches = MonthlySiteSketches()
+        sketches.add("3005", "LERWICK", 60.1, -1.2, "2026-02-01T00:00:00Z", 20.0)
+
+        assert sketches.save("lake", "datahub") is True
+        assert mock_load.call_count == 2
+
+
+class TestMonthlySummary:
+    @patch('helpers.quantile_sketch.load_json_and_etag_from_s3')
+    def test_summary_rows_come_from_sketches(self, mock_load):
+        digest = TDigest()
+        for value in range(101):
+            digest.add(value / 10)
+        mock_load.return_value = ({"sites": {"3005": {"site_name": "LERWICK", "lat": 60.1, "lon": -1.2,
+                                                       "digest": digest.to_dict()}}}, '"etag"')
+
+        row, = monthly_summary("lake", 2026, 2)
+
+        assert row["site_id"] == "3005" and (row["year"], row["month"]) == (2026, 2)
+        assert abs(row["low_temp"] - 0.5) < 0.1
+        assert abs(row["median_temp"] - 5.0) < 0.1
+        assert abs(row["high_temp"] - 9.5) < 0.1
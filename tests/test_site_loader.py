@@ -1,56 +1,132 @@
 import pytest
 import os
+import tempfile
 from unittest.mock import Mock, patch
-from datahub_etl.site_loader import get_sites, load_sites_from_athena, clear_cache
+from datahub_etl.site_loader import (
+    get_sites,
+    load_sites_from_athena,
+    clear_cache,
+    load_sites_snapshot,
+    save_sites_snapshot,
+    refresh_sites_snapshot
+)
 from tests.fixtures import SAMPLE_SITE
 
+ATHENA_ROWS = [
+    {'site_id': '3005', 'site_name': 'LERWICK (S. SCREEN)', 'site_country': 'SCOTLAND',
+     'site_elevation': 82.0, 'lat': 60.139, 'lon': -1.183},
+    {'site_id': '3017', 'site_name': 'KIRKWALL AIRPORT', 'site_country': 'SCOTLAND',
+     'site_elevation': 26.0, 'lat': 58.954, 'lon': -2.9}
+]
+
 
 class TestGetSites:
     def setup_method(self):
         """Clear cache before each test"""
         clear_cache()
+        self.snapshot_file = tempfile.mktemp(suffix='.json')
+
+    def teardown_method(self):
+        if os.path.exists(self.snapshot_file):
+            os.unlink(self.snapshot_file)
 
+    @patch('datahub_etl.site_loader.load_sites_from_s3', return_value=(None, None))
     @patch('datahub_etl.site_loader.load_sites_from_athena')
-    def test_get_sites_loads_from_athena(self, mock_load):
-        """get_sites should load from Athena"""
+    def test_get_sites_loads_from_athena(self, mock_load, mock_load_s3):
+        """get_sites should load from Athena when there is no snapshot"""
         mock_load.return_value = [SAMPLE_SITE]
 
-        sites = get_sites()
+        sites = get_sites(snapshot_file=self.snapshot_file)
 
         mock_load.assert_called_once()
         assert sites == [SAMPLE_SITE]
         assert all('site_name' in s for s in sites)
 
     @patch.dict(os.environ, {'USE_ATHENA_SITES': 'false'})
+    @patch('datahub_etl.site_loader.load_sites_from_s3', return_value=(None, None))
     @patch('datahub_etl.site_loader.load_sites_from_athena')
-    def test_get_sites_respects_env_var_false(self, mock_load):
+    def test_get_sites_respects_env_var_false(self, mock_load, mock_load_s3):
         """Env var no longer used, always loads from Athena"""
         mock_load.return_value = [SAMPLE_SITE]
 
-        sites = get_sites()
+        sites = get_sites(snapshot_file=self.snapshot_file)
 
         mock_load.assert_called_once()
         assert len(sites) == 1
 
 
+class TestTieredSiteSource:
+    def setup_method(self):
+        clear_cache()
+        self.snapshot_file = tempfile.mktemp(suffix='.json')
+
+    def teardown_method(self):
+        if os.path.exists(self.snapshot_file):
+            os.unlink(self.snapshot_file)
+
+    @patch('datahub_etl.site_loader.load_sites_from_s3')
+    @patch('datahub_etl.site_loader.load_sites_from_athena')
+    def test_fresh_snapshot_avoids_s3_and_athena(self, mock_athena, mock_s3):
+        save_sites_snapshot([SAMPLE_SITE], '"v1"', "s3", self.snapshot_file)
+
+        sites = get_sites(snapshot_file=self.snapshot_file)
+
+        assert sites == [SAMPLE_SITE]
+        mock_s3.assert_not_called()
+        mock_athena.assert_not_called()
+
+    @patch('datahub_etl.site_loader.load_sites_from_athena')
+    @patch('datahub_etl.site_loader.load_sites_from_s3')
+    def test_s3_snapshot_is_used_before_athena_and_saved_locally(self, mock_s3, mock_athena):
+        mock_s3.return_value = ([SAMPLE_SITE], '"v1"')
+
+        sites = get_sites(snapshot_file=self.snapshot_file)
+
+        assert sites == [SAMPLE_SITE]
+        mock_athena.assert_not_called()
+        assert load_sites_snapshot(self.snapshot_file)["version"] == '"v1"'
+
+    @patch('datahub_etl.site_loader._refresh_in_background')
+    @patch('datahub_etl.site_loader.load_sites_from_athena')
+    def test_stale_snapshot_is_used_while_refreshing_in_background(self, mock_athena, mock_refresh):
+        save_sites_snapshot([SAMPLE_SITE], '"v1"', "s3", self.snapshot_file)
+
+        sites = get_sites(snapshot_file=self.snapshot_file, max_age_seconds=0)
+
+        assert sites == [SAMPLE_SITE]
+        mock_athena.assert_not_called()
+        assert mock_refresh.call_args[1]["known_version"] == '"v1"'
+
+    @patch('datahub_etl.site_loader.load_sites_from_s3', return_value=(None, '"v1"'))
+    @patch('datahub_etl.site_loader.load_sites_from_athena')
+    def test_refresh_keeps_snapshot_when_s3_unchanged(self, mock_athena, mock_s3):
+        save_sites_snapshot([SAMPLE_SITE], '"v1"', "s3", self.snapshot_file)
+
+        sites = refresh_sites_snapshot(snapshot_file=self.snapshot_file, known_version='"v1"')
+
+        assert sites == [SAMPLE_SITE]
+        mock_athena.assert_not_called()
+
+    @patch('datahub_etl.site_loader.load_sites_from_s3', side_effect=Exception("No credentials"))
+    @patch('datahub_etl.site_loader.load_sites_from_athena', side_effect=AttributeError("Query failed"))
+    def test_falls_back_to_bundled_sites(self, mock_athena, mock_s3):
+        sites = get_sites(snapshot_file=self.snapshot_file)
+
+        assert sites[0] == SAMPLE_SITE
+        assert len(sites) > 100
+
+
 class TestLoadSitesFromAthena:
     def setup_method(self):
         """Clear cache before each test"""
         clear_cache()
 
     @patch('helpers.aws.execute_athena_query')
-    @patch('helpers.aws.load_text_from_s3')
-    def test_load_from_athena_parses_csv_correctly(self, mock_load_text, mock_execute):
-        """Should parse Athena CSV results into site dictionaries"""
-        # Mock Athena query result location
+    @patch('helpers.aws.read_athena_results')
+    def test_load_from_athena_reads_typed_rows(self, mock_read_results, mock_execute):
+        """Should build sites from the rows streamed back from Athena"""
         mock_execute.return_value = "s3://dantelore.queryresults/results/abc123.csv"
-
-        # Mock S3 CSV content
-        csv_content = """site_id,site_name,site_country,site_elevation,lat,lon
-3005,LERWICK (S. SCREEN),SCOTLAND,82.0,60.139,-1.183
-3017,KIRKWALL AIRPORT,SCOTLAND,26.0,58.954,-2.9"""
-
-        mock_load_text.return_value = csv_content
+        mock_read_results.return_value = iter([ATHENA_ROWS[0], ATHENA_ROWS[1]])
 
         sites = load_sites_from_athena()
 
@@ -65,18 +141,14 @@ class TestLoadSitesFromAthena:
         }
 
         mock_execute.assert_called_once()
-        mock_load_text.assert_called_once_with('dantelore.queryresults', 'results/abc123.csv')
+        mock_read_results.assert_called_once_with("s3://dantelore.queryresults/results/abc123.csv")
 
     @patch('helpers.aws.execute_athena_query')
-    @patch('helpers.aws.load_text_from_s3')
-    def test_load_from_athena_caches_results(self, mock_load_text, mock_execute):
+    @patch('helpers.aws.read_athena_results')
+    def test_load_from_athena_caches_results(self, mock_read_results, mock_execute):
         """Should cache results and not re-query Athena"""
         mock_execute.return_value = "s3://dantelore.queryresults/results/abc123.csv"
-
-        csv_content = """site_id,site_name,site_country,site_elevation,lat,lon
-3005,LERWICK (S. SCREEN),SCOTLAND,82.0,60.139,-1.183"""
-
-        mock_load_text.return_value = csv_content
+        mock_read_results.return_value = iter([ATHENA_ROWS[0]])
 
         # First call
         sites1 = load_sites_from_athena()
@@ -91,7 +163,7 @@ class TestLoadSitesFromAthena:
         """Should fail fast when Athena query fails"""
         mock_execute.return_value = None
 
-        with pytest.raises(AttributeError):
+        with pytest.raises(RuntimeError):
             load_sites_from_athena()
 
 
@@ -99,13 +171,9 @@ class TestCacheClearing:
     def test_clear_cache_resets_module_cache(self):
         """Should reset cache to allow fresh queries"""
         with patch('helpers.aws.execute_athena_query') as mock_execute:
-            with patch('helpers.aws.load_text_from_s3') as mock_load_text:
+            with patch('helpers.aws.read_athena_results') as mock_read_results:
                 mock_execute.return_value = "s3://bucket/key.csv"
-
-                csv_content = """site_id,site_name,site_country,site_elevation,lat,lon
-3005,LERWICK (S. SCREEN),SCOTLAND,82.0,60.139,-1.183"""
-
-                mock_load_text.return_value = csv_content
+                mock_read_results.side_effect = lambda location: iter([ATHENA_ROWS[0]])
 
                 # Load with caching
                 load_sites_from_athena()
@@ -0,0 +1,46 @@
+import pytest
+from datahub_etl.site_registry import Site, SiteRegistry
+from tests.fixtures import SAMPLE_SITE
+
+KIRKWALL = {
+    "site_id": "3017",
+    "site_name": "KIRKWALL AIRPORT",
+    "site_country": "SCOTLAND",
+    "site_elevation": 26.0,
+    "lat": 58.954,
+    "lon": -2.9
+}
+
+
+class TestSite:
+    def test_site_reads_like_the_dict_it_replaces(self):
+        site = Site.from_dict(SAMPLE_SITE)
+
+        assert site["lat"] == 60.139
+        assert site.get("missing") is None
+        assert "site_name" in site
+        assert site == SAMPLE_SITE
+        assert site.to_dict() == SAMPLE_SITE
+
+    def test_unknown_key_raises_key_error(self):
+        with pytest.raises(KeyError):
+            Site.from_dict(SAMPLE_SITE)["geohash"]
+
+
+class TestSiteRegistry:
+    def test_lookup_by_site_id(self):
+        registry = SiteRegistry([SAMPLE_SITE, KIRKWALL])
+
+        assert registry.get("3017").site_name == "KIRKWALL AIRPORT"
+        assert registry.get(3005).site_name == "LERWICK (S. SCREEN)"
+        assert registry.get("9999") is None
+        assert "3017" in registry
+
+    def test_registry_behaves_like_site_list(self):
+        registry = SiteRegistry([SAMPLE_SITE, KIRKWALL])
+
+        assert len(registry) == 2
+        assert registry[0] == SAMPLE_SITE
+        assert registry == [SAMPLE_SITE, KIRKWALL]
+        assert registry.to_dicts() == [SAMPLE_SITE, KIRKWALL]
+        assert SiteRegistry.from_sites(registry) is registry
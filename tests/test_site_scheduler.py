@@ -0,0 +1,47 @@
+from datahub_etl.site_scheduler import SiteScheduler, site_priority, update_expected_yield
+
+SITES = [
+    {"site_id": "3005", "site_name": "Site A"},
+    {"site_id": "3017", "site_name": "Site B"},
+    {"site_id": "3026", "site_name": "Site C"}
+]
+
+
+class TestSitePriority:
+    def test_failures_push_site_back(self):
+        healthy = {"last_fetched": "2026-02-13T10:00:00Z"}
+        failing = {"last_fetched": "2026-02-13T10:00:00Z", "failures": 3}
+
+        assert site_priority(failing) - site_priority(healthy) == 3 * 3600
+
+    def test_sites_without_new_rows_are_pushed_back(self):
+        productive = {"last_fetched": "2026-02-13T10:00:00Z", "yield": 24.0}
+        empty = {"last_fetched": "2026-02-13T10:00:00Z", "yield": 0.0}
+
+        assert site_priority(empty) > site_priority(productive)
+
+    def test_expected_yield_is_a_moving_average(self):
+        assert update_expected_yield(None, 24) == 24.0
+        assert update_expected_yield(24.0, 0) == 16.8
+
+
+class TestSiteScheduler:
+    def test_pops_most_overdue_sites_first(self):
+        cache = {
+            "3005": {"geohash": "abc", "last_fetched": "2026-02-13T10:00:00Z"},
+            "3017": {"geohash": "def", "last_fetched": "2026-02-13T11:00:00Z", "failures": 0},
+            "3026": {"geohash": "ghi", "last_fetched": "2026-02-13T09:00:00Z", "failures": 3}
+        }
+
+        scheduler = SiteScheduler(SITES, cache)
+
+        assert [site["site_id"] for site, _ in scheduler.take(2)] == ["3005", "3017"]
+        assert len(scheduler) == 1
+
+    def test_iterates_lazily(self):
+        scheduler = SiteScheduler(SITES, {})
+
+        first = next(iter(scheduler))
+
+        assert first == (SITES[0], "1970-01-01T00:00:00Z")
+        assert len(scheduler) == 2
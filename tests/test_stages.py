@@ -0,0 +1,112 @@
+import pytest
+import threading
+from unittest.mock import patch
+from weather_data_model.stages import Stage, run_stages, table_stages
+
+
+def _recorder(order, name, result=None, error=None):
+    def run(results):
+        order.append(name)
+        if error:
+            raise error
+        return result
+    return run
+
+
+class TestRunStages:
+    def test_dependencies_finish_first_and_pass_their_results(self):
+        order = []
+        seen = {}
+
+        def summary(results):
+            seen.update(results)
+            order.append("summary")
+
+        run_stages([
+            Stage("summary", run=summary, depends_on=["weather"]),
+            Stage("weather", run=_recorder(order, "weather", result=[(2026, 3)])),
+        ])
+
+        assert order == ["weather", "summary"]
+        assert seen == {"weather": [(2026, 3)]}
+
+    def test_independent_stages_run_at_the_same_time(self):
+        both_started = threading.Barrier(2, timeout=5)
+
+        def run(results):
+            both_started.wait()
+            return True
+
+        results = run_stages([Stage("a", run=run), Stage("b", run=run)])
+
+        assert results == {"a": True, "b": True}
+
+    def test_failed_stage_is_retried_after_clearing_its_output(self):
+        attempts = []
+
+        def flaky(results):
+            attempts.append(len(attempts))
+            if len(attempts) == 1:
+                raise RuntimeError("throttled")
+            return "ok"
+
+        sleeps = []
+        stage = Stage("weather", run=flaky, output_location="s3://lake/weather/")
+        with patch('weather_data_model.stages.delete_folder_from_s3', return_value=(0, [])) as mock_delete:
+            results = run_stages([stage], sleep=sleeps.append)
+
+        assert results == {"weather": "ok"}
+        assert len(sleeps) == 1
+        mock_delete.assert_called_once_with("lake", "weather/")
+
+    def test_failure_skips_dependents_but_not_other_stages(self):
+        order = []
+        stages = [
+            Stage("weather", run=_recorder(order, "weather", error=ValueError("bad")), attempts=1),
+            Stage("summary", run=_recorder(order, "summary"), depends_on=["weather"]),
+            Stage("report", run=_recorder(order, "report"), depends_on=["summary"]),
+            Stage("sites", run=_recorder(order, "sites")),
+        ]
+
+        with pytest.raises(RuntimeError, match="Stages failed: weather \\(skipped summary, report\\)"):
+            run_stages(stages)
+
+        assert sorted(order) == ["sites", "weather"]
+
+    def test_partial_clear_fails_the_stage_and_skips_the_build(self):
+        stages = table_stages("weather", "create table", "s3://lake/weather/")
+
+        with patch('weather_data_model.stages.delete_folder_from_s3',
+                   side_effect=RuntimeError("Failed to delete 3 files")) as mock_delete, \
+                patch('weather_data_model.stages.execute_athena_command') as mock_execute:
+            with pytest.raises(RuntimeError, match="Stages failed: clear weather \\(skipped weather\\)"):
+                run_stages(stages, sleep=lambda seconds: None)
+
+        assert mock_delete.call_count == 2
+        mock_execute.assert_not_called()
+
+    def test_sql_stage_fails_when_the_query_does(self):
+        with patch('weather_data_model.stages.execute_athena_command', return_value=False) as mock_execute:
+            with pytest.raises(RuntimeError):
+                run_stages([Stage("weather", sql="create table", attempts=1)])
+
+        mock_execute.assert_called_once_with("create table", "lake", "dantelore.queryresults", 120)
+
+    def test_rejects_unknown_and_circular_dependencies(self):
+        with pytest.raises(ValueError, match="unknown stage"):
+            run_stages([Stage("a", run=print, depends_on=["b"])])
+        with pytest.raises(ValueError, match="depend on each other"):
+            run_stages([Stage("a", run=print, depends_on=["b"]), Stage("b", run=print, depends_on=["a"])])
+
+
+class TestTableStages:
+    def test_clear_and_drop_come_before_the_build(self):
+        stages = table_stages("summary", "create table", "s3://lake/summary/", depends_on=["weather"],
+                              drop_partitions=lambda: None)
+
+        assert [(stage.name, stage.depends_on) for stage in stages] == [
+            ("clear summary", ()),
+            ("drop summary partitions", ()),
+            ("summary", ("clear summary", "drop summary partitions", "weather")),
+        ]
+        assert stages[-1].output_location == "s3://lake/summary/"
@@ -0,0 +1,42 @@
+from datahub_etl.station_index import StationIndex, build_station_index, decode_geohash, haversine_km
+from tests.fixtures import SAMPLE_SITE
+
+
+class TestGeohash:
+    def test_decode_geohash_returns_cell_centre(self):
+        lat, lon = decode_geohash("gfxnj5")
+
+        assert haversine_km(lat, lon, SAMPLE_SITE["lat"], SAMPLE_SITE["lon"]) < 1.0
+
+
+class TestStationIndex:
+    def test_nearest_returns_closest_station_within_range(self):
+        index = StationIndex()
+        index.add(60.139, -1.183, "gfxnj5")
+        index.add(58.954, -2.9, "gfk4ke")
+
+        geohash, distance = index.nearest(60.14, -1.18, max_distance_km=2)
+
+        assert geohash == "gfxnj5"
+        assert distance < 1.0
+
+    def test_nearest_searches_neighbouring_cells(self):
+        index = StationIndex(cell_degrees=0.5)
+        index.add(50.49, -4.01, "gbumvn")
+
+        assert index.nearest(50.51, -3.99, max_distance_km=5)[0] == "gbumvn"
+
+    def test_nearest_returns_none_when_out_of_range(self):
+        index = StationIndex()
+        index.add(58.954, -2.9, "gfk4ke")
+
+        assert index.nearest(60.139, -1.183, max_distance_km=10) is None
+
+    def test_build_index_uses_resolved_sites_only(self):
+        sites = [SAMPLE_SITE, {**SAMPLE_SITE, "site_id": "3017", "lat": 58.954, "lon": -2.9}]
+        cache = {"3005": {"geohash": "gfxnj5", "last_fetched": None}}
+
+        index = build_station_index(sites, cache)
+
+        assert len(index) == 2  # site location and decoded station location
+        assert index.nearest(58.954, -2.9, max_distance_km=5) is None
@@ -0,0 +1,41 @@
+from datahub_etl.warm_state import WarmState
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestWarmState:
+    def test_values_expire_after_ttl(self):
+        clock = FakeClock()
+        state = WarmState(clock=clock)
+        state.put("client", "value", ttl_seconds=60)
+
+        clock.now = 59
+        assert state.get("client") == "value"
+
+        clock.now = 60
+        assert state.get("client") is None
+        assert not state.contains("client")
+
+    def test_version_mismatch_invalidates_value(self):
+        state = WarmState()
+        state.put("cache", {"3005": "gfxnj5"}, version='"v1"')
+
+        assert state.get("cache", version='"v1"') == {"3005": "gfxnj5"}
+        assert state.get("cache", version='"v2"') is None
+        assert state.get("cache") is None
+
+    def test_invalidate_all(self):
+        state = WarmState()
+        state.put("a", 1)
+        state.put("b", 2)
+
+        state.invalidate()
+
+        assert state.get("a") is None
+        assert state.get("b") is None
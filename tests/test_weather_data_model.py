@@ -0,0 +1,202 @@
+import pytest
+from datetime import date
+from unittest.mock import patch
+from weather_data_model import incremental
+from weather_data_model.lambda_function import build_data_models, model_stages
+from weather_data_model.model_sql import SUMMARY_TABLE_SQL, WEATHER_TABLE_SQL
+
+DAYS = [date(2026, 2, 28), date(2026, 3, 1)]
+
+
+class TestIncrementalSql:
+    def test_watermark_day_is_processed_again(self):
+        assert incremental.incoming_days(date(2026, 2, 28), date(2026, 3, 1)) == DAYS
+
+    def test_partition_filter_uses_unpadded_incoming_values(self):
+        assert incremental.incoming_partition_filter(DAYS) == (
+            "(year = '2026' and month = '2' and day = '28') or (year = '2026' and month = '3' and day = '1')"
+        )
+
+    def test_month_rebuild_merges_lake_rows_with_new_incoming_rows(self):
+        sql = incremental.rebuild_month_sql(2026, 2, DAYS, "s3://lake/weather_builds/build=1/year=2026/month=2/")
+
+        assert "from lake.weather\n                where year = 2026 and month = 2" in sql
+        assert "year(observation_ts) = 2026 and month(observation_ts) = 2" in sql
+        assert incremental.incoming_partition_filter(DAYS) in sql
+        assert incremental.BROKEN_READINGS_FILTER in sql
+        assert "where rn = 1" in sql
+        assert "to 's3://lake/weather_builds/build=1/year=2026/month=2/'" in sql
+
+
+class TestIncrementalBuild:
+    @patch('weather_data_model.incremental._delete_location')
+    @patch('weather_data_model.incremental.execute_athena_commands', return_value=True)
+    @patch('weather_data_model.incremental.get_glue_partition_location')
+    @patch('weather_data_model.incremental.touched_months', return_value=[(2026, 2), (2026, 3)])
+    def test_rebuilds_and_swaps_touched_months(self, mock_months, mock_location, mock_execute, mock_delete):
+        old = {(2026, 2): "s3://lake/weather/year=2026/month=2", (2026, 3): None}
+        mock_location.side_effect = lambda table, database, month: old[month]
+
+        months = incremental.build_weather_incrementally("lake", date(2026, 2, 28), date(2026, 3, 1), build_id="7")
+
+        assert months == [(2026, 2), (2026, 3)]
+        unloads, add_partitions, set_locations = [c[0][0] for c in mock_execute.call_args_list]
+        assert len(unloads) == 2
+        assert add_partitions == [
+            "ALTER TABLE weather ADD IF NOT EXISTS "
+            "PARTITION (year=2026, month=2) LOCATION 's3://lake/weather_builds/build=7/year=2026/month=2/' "
+            "PARTITION (year=2026, month=3) LOCATION 's3://lake/weather_builds/build=7/year=2026/month=3/'"
+        ]
+        assert set_locations[1] == (
+            "ALTER TABLE weather PARTITION (year=2026, month=3) "
+            "SET LOCATION 's3://lake/weather_builds/build=7/year=2026/month=3/'"
+        )
+        mock_delete.assert_called_once_with("s3://lake/weather/year=2026/month=2")
+
+    def test_builds_are_written_outside_the_table_folder(self):
+        location = incremental.month_location("lake", 2026, 2, "7")
+
+        assert location == "s3://lake/weather_builds/build=7/year=2026/month=2/"
+        assert not location.startswith("s3://lake/weather/")
+
+    @patch('weather_data_model.incremental._delete_location')
+    @patch('weather_data_model.incremental.execute_athena_commands', return_value=False)
+    @patch('weather_data_model.incremental.get_glue_partition_location', return_value=None)
+    @patch('weather_data_model.incremental.touched_months', return_value=[(2026, 3)])
+    def test_failed_rebuild_leaves_partitions_alone(self, mock_months, mock_location, mock_execute, mock_delete):
+        with pytest.raises(RuntimeError):
+            incremental.build_weather_incrementally("lake", date(2026, 3, 1), date(2026, 3, 1), build_id="7")
+
+        mock_execute.assert_called_once()
+        mock_delete.assert_called_once_with("s3://lake/weather_builds/build=7/year=2026/month=3/")
+
+    @patch('weather_data_model.incremental._delete_location')
+    @patch('weather_data_model.incremental.execute_athena_commands', side_effect=[True, True, False])
+    @patch('weather_data_model.incremental.get_glue_partition_location')
+    @patch('weather_data_model.incremental.touched_months', return_value=[(2026, 2), (2026, 3)])
+    def test_failed_swap_removes_builds_nothing_points_at(self, mock_months, mock_location, mock_execute,
+                                                          mock_delete):
+        new = {month: incremental.month_location("lake", *month, "7") for month in [(2026, 2), (2026, 3)]}
+        # Before the build, then after a swap where only March's SET LOCATION went through
+        mock_location.side_effect = [
+            "s3://lake/weather/year=2026/month=2", "s3://lake/weather_builds/build=6/year=2026/month=3/",
+            "s3://lake/weather/year=2026/month=2", new[(2026, 3)],
+        ]
+
+        with pytest.raises(RuntimeError, match="Failed to swap"):
+            incremental.build_weather_incrementally("lake", date(2026, 2, 28), date(2026, 3, 1), build_id="7")
+
+        assert [c[0][0] for c in mock_delete.call_args_list] == [
+            new[(2026, 2)], "s3://lake/weather_builds/build=6/year=2026/month=3/"
+        ]
+
+    @patch('weather_data_model.incremental.execute_athena_commands')
+    @patch('weather_data_model.incremental.touched_months', return_value=[])
+    def test_nothing_new_runs_nothing(self, mock_months, mock_execute):
+        assert incremental.build_weather_incrementally("lake", date(2026, 3, 1), date(2026, 3, 1)) == []
+        mock_execute.assert_not_called()
+
+
+class TestIncrementalSummary:
+    def test_month_summary_matches_full_summary_measures(self):
+        sql = incremental.summarise_month_sql(2026, 3, "s3://lake/weather_monthly_site_summary/year=2026/month=3/")
+
+        assert "approx_percentile(temperature, 0.05) as low_temp" in sql
+        assert "where year = 2026 and month = 3" in sql
+        assert "group by site_id, site_name, lat, lon" in sql
+
+    @patch('weather_data_model.incremental.replace_months')
+    def test_only_changed_months_are_summarised(self, mock_replace):
+        incremental.build_summary_incrementally("lake", [(2026, 3)], build_id="7")
+
+        table, statements, locations = mock_replace.call_args[0][:3]
+        assert table == "weather_monthly_site_summary"
+        assert locations == {(2026, 3): "s3://lake/weather_monthly_site_summary_builds/build=7/year=2026/month=3/"}
+        assert len(statements) == 1
+
+    @patch('weather_data_model.incremental.replace_months')
+    def test_no_changed_months_leaves_summary_alone(self, mock_replace):
+        assert incremental.build_summary_incrementally("lake", []) == []
+        mock_replace.assert_not_called()
+
+
+@patch('weather_data_model.lambda_function.save_watermark')
+@patch('weather_data_model.lambda_function.build_summary_incrementally')
+@patch('weather_data_model.lambda_function.build_weather_incrementally', return_value=[(2026, 3)])
+@patch('weather_data_model.lambda_function.execute_athena_command', return_value=True)
+@patch('weather_data_model.stages.delete_folder_from_s3', return_value=(0, []))
+@patch('weather_data_model.stages.execute_athena_command', return_value=True)
+@patch('weather_data_model.lambda_function.delete_folder_from_s3', return_value=(0, []))
+class TestBuildDataModels:
+    @patch('weather_data_model.lambda_function.list_glue_partitions', return_value=[('2026', '2')])
+    @patch('weather_data_model.lambda_function.load_watermark', return_value=date(2026, 3, 1))
+    def test_builds_incrementally_from_watermark(self, mock_load, mock_partitions, mock_clear_builds, mock_ctas,
+                                                 mock_delete, mock_drop, mock_incremental, mock_summary,
+                                                 mock_save):
+        build_data_models("lake")
+
+        assert mock_incremental.call_args[0][:2] == ("lake", date(2026, 3, 1))
+        mock_summary.assert_called_once_with("lake", [(2026, 3)])
+        mock_ctas.assert_not_called()
+        mock_delete.assert_not_called()
+        mock_save.assert_called_once()
+
+    @patch('weather_data_model.lambda_function.list_glue_partitions', return_value=[('2026', '2')])
+    @patch('weather_data_model.lambda_function.load_watermark', return_value=None)
+    def test_first_build_is_full(self, mock_load, mock_partitions, mock_clear_builds, mock_ctas, mock_delete,
+                                 mock_drop, mock_incremental, mock_summary, mock_save):
+        build_data_models("lake")
+
+        assert [c[0][0] for c in mock_ctas.call_args_list] == [WEATHER_TABLE_SQL, SUMMARY_TABLE_SQL]
+        assert sorted(c[0][1] for c in mock_delete.call_args_list) == ["weather/", "weather_monthly_site_summary/"]
+        assert sorted(c[0][1] for c in mock_clear_builds.call_args_list) == [
+            "weather_builds/", "weather_monthly_site_summary_builds/"
+        ]
+        assert mock_drop.call_count == 2
+        mock_incremental.assert_not_called()
+        mock_summary.assert_not_called()
+        mock_save.assert_called_once()
+
+    @patch('weather_data_model.lambda_function.list_glue_partitions', return_value=[])
+    @patch('weather_data_model.lambda_function.load_watermark', return_value=date(2026, 3, 1))
+    def test_summary_without_month_partitions_is_rebuilt_in_full(self, mock_load, mock_partitions,
+                                                                 mock_clear_builds, mock_ctas, mock_delete,
+                                                                 mock_drop, mock_incremental, mock_summary,
+                                                                 mock_save):
+        build_data_models("lake")
+
+        mock_incremental.assert_called_once()
+        mock_ctas.assert_called_once_with(SUMMARY_TABLE_SQL, "lake", "dantelore.queryresults", 120)
+        mock_drop.assert_not_called()
+        mock_summary.assert_not_called()
+
+    @patch('weather_data_model.lambda_function.list_glue_partitions', return_value=[('2026', '2')])
+    @patch('weather_data_model.lambda_function.load_watermark', return_value=None)
+    def test_failed_build_keeps_the_watermark(self, mock_load, mock_partitions, mock_clear_builds, mock_ctas,
+                                              mock_delete, mock_drop, mock_incremental, mock_summary, mock_save):
+        mock_ctas.return_value = False
+
+        with patch('weather_data_model.stages.time.sleep'), pytest.raises(RuntimeError):
+            build_data_models("lake")
+
+        # lake.weather is retried once, and the summary that reads it never runs
+        assert [c[0][0] for c in mock_ctas.call_args_list] == [WEATHER_TABLE_SQL, WEATHER_TABLE_SQL]
+        mock_save.assert_not_called()
+
+
+class TestModelStages:
+    def test_full_build_clears_both_tables_before_building_either(self):
+        stages = {stage.name: stage for stage in model_stages("lake", None, date(2026, 3, 1), [('2026', '2')])}
+
+        assert stages["weather"].depends_on == ("clear weather", "drop weather partitions")
+        assert stages["weather_monthly_site_summary"].depends_on == (
+            "clear weather_monthly_site_summary", "drop weather_monthly_site_summary partitions", "weather"
+        )
+        assert not stages["clear weather_monthly_site_summary"].depends_on
+
+    def test_incremental_summary_follows_the_weather_months(self):
+        stages = model_stages("lake", date(2026, 3, 1), date(2026, 3, 1), [('2026', '2')])
+
+        assert [(stage.name, stage.depends_on) for stage in stages] == [
+            ("weather months", ()), ("summary months", ("weather months",))
+        ]
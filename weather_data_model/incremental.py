@@ -0,0 +1,200 @@
+from datetime import date, datetime, timedelta, timezone
+from helpers.aws import (
+    delete_folder_from_s3,
+    execute_athena_commands,
+    execute_athena_query,
+    get_glue_partition_location,
+    load_json_from_s3,
+    read_athena_results,
+    save_json_to_s3,
+    split_s3_location
+)
+from .model_sql import BROKEN_READINGS_FILTER, SUMMARY_MEASURES, WEATHER_COLUMNS
+
+ATHENA_DATABASE = "lake"
+ATHENA_RESULTS_BUCKET = "dantelore.queryresults"
+WATERMARK_KEY = "weather_model_state/watermark.json"
+WEATHER_TABLE_LOCATION = "weather"
+SUMMARY_TABLE_LOCATION = "weather_monthly_site_summary"
+ATHENA_WAIT_SECONDS = 120
+
+
+def load_watermark(data_lake_bucket):
+    """The last incoming day folded into lake.weather, or None if the lake has never been built"""
+    watermark = load_json_from_s3(data_lake_bucket, WATERMARK_KEY)
+    if not watermark or not watermark.get("last_day"):
+        return None
+    return date.fromisoformat(watermark["last_day"])
+
+
+def save_watermark(data_lake_bucket, last_day):
+    return save_json_to_s3(
+        {"last_day": last_day.isoformat(), "built_at": datetime.now(timezone.utc).isoformat()},
+        data_lake_bucket, WATERMARK_KEY
+    )
+
+
+def incoming_days(last_day, today):
+    # The watermark day is included again, as hourly loads kept adding to it after the last build
+    return [last_day + timedelta(days=offset) for offset in range((today - last_day).days + 1)]
+
+
+def incoming_partition_filter(days):
+    # incoming.weather partition values are unpadded strings, as written by the DataHub lambda
+    return " or ".join(f"(year = '{day.year}' and month = '{day.month}' and day = '{day.day}')" for day in days)
+
+
+def touched_months(days, database=ATHENA_DATABASE, results_bucket=ATHENA_RESULTS_BUCKET):
+    """(year, month) of every observation in the given incoming days - observations near midnight
+    can land in a different month from the day they were loaded"""
+    sql = f"""
+    select distinct year(observation_ts) as obs_year, month(observation_ts) as obs_month
+    from incoming.weather
+    where {incoming_partition_filter(days)}
+    """
+    output_location = execute_athena_query(sql, database, results_bucket, ATHENA_WAIT_SECONDS)
+    if output_location is None:
+        raise RuntimeError("Could not find the months touched by new incoming data")
+    return sorted((row["obs_year"], row["obs_month"]) for row in read_athena_results(output_location))
+
+
+def builds_location(data_lake_bucket, table_location=WEATHER_TABLE_LOCATION):
+    # Outside the table folder, so no live partition location covers a build in progress
+    return f"s3://{data_lake_bucket}/{table_location}_builds/"
+
+
+def month_location(data_lake_bucket, year, month, build_id, table_location=WEATHER_TABLE_LOCATION):
+    return f"{builds_location(data_lake_bucket, table_location)}build={build_id}/year={year}/month={month}/"
+
+
+def rebuild_month_sql(year, month, days, location):
+    """Existing lake rows for the month plus the new incoming rows, deduplicated as WEATHER_TABLE_SQL does,
+    unloaded as Parquet to a fresh location"""
+    columns = ", ".join(WEATHER_COLUMNS)
+    return f"""
+    unload (
+        select {columns}
+        from (
+            select {columns},
+                ROW_NUMBER() OVER ( PARTITION BY date_trunc('hour', observation_ts), site_id ORDER BY observation_ts DESC ) as rn
+            from (
+                select {columns} from lake.weather
+                where year = {year} and month = {month}
+                union all
+                select {columns} from incoming.weather
+                where ({incoming_partition_filter(days)})
+                    and year(observation_ts) = {year} and month(observation_ts) = {month}
+                    and {BROKEN_READINGS_FILTER}
+            )
+        )
+        where rn = 1
+    )
+    to '{location}'
+    with (format = 'PARQUET', compression = 'SNAPPY')
+    """
+
+
+def summarise_month_sql(year, month, location):
+    """SUMMARY_TABLE_SQL for a single month of lake.weather, unloaded as Parquet to a fresh location"""
+    return f"""
+    unload (
+        select
+            site_id,
+            site_name,
+            lat,
+            lon,{SUMMARY_MEASURES}
+        from lake.weather
+        where year = {year} and month = {month}
+        group by site_id, site_name, lat, lon
+    )
+    to '{location}'
+    with (format = 'PARQUET', compression = 'SNAPPY')
+    """
+
+
+def _swap_statements(table, locations):
+    add_partitions = " ".join(
+        f"PARTITION (year={year}, month={month}) LOCATION '{location}'"
+        for (year, month), location in locations.items()
+    )
+    set_locations = [
+        f"ALTER TABLE {table} PARTITION (year={year}, month={month}) SET LOCATION '{location}'"
+        for (year, month), location in locations.items()
+    ]
+    return f"ALTER TABLE {table} ADD IF NOT EXISTS {add_partitions}", set_locations
+
+
+def _delete_location(location):
+    bucket, prefix = split_s3_location(location.rstrip('/') + '/')
+    delete_folder_from_s3(bucket, prefix)
+
+
+def _same_location(a, b):
+    return (a or '').rstrip('/') == (b or '').rstrip('/')
+
+
+def replace_months(table, statements, locations, database=ATHENA_DATABASE, results_bucket=ATHENA_RESULTS_BUCKET):
+    """Run the statements that write each month to its new location, then point the month partitions at them.
+
+    The swap is one metadata update per partition, so readers see either the old month or the new one.
+    Old month files are deleted once nothing points at them. If the swap fails, each month is checked:
+    those that were swapped lose their old files, the rest lose the new build, and the error is raised.
+    """
+    old_locations = {month: get_glue_partition_location(table, database, month) for month in locations}
+
+    if not execute_athena_commands(statements, database, results_bucket, ATHENA_WAIT_SECONDS):
+        for location in locations.values():
+            _delete_location(location)
+        raise RuntimeError(f"Failed to rebuild {database}.{table} months")
+
+    add_partitions, set_locations = _swap_statements(table, locations)
+    swapped = (execute_athena_commands([add_partitions], database, results_bucket, ATHENA_WAIT_SECONDS) and
+               execute_athena_commands(set_locations, database, results_bucket, ATHENA_WAIT_SECONDS))
+
+    for month, location in locations.items():
+        if swapped or _same_location(get_glue_partition_location(table, database, month), location):
+            if old_locations[month] and not _same_location(old_locations[month], location):
+                _delete_location(old_locations[month])
+        else:
+            _delete_location(location)
+
+    if not swapped:
+        raise RuntimeError(f"Failed to swap rebuilt {database}.{table} months into place")
+
+
+def _build_id():
+    return datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+
+
+def build_weather_incrementally(data_lake_bucket, last_day, today, build_id=None,
+                                database=ATHENA_DATABASE, results_bucket=ATHENA_RESULTS_BUCKET):
+    """Rebuild only the lake.weather months touched by incoming data since last_day. Returns the months rebuilt."""
+    build_id = build_id or _build_id()
+    days = incoming_days(last_day, today)
+    months = touched_months(days, database, results_bucket)
+    if not months:
+        print(f"No new incoming data since {last_day}")
+        return []
+
+    print(f"Rebuilding lake.weather for {', '.join(f'{year}-{month:02d}' for year, month in months)}")
+    locations = {(year, month): month_location(data_lake_bucket, year, month, build_id) for year, month in months}
+    statements = [rebuild_month_sql(year, month, days, locations[(year, month)]) for year, month in months]
+    replace_months("weather", statements, locations, database, results_bucket)
+    return months
+
+
+def build_summary_incrementally(data_lake_bucket, months, build_id=None,
+                                database=ATHENA_DATABASE, results_bucket=ATHENA_RESULTS_BUCKET):
+    """Recompute the monthly site summary for the given months only - closed months are left as they are"""
+    if not months:
+        return []
+
+    build_id = build_id or _build_id()
+    print(f"Summarising {', '.join(f'{year}-{month:02d}' for year, month in months)}")
+    locations = {
+        (year, month): month_location(data_lake_bucket, year, month, build_id, SUMMARY_TABLE_LOCATION)
+        for year, month in months
+    }
+    statements = [summarise_month_sql(year, month, locations[(year, month)]) for year, month in months]
+    replace_months("weather_monthly_site_summary", statements, locations, database, results_bucket)
+    return months
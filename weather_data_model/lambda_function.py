@@ -1,100 +1,83 @@
-from helpers.aws import execute_athena_command, delete_folder_from_s3
+from datetime import datetime, timezone
+from helpers.aws import delete_folder_from_s3, execute_athena_command, list_glue_partitions, split_s3_location
+from .incremental import (
+    build_summary_incrementally,
+    build_weather_incrementally,
+    builds_location,
+    load_watermark,
+    save_watermark
+)
+from .model_sql import WEATHER_TABLE_SQL, SUMMARY_TABLE_SQL
+from .stages import Stage, run_stages, table_stages
 
 S3_DATA_LAKE_BUCKET = "dantelore.data.lake"
 
 WEATHER_DIR_NAME = 'weather/'
-WEATHER_TABLE_SQL = '''
-insert into lake.weather
-select 
-    observation_ts,    
-    site_id,             
-    site_name,           
-    site_country,        
-    site_continent,      
-    site_elevation,      
-    lat,                 
-    lon,                 
-    wind_direction,      	
-    screen_relative_humidity,
-    pressure,            	
-    wind_speed,          	
-    temperature,         	
-    visibility,          	
-    weather_type,
-    pressure_tendency,
-    dew_point, 
-    obs_year as year,
-    obs_month as month	   
-from 
-( 
-    select 
-        observation_ts,    
-        site_id,             
-        site_name,           
-        site_country,        
-        site_continent,      
-        site_elevation,      
-        lat,                 
-        lon,                 
-        wind_direction,      	
-        screen_relative_humidity,
-        pressure,            	
-        wind_speed,          	
-        temperature,         	
-        visibility,          	
-        weather_type,
-        pressure_tendency,
-        dew_point, 
-        month(observation_ts) as obs_month,
-        year(observation_ts) as obs_year,
-        ROW_NUMBER() OVER ( PARTITION BY date_trunc('hour', observation_ts), site_id ORDER BY observation_ts DESC ) as rn
-    from incoming.weather
-    where (year <> '2022' and month <> '7' and site_name <> 'CHIVENOR' or temperature > -5) -- exclude broken readings from Chivenor
-)
-where rn = 1
-'''
-
 SUMMARY_DIR_NAME = 'weather_monthly_site_summary/'
-SUMMARY_TABLE_SQL = '''
-insert into lake.weather_monthly_site_summary (
-    site_id,
-    site_name,
-    lat,
-    lon,
-    year,
-    month,
-    low_temp,
-    high_temp,
-    median_temp
-)
-select 
-    site_id,
-    site_name,
-    lat,
-    lon,
-    YEAR(observation_ts) as obs_year,
-    MONTH(observation_ts) as obs_month,
-    approx_percentile(temperature, 0.05) as low_temp,
-    approx_percentile(temperature, 0.95) as high_temp,
-    approx_percentile(temperature, 0.50) as median_temp
-from lake.weather
-group by site_id, site_name, lat, lon, YEAR(observation_ts), MONTH(observation_ts)
-'''
-
-
-def build_data_models(data_lake_bucket):
-    # Create the core model
-    delete_folder_from_s3(data_lake_bucket, WEATHER_DIR_NAME)
-    execute_athena_command(WEATHER_TABLE_SQL, "lake", "dantelore.queryresults", wait_seconds=120)
-
-    # Create the summary table
-    delete_folder_from_s3(data_lake_bucket, SUMMARY_DIR_NAME)
-    execute_athena_command(SUMMARY_TABLE_SQL, "lake", "dantelore.queryresults", wait_seconds=120)
+
+
+def _drop_partitions(table, partitions, builds=None):
+    # Incremental builds point partitions at build= folders, so a full rebuild starts from none at all
+    if partitions:
+        specs = ", ".join(f"PARTITION (year={year}, month={month})" for year, month in partitions)
+        if not execute_athena_command(f"ALTER TABLE {table} DROP IF EXISTS {specs}", "lake",
+                                      "dantelore.queryresults", wait_seconds=120):
+            raise RuntimeError(f"Failed to drop lake.{table} partitions")
+
+    # ...and once nothing points at those folders they can go too
+    if builds:
+        delete_folder_from_s3(*split_s3_location(builds))
+
+
+def weather_table_stages(data_lake_bucket):
+    return table_stages(
+        "weather", WEATHER_TABLE_SQL, f"s3://{data_lake_bucket}/{WEATHER_DIR_NAME}",
+        drop_partitions=lambda: _drop_partitions("weather", list_glue_partitions("weather", "lake"),
+                                                 builds_location(data_lake_bucket, "weather"))
+    )
+
+
+def summary_table_stages(data_lake_bucket, partitions, depends_on=()):
+    return table_stages(
+        "weather_monthly_site_summary", SUMMARY_TABLE_SQL, f"s3://{data_lake_bucket}/{SUMMARY_DIR_NAME}",
+        depends_on=depends_on,
+        drop_partitions=lambda: _drop_partitions("weather_monthly_site_summary", partitions,
+                                                 builds_location(data_lake_bucket, "weather_monthly_site_summary"))
+    )
+
+
+def model_stages(data_lake_bucket, last_day, today, summary_partitions):
+    """The model build as a stage graph. New derived tables add their stages here, depending on
+    the stage that builds the table they read, and run alongside the others."""
+    # Create the core model, incrementally unless it has never been built
+    if last_day is None:
+        stages = weather_table_stages(data_lake_bucket)
+    else:
+        stages = [Stage("weather months",
+                        run=lambda results: build_weather_incrementally(data_lake_bucket, last_day, today))]
+    weather = stages[-1].name
+
+    # Create the summary table, only for the changed months once it has been built by month
+    if last_day is None or not summary_partitions:
+        stages += summary_table_stages(data_lake_bucket, summary_partitions, depends_on=[weather])
+    else:
+        stages.append(Stage("summary months", depends_on=[weather],
+                            run=lambda results: build_summary_incrementally(data_lake_bucket, results[weather])))
+    return stages
+
+
+def build_data_models(data_lake_bucket, full_rebuild=False):
+    today = datetime.now(timezone.utc).date()
+    last_day = None if full_rebuild else load_watermark(data_lake_bucket)
+    summary_partitions = list_glue_partitions("weather_monthly_site_summary", "lake")
+
+    run_stages(model_stages(data_lake_bucket, last_day, today, summary_partitions))
+    save_watermark(data_lake_bucket, today)
 
 
 def handler(event, context):
     try:
-        build_data_models(S3_DATA_LAKE_BUCKET)
+        build_data_models(S3_DATA_LAKE_BUCKET, full_rebuild=bool((event or {}).get("full_rebuild")))
         return {"statusCode": 200, "message": "Success"}
     except Exception as e:
         print("Failed to transform data")
@@ -0,0 +1,169 @@
+"""Runs the weather_data_model SQL locally, over NDJSON or Parquet files, with pandas.
+
+WEATHER_TABLE_SQL and SUMMARY_TABLE_SQL are replicated column-at-a-time: the Chivenor filter
+follows SQL three-valued logic, the hourly dedupe keeps the latest row per hour and site,
+and the summary percentiles return values from the data as approx_percentile does.
+
+    python -m weather_data_model.local_engine <incoming dir> <output dir>
+"""
+import json
+import os
+import sys
+import pandas as pd
+from .model_sql import WEATHER_COLUMNS
+
+STRING_COLUMNS = ("site_id", "site_name", "site_country", "site_continent", "wind_direction", "pressure_tendency")
+DOUBLE_COLUMNS = ("site_elevation", "lat", "lon", "screen_relative_humidity", "pressure", "wind_speed",
+                  "temperature", "dew_point")
+INT_COLUMNS = ("visibility", "weather_type")
+SUMMARY_COLUMNS = ("site_id", "site_name", "lat", "lon", "low_temp", "high_temp", "median_temp", "year", "month")
+SUMMARY_PERCENTILES = (("low_temp", 0.05), ("high_temp", 0.95), ("median_temp", 0.50))
+
+
+def _partition_values(path):
+    # Hive-style folders, e.g. weather/year=2026/month=2/day=11/observations.json.gz
+    return dict(part.split("=", 1) for part in path.split(os.sep) if "=" in part)
+
+
+def _read_file(path):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+
+    # Values are read as they are in the file, apply_schema does the casting
+    return pd.read_json(path, lines=True, compression="infer", dtype=False, convert_dates=False)
+
+
+def read_table(root):
+    """Every NDJSON (.json, .json.gz) and Parquet file under root, with partition folders as string columns"""
+    frames = []
+    for directory, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if not filename.endswith((".json", ".json.gz", ".parquet")):
+                continue
+            path = os.path.join(directory, filename)
+            frame = _read_file(path)
+            for column, value in _partition_values(os.path.relpath(path, root)).items():
+                frame[column] = value
+            frames.append(frame)
+
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def apply_schema(table):
+    """Cast to the incoming.weather column types. Invalid values become null, as with use.null.for.invalid.data"""
+    table = table.copy()
+    for column in WEATHER_COLUMNS:
+        if column not in table:
+            table[column] = None
+
+    table["observation_ts"] = pd.to_datetime(table["observation_ts"], errors="coerce")
+    for column in STRING_COLUMNS:
+        table[column] = table[column].astype("string")
+    for column in DOUBLE_COLUMNS:
+        table[column] = pd.to_numeric(table[column], errors="coerce").astype("float64")
+    for column in INT_COLUMNS:
+        values = pd.to_numeric(table[column], errors="coerce")
+        table[column] = values.where(values == values.round()).astype("Int64")
+    return table
+
+
+def _sql_compare(values, result):
+    # A comparison involving NULL is NULL, not False
+    result = pd.array(result, dtype="boolean")
+    result[pd.isna(values).to_numpy()] = pd.NA
+    return pd.Series(result, index=values.index)
+
+
+def _partition_column(incoming, column):
+    # Partition values from year=/month= folders, or from observation_ts for files outside them
+    if column in incoming:
+        return incoming[column].astype("string")
+    return getattr(incoming["observation_ts"].dt, column).astype("Int64").astype("string")
+
+
+def broken_readings_mask(incoming):
+    """BROKEN_READINGS_FILTER, evaluated with SQL NULL semantics. True where the row is kept"""
+    year = _partition_column(incoming, "year")
+    month = _partition_column(incoming, "month")
+    site_name = incoming["site_name"]
+    temperature = incoming["temperature"]
+
+    not_chivenor_july_2022 = (
+        _sql_compare(year, year != "2022") &
+        _sql_compare(month, month != "7") &
+        _sql_compare(site_name, site_name != "CHIVENOR")
+    )
+    keep = not_chivenor_july_2022 | _sql_compare(temperature, temperature > -5)
+
+    # WHERE only keeps rows where the condition is TRUE
+    return keep.fillna(False).astype(bool)
+
+
+def build_weather(incoming):
+    """WEATHER_TABLE_SQL: filter, then keep the latest observation per hour per site"""
+    incoming = apply_schema(incoming)
+    rows = incoming[broken_readings_mask(incoming)]
+
+    hour = rows["observation_ts"].dt.floor("h")
+    rows = rows.assign(_hour=hour).sort_values("observation_ts", ascending=False, kind="stable", na_position="last")
+    rows = rows.drop_duplicates(subset=["_hour", "site_id"], keep="first")
+
+    weather = rows.loc[:, list(WEATHER_COLUMNS)]
+    weather["year"] = weather["observation_ts"].dt.year.astype("Int64")
+    weather["month"] = weather["observation_ts"].dt.month.astype("Int64")
+    return _sorted(weather, ["site_id", "observation_ts"])
+
+
+def build_summary(weather):
+    """SUMMARY_TABLE_SQL: 5th, 95th and 50th temperature percentiles per site per month.
+
+    approx_percentile returns a value from the data, so the percentiles here do too.
+    """
+    keys = ["site_id", "site_name", "lat", "lon", "year", "month"]
+    grouped = weather.groupby(keys, dropna=False, sort=True)["temperature"]
+
+    summary = grouped.size().to_frame("_rows").drop(columns="_rows")
+    for column, q in SUMMARY_PERCENTILES:
+        summary[column] = grouped.quantile(q, interpolation="lower")
+
+    return _sorted(summary.reset_index().loc[:, list(SUMMARY_COLUMNS)], ["site_id", "year", "month"])
+
+
+def _sorted(table, keys):
+    return table.sort_values(keys, kind="stable", na_position="last").reset_index(drop=True)
+
+
+def to_ndjson(table):
+    """Canonical NDJSON for a table - sorted rows, nulls as null, timestamps as Athena prints them -
+    so local output can be compared with the same table exported from Athena"""
+    lines = []
+    for row in table.astype(object).where(table.notna(), None).to_dict(orient="records"):
+        for column, value in row.items():
+            if isinstance(value, pd.Timestamp):
+                row[column] = value.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        lines.append(json.dumps(row, sort_keys=True, separators=(",", ":")))
+    return "".join(line + "\n" for line in sorted(lines))
+
+
+def write_table(table, output_dir):
+    """Parquet partitioned by year and month, laid out as the lake tables are"""
+    table.to_parquet(output_dir, partition_cols=["year", "month"], index=False,
+                     existing_data_behavior="delete_matching")
+
+
+def build_lake(incoming_dir, output_dir):
+    weather = build_weather(read_table(incoming_dir))
+    summary = build_summary(weather)
+
+    write_table(weather, os.path.join(output_dir, "weather"))
+    write_table(summary, os.path.join(output_dir, "weather_monthly_site_summary"))
+    print(f"Built {len(weather)} weather rows and {len(summary)} summary rows in {output_dir}")
+    return weather, summary
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python -m weather_data_model.local_engine <incoming dir> <output dir>")
+        exit(1)
+
+    build_lake(sys.argv[1], sys.argv[2])
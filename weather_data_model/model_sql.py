@@ -0,0 +1,92 @@
+WEATHER_COLUMNS = (
+    "observation_ts",
+    "site_id",
+    "site_name",
+    "site_country",
+    "site_continent",
+    "site_elevation",
+    "lat",
+    "lon",
+    "wind_direction",
+    "screen_relative_humidity",
+    "pressure",
+    "wind_speed",
+    "temperature",
+    "visibility",
+    "weather_type",
+    "pressure_tendency",
+    "dew_point"
+)
+
+# year and month here are the incoming.weather partition columns, which are strings
+BROKEN_READINGS_FILTER = "(year <> '2022' and month <> '7' and site_name <> 'CHIVENOR' or temperature > -5)"
+
+WEATHER_TABLE_SQL = f'''
+insert into lake.weather
+select 
+    observation_ts,    
+    site_id,             
+    site_name,           
+    site_country,        
+    site_continent,      
+    site_elevation,      
+    lat,                 
+    lon,                 
+    wind_direction,      	
+    screen_relative_humidity,
+    pressure,            	
+    wind_speed,          	
+    temperature,         	
+    visibility,          	
+    weather_type,
+    pressure_tendency,
+    dew_point, 
+    obs_year as year,
+    obs_month as month	   
+from 
+( 
+    select 
+        observation_ts,    
+        site_id,             
+        site_name,           
+        site_country,        
+        site_continent,      
+        site_elevation,      
+        lat,                 
+        lon,                 
+        wind_direction,      	
+        screen_relative_humidity,
+        pressure,            	
+        wind_speed,          	
+        temperature,         	
+        visibility,          	
+        weather_type,
+        pressure_tendency,
+        dew_point, 
+        month(observation_ts) as obs_month,
+        year(observation_ts) as obs_year,
+        ROW_NUMBER() OVER ( PARTITION BY date_trunc('hour', observation_ts), site_id ORDER BY observation_ts DESC ) as rn
+    from incoming.weather
+    where {BROKEN_READINGS_FILTER} -- exclude broken readings from Chivenor
+)
+where rn = 1
+'''
+
+SUMMARY_MEASURES = """
+    approx_percentile(temperature, 0.05) as low_temp,
+    approx_percentile(temperature, 0.95) as high_temp,
+    approx_percentile(temperature, 0.50) as median_temp"""
+
+# The summary table is partitioned by year and month, which come last, as they do for lake.weather
+SUMMARY_TABLE_SQL = f'''
+insert into lake.weather_monthly_site_summary
+select 
+    site_id,
+    site_name,
+    lat,
+    lon,{SUMMARY_MEASURES},
+    YEAR(observation_ts) as year,
+    MONTH(observation_ts) as month
+from lake.weather
+group by site_id, site_name, lat, lon, YEAR(observation_ts), MONTH(observation_ts)
+'''
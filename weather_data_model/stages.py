@@ -0,0 +1,163 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from helpers.aws import delete_folder_from_s3, execute_athena_command, split_s3_location
+
+ATHENA_DATABASE = "lake"
+ATHENA_RESULTS_BUCKET = "dantelore.queryresults"
+ATHENA_WAIT_SECONDS = 120
+STAGE_MAX_CONCURRENCY = 4
+STAGE_ATTEMPTS = 2
+STAGE_RETRY_SECONDS = 5
+
+
+class Stage:
+    """One step of the model build.
+
+    A stage either runs its sql in Athena or calls run(results), where results holds the
+    return values of the stages it depends on. output_location is the S3 folder the stage
+    writes; it is cleared before a retry so a CREATE TABLE AS can be attempted again.
+    """
+
+    def __init__(self, name, run=None, sql=None, depends_on=(), output_location=None, attempts=STAGE_ATTEMPTS):
+        if (run is None) == (sql is None):
+            raise ValueError(f"Stage {name} needs exactly one of run or sql")
+        self.name = name
+        self.run = run
+        self.sql = sql
+        self.depends_on = tuple(depends_on)
+        self.output_location = output_location
+        self.attempts = attempts
+
+    def execute(self, results):
+        if self.sql is None:
+            return self.run({name: results[name] for name in self.depends_on})
+        if not execute_athena_command(self.sql, ATHENA_DATABASE, ATHENA_RESULTS_BUCKET, ATHENA_WAIT_SECONDS):
+            raise RuntimeError(f"Query for stage {self.name} failed")
+        return True
+
+    def clear_output(self):
+        if self.output_location:
+            _clear(self.output_location)
+
+    def __repr__(self):
+        return f"Stage({self.name!r})"
+
+
+def table_stages(table, sql, output_location, depends_on=(), drop_partitions=None):
+    """Stages that rebuild a table from scratch: clear its folder (and drop its partitions, if
+    given a function that does so) alongside everything else, then run its CREATE TABLE AS once
+    those and depends_on are done"""
+    stages = [Stage(f"clear {table}", run=lambda results: _clear(output_location))]
+    if drop_partitions:
+        stages.append(Stage(f"drop {table} partitions", run=lambda results: drop_partitions()))
+    stages.append(Stage(table, sql=sql, output_location=output_location,
+                        depends_on=[stage.name for stage in stages] + list(depends_on)))
+    return stages
+
+
+def _clear(output_location):
+    # Raises if any file is left behind, failing the stage so nothing is built on top of old data
+    bucket, prefix = split_s3_location(output_location)
+    count, _ = delete_folder_from_s3(bucket, prefix)
+    return count
+
+
+def _check_graph(stages):
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Duplicate stage {stage.name}")
+        by_name[stage.name] = stage
+
+    for stage in stages:
+        for dependency in stage.depends_on:
+            if dependency not in by_name:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dependency}")
+
+    # Kahn's algorithm - anything left over is on a cycle
+    remaining = {stage.name: set(stage.depends_on) for stage in stages}
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise ValueError(f"Stages {', '.join(sorted(remaining))} depend on each other")
+        for name in ready:
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+    return by_name
+
+
+def _run_stage(stage, results, sleep):
+    # Returns (result, error, seconds, attempts)
+    started = time.monotonic()
+    error = None
+    for attempt in range(1, stage.attempts + 1):
+        try:
+            if attempt > 1:
+                stage.clear_output()
+            return stage.execute(results), None, time.monotonic() - started, attempt
+        except Exception as e:
+            print(f"Stage {stage.name} failed on attempt {attempt} of {stage.attempts}: {e}")
+            error = e
+            if attempt < stage.attempts:
+                sleep(STAGE_RETRY_SECONDS)
+    return None, error, time.monotonic() - started, stage.attempts
+
+
+def run_stages(stages, max_concurrency=STAGE_MAX_CONCURRENCY, sleep=None):
+    """Run stages as soon as everything they depend on has finished, up to max_concurrency at once.
+
+    Independent stages overlap, so the build takes as long as its longest chain of stages rather
+    than the sum of them all. When a stage fails for good, the stages that depend on it are skipped,
+    the rest carry on, and a RuntimeError naming the failures is raised at the end.
+    Returns {stage name: return value}.
+    """
+    by_name = _check_graph(stages)
+    sleep = sleep or time.sleep
+    waiting = {stage.name: set(stage.depends_on) for stage in stages}
+    results = {}
+    failed = []
+    skipped = []
+    timings = {}
+
+    def skip_dependents(name):
+        for other, dependencies in list(waiting.items()):
+            if other in waiting and name in dependencies:
+                del waiting[other]
+                skipped.append(other)
+                skip_dependents(other)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        in_flight = {}
+
+        def start_ready():
+            for name, dependencies in list(waiting.items()):
+                if not dependencies and len(in_flight) < max_concurrency:
+                    del waiting[name]
+                    print(f"Starting stage {name}")
+                    in_flight[executor.submit(_run_stage, by_name[name], results, sleep)] = name
+
+        start_ready()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = in_flight.pop(future)
+                result, error, seconds, attempts = future.result()
+                timings[name] = seconds
+                if error is None:
+                    retried = f" after {attempts} attempts" if attempts > 1 else ""
+                    print(f"Stage {name} finished in {seconds:.1f}s{retried}")
+                    results[name] = result
+                    for dependencies in waiting.values():
+                        dependencies.discard(name)
+                else:
+                    print(f"Stage {name} failed after {seconds:.1f}s")
+                    failed.append(name)
+                    skip_dependents(name)
+            start_ready()
+
+    print("Stage timings: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items()))
+    if failed:
+        raise RuntimeError(f"Stages failed: {', '.join(failed)}" +
+                           (f" (skipped {', '.join(skipped)})" if skipped else ""))
+    return results